@@ -1,2 +1,3 @@
 from .memory_db import MemoryDatabase
 from .sqlite_db import SQLiteDatabase
+from .snapshot import RatingsSnapshot
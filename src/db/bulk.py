@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+"""Streams players and games between a database and CSV or JSON-lines files.
+
+Usage: python -m db.bulk (import|export) (players|games) <file.csv|file.jsonl> [database file]
+
+Everything is read and written through generators, so memory use stays constant no matter how
+many players or games are moved.
+"""
+
+import csv
+import itertools
+import json
+import sys
+import time
+
+from entities import Player, Game
+from .sqlite_db import SQLiteDatabase
+
+_json_string = json.encoder.encode_basestring_ascii
+
+PLAYER_FIELDS = ['name', 'rating', 'rd', 'volatility']
+GAME_FIELDS = ['game_id', 'timestamp', 'match_id', 'name', 'score', 'rating_delta', 'rating']
+
+def read_players_csv(file):
+	"""Yields the Players in a CSV file with a PLAYER_FIELDS header."""
+	for row in csv.DictReader(file):
+		yield Player(row['name'], rating=float(row['rating']), rd=float(row['rd']),
+		             volatility=float(row['volatility']))
+
+def write_players_csv(file, players):
+	"""Writes the Players to a CSV file, with a PLAYER_FIELDS header."""
+	writer = csv.writer(file)
+	writer.writerow(PLAYER_FIELDS)
+	writer.writerows((player.name, player.rating, player.rd, player.volatility) for player in players)
+
+def read_players_jsonl(file):
+	"""Yields the Players in a JSON-lines file, one object with PLAYER_FIELDS keys per line."""
+	for line in file:
+		if line.strip():
+			row = json.loads(line)
+			yield Player(row['name'], rating=row['rating'], rd=row['rd'], volatility=row['volatility'])
+
+def write_players_jsonl(file, players):
+	"""Writes the Players to a JSON-lines file, one object per line."""
+	# Formatting the (always finite) numbers directly is several times faster than json.dumps
+	file.writelines('{"name": %s, "rating": %r, "rd": %r, "volatility": %r}\n'
+	                % (_json_string(player.name), float(player.rating), float(player.rd),
+	                   float(player.volatility))
+	                for player in players)
+
+def read_games_csv(file):
+	"""
+	Yields the Games in a CSV file with a GAME_FIELDS header, one row per result.
+
+	Consecutive rows with the same game_id are one game. Rows without a game_id are told apart
+	by their timestamp instead.
+	"""
+	rows = csv.DictReader(file)
+	for (_, results) in itertools.groupby(rows, key=lambda row: (row['game_id'], row['timestamp'])):
+		results = list(results)
+		game_id = int(results[0]['game_id']) if results[0]['game_id'] else None
+		# Files exported before ratings were recorded have no rating column
+		yield Game([(row['name'], float(row['score']), float(row['rating_delta']),
+		             float(row['rating']) if row.get('rating') else None) for row in results],
+		           game_id=game_id, timestamp=float(results[0]['timestamp']),
+		           match_id=results[0].get('match_id') or None)
+
+def write_games_csv(file, games):
+	"""Writes the Games to a CSV file, with a GAME_FIELDS header and one row per result."""
+	writer = csv.writer(file)
+	writer.writerow(GAME_FIELDS)
+	writer.writerows((game.game_id, game.timestamp, game.match_id) + tuple(result)
+	                 for game in games for result in game.results)
+
+def read_games_jsonl(file):
+	"""Yields the Games in a JSON-lines file, one game object per line."""
+	for line in file:
+		if line.strip():
+			row = json.loads(line)
+			# Results exported before ratings were recorded are (name, score, rating_delta)
+			yield Game([tuple(result) if len(result) == 4 else tuple(result) + (None,)
+			            for result in row['results']],
+			           game_id=row.get('game_id'), timestamp=row['timestamp'],
+			           match_id=row.get('match_id'))
+
+def write_games_jsonl(file, games):
+	"""Writes the Games to a JSON-lines file, one game object per line."""
+	for game in games:
+		file.write(json.dumps({'game_id': game.game_id, 'timestamp': game.timestamp,
+		                       'match_id': game.match_id, 'results': game.results}) + '\n')
+
+_READERS = {('players', 'csv'): read_players_csv, ('players', 'jsonl'): read_players_jsonl,
+            ('games', 'csv'): read_games_csv, ('games', 'jsonl'): read_games_jsonl}
+_WRITERS = {('players', 'csv'): write_players_csv, ('players', 'jsonl'): write_players_jsonl,
+            ('games', 'csv'): write_games_csv, ('games', 'jsonl'): write_games_jsonl}
+
+def _file_format(path):
+	"""Guess the file format from the file extension."""
+	return 'csv' if path.endswith('.csv') else 'jsonl'
+
+def import_file(database, kind, path):
+	"""Streams the players or games (kind) in the file at path into the database, and commits."""
+	reader = _READERS[(kind, _file_format(path))]
+	with open(path, newline='') as file:
+		if kind == 'players':
+			database.import_players(reader(file))
+		else:
+			database.import_games(reader(file))
+	return database.commit()
+
+def export_file(database, kind, path):
+	"""Streams the players or games (kind) in the database out to the file at path."""
+	writer = _WRITERS[(kind, _file_format(path))]
+	with open(path, 'w', newline='') as file:
+		if kind == 'players':
+			writer(file, database.export_players())
+		else:
+			writer(file, database.export_games())
+
+def _main():
+	if len(sys.argv) < 4 or sys.argv[1] not in ('import', 'export') \
+			or sys.argv[2] not in ('players', 'games'):
+		print(__doc__)
+		sys.exit(1)
+
+	(command, kind, path) = sys.argv[1:4]
+	database = SQLiteDatabase(sys.argv[4] if len(sys.argv) > 4 else 'players.db')
+
+	start = time.perf_counter()
+	if command == 'import':
+		import_file(database, kind, path)
+	else:
+		export_file(database, kind, path)
+	print('%sed %s in %.2fs' % (command, kind, time.perf_counter() - start))
+
+if __name__ == '__main__':
+	_main()
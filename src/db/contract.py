@@ -0,0 +1,348 @@
+#! /usr/bin/env python3
+"""Checks that a database behaves the way DatabaseInterface promises.
+
+Usage: python -m db.contract (checks every database implementation)
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from entities import Player, PlayerStats, Game, RatingHistogram, get_matchup_outcomes
+from . import MemoryDatabase, SQLiteDatabase
+
+def _expect(actual, expected, what):
+	if actual != expected:
+		raise AssertionError('%s: expected %r, got %r' % (what, expected, actual))
+
+def check_players(database):
+	"""Check reading, updating, ranking and deleting players."""
+	_expect(database.read_player('Alice', create_if_not_found=False), None, 'missing player')
+	_expect(database.read_player('Alice').rating, 1000, 'new player rating')
+	_expect(database.count_players(), 0, 'read_player does not save new players')
+
+	for (name, rating) in [('Alice', 1200), ('Bob', 1400), ('Charlie', 1600), ('Dave', 1000)]:
+		database.update_player(Player(name, rating))
+	database.commit()
+	_expect(database.count_players(), 4, 'count_players')
+	_expect(database.read_player('aLiCe').name, 'Alice', 'case-insensitive lookup')
+	_expect([player and player.name for player in database.read_players(['bob', 'Eve', 'CHARLIE'])],
+	        ['Bob', None, 'Charlie'], 'read_players')
+
+	_expect([player.name for player in database.get_leaderboard(2, 1)], ['Bob', 'Alice'], 'leaderboard')
+	_expect([database.get_ranking(database.read_player(name)) for name in ['Charlie', 'Alice', 'Dave']],
+	        [1, 3, 4], 'get_ranking')
+	_expect(database.get_ranking(Player('Eve', 1300)), 3, 'get_ranking of an unsaved player')
+
+	bob = database.read_player('Bob')
+	bob.rating = 900
+	_expect(database.read_player('Bob').rating, 1400, 'changes are not saved until update_player')
+	database.update_player(bob).commit()
+	_expect([player.name for player in database.get_leaderboard(10)],
+	        ['Charlie', 'Alice', 'Dave', 'Bob'], 'leaderboard after update')
+
+	database.delete_player('Dave').commit()
+	_expect(database.read_player('Dave', create_if_not_found=False), None, 'deleted player')
+	_expect(database.count_players(), 3, 'count_players after delete')
+	_expect(sorted(player.name for player in database.export_players()),
+	        ['Alice', 'Bob', 'Charlie'], 'export_players')
+
+	database.import_players([Player('Alice', 1700), Player('Eve', 1100)]).commit()
+	_expect([player.name for player in database.get_leaderboard(10)],
+	        ['Alice', 'Charlie', 'Eve', 'Bob'], 'leaderboard after import')
+
+	imported = Player('Frank', 1300)
+	database.import_players([imported]).commit()
+	imported.rating = 2000
+	_expect(database.read_player('Frank').rating, 1300, 'import_players saves a copy')
+
+def check_games(database):
+	"""Check creating, fetching, importing and deleting games."""
+	first = Game([('Alice', 30.0, 5.0, 1005.0), ('Bob', 10.0, -5.0, 995.0)], timestamp=1.0,
+	             match_id='first')
+	database.create_game(first).commit()
+	_expect(first.game_id is not None, True, 'create_game sets the game id')
+	_expect((database.has_match('first'), database.has_match('other')), (True, False), 'has_match')
+
+	database.import_games([Game([('Bob', 20.0, 3.0, 998.0), ('Charlie', 5.0, -3.0, 997.0)],
+	                            timestamp=2.0),
+	                       Game([('Charlie', 9.0, 1.0, 998.0), ('Alice', 8.0, -1.0, 1004.0)],
+	                            timestamp=3.0, match_id='third')]).commit()
+	_expect([game.timestamp for game in database.get_games(10)], [3.0, 2.0, 1.0], 'get_games order')
+	_expect([game.timestamp for game in database.get_games(1, offset=1)], [2.0], 'get_games offset')
+	_expect([game.timestamp for game in database.get_games(10, player_name='Alice')], [3.0, 1.0],
+	        'get_games by player')
+	_expect(list(database.get_games(10, player_name='Nobody')), [], 'get_games of unknown player')
+	_expect([game.results for game in database.get_games(1)],
+	        [[('Charlie', 9.0, 1.0, 998.0), ('Alice', 8.0, -1.0, 1004.0)]], 'game results')
+	_expect([game.match_id for game in database.get_games(10)], ['third', None, 'first'],
+	        'game match ids')
+
+	database.delete_game(first.game_id).commit()
+	_expect(database.has_match('first'), False, 'has_match after delete')
+	_expect([game.timestamp for game in database.export_games()], [2.0, 3.0], 'export_games')
+	_expect([game.timestamp for game in database.get_games(10, player_name='Alice')], [3.0],
+	        'get_games by player after delete')
+
+def check_player_stats(database):
+	"""Check reading, updating and replacing player stats."""
+	_expect(database.read_player_stats(['Alice']), [None], 'missing stats')
+
+	alice = PlayerStats('Alice')
+	alice.record_game(1, 1010.0)
+	alice.record_game(2, 1005.0)
+	database.update_player_stats([alice, PlayerStats('Bob', games_played=3)]).commit()
+	(stored, bob, missing) = database.read_player_stats(['alice', 'Bob', 'Eve'])
+	_expect((stored.games_played, stored.wins, stored.placement_sum, stored.peak_rating,
+	         stored.streak, stored.best_streak), (2, 1, 3, 1010.0, -1, 1), 'stored stats')
+	_expect((bob.games_played, missing), (3, None), 'read_player_stats')
+
+	database.replace_player_stats([PlayerStats('Eve', games_played=7)]).commit()
+	_expect([stats and stats.games_played for stats in database.read_player_stats(['Alice', 'Eve'])],
+	        [None, 7], 'replace_player_stats')
+
+	database.update_player(Player('Eve')).delete_player('Eve').commit()
+	_expect(database.read_player_stats(['Eve']), [None], 'delete_player deletes stats')
+
+def check_head_to_head(database):
+	"""Check recording and fetching head-to-head records."""
+	_expect(database.get_head_to_head('Alice', 'Bob'), None, 'missing head-to-head')
+
+	database.update_head_to_head(get_matchup_outcomes(['Bob', 'Alice', 'Charlie'], [30, 20, 20]))
+	database.update_head_to_head(get_matchup_outcomes(['alice', 'bob'], [50, 10])).commit()
+
+	record = database.get_head_to_head('Alice', 'BOB')
+	_expect((record.wins, record.losses, record.draws), (1, 1, 0), 'head-to-head')
+	record = database.get_head_to_head('Charlie', 'Alice')
+	_expect((record.player, record.wins, record.losses, record.draws), ('Charlie', 0, 0, 1),
+	        'head-to-head from the second player\'s point of view')
+
+	rivals = database.get_rivals('alice', 5)
+	_expect([(record.opponent.lower(), record.get_games_played()) for record in rivals],
+	        [('bob', 2), ('charlie', 1)], 'get_rivals')
+	_expect(len(database.get_rivals('Alice', 1)), 1, 'get_rivals amount')
+
+	database.update_player(Player('Charlie')).delete_player('Charlie').commit()
+	_expect(database.get_head_to_head('Alice', 'Charlie'), None, 'delete_player deletes head-to-head')
+	_expect(len(database.get_rivals('Alice')), 1, 'get_rivals after delete')
+
+	database.replace_player_stats([]).commit()
+	_expect(database.get_head_to_head('Alice', 'Bob').wins, 1, 'replace_player_stats keeps head-to-head')
+
+	# Only ASCII letters are case-insensitive, as in SQLite
+	database.update_head_to_head(get_matchup_outcomes(['Zed', 'Éva'], [1, 0])).commit()
+	_expect(database.get_head_to_head('ÉVA', 'zed').losses, 1, 'head-to-head with non-ASCII names')
+	_expect(database.get_head_to_head('éva', 'Zed'), None, 'non-ASCII letters are case-sensitive')
+
+def check_compare_and_swap(database, other=None):
+	"""
+	Check that compare_and_swap_players refuses to overwrite changes made since players were read.
+
+	other -- a second connection to the same database (or None to use the same one)
+	"""
+	other = other if other is not None else database
+	(alice, bob) = (database.read_player('Alice'), database.read_player('Bob'))
+	_expect(database.compare_and_swap_players([alice, bob]), True, 'swap new players')
+	database.commit()
+	_expect((alice.version, database.read_player('alice').version), (1, 1), 'versions after swap')
+
+	stale_alice = other.read_player('Alice')
+	(alice.rating, bob.rating) = (1100, 900)
+	_expect(database.compare_and_swap_players([alice, bob]), True, 'swap read players')
+	database.commit()
+
+	stale_alice.rating = 1300
+	_expect(other.compare_and_swap_players([other.read_player('Charlie'), stale_alice]), False,
+	        'swap a player saved since they were read')
+	other.commit()
+	_expect((database.read_player('Alice').rating, database.read_player('Charlie', False)),
+	        (1100, None), 'a failed swap saves nothing')
+	_expect(other.compare_and_swap_players([Player('ALICE')]), False, 'swap a new player who exists')
+
+	database.update_player(Player('Bob', 1000)).commit()
+	_expect(database.read_player('Bob').version, 3, 'update_player increments the version')
+
+def _run_chunks(step):
+	"""Run a maintenance method over every player, two at a time."""
+	after = step(None, 2)
+	while after is not None:
+		after = step(after, 2)
+
+def check_maintenance(database):
+	"""Check decay, season archiving and soft resets, run in chunks."""
+	ratings = [('Alice', 1200), ('bob', 1400), ('Charlie', 1003), ('dave', 900), ('Eve', 1100)]
+	database.import_players([Player(name, rating) for (name, rating) in ratings])
+	database.update_player_stats([PlayerStats(name, games_played=1, last_played=last_played)
+	                              for (name, last_played) in [('Alice', 10.0), ('Bob', 50.0),
+	                                                          ('Charlie', 10.0), ('Dave', 10.0)]])
+	database.commit()
+	_expect(database.read_player_stats(['alice'])[0].last_played, 10.0, 'last_played')
+
+	_run_chunks(lambda after, amount: database.decay_ratings(20.0, 10, 1000, after, amount))
+	database.commit()
+	_expect([(player.name, player.rating) for player in database.get_leaderboard(10)],
+	        [('bob', 1400), ('Alice', 1190), ('Eve', 1100), ('Charlie', 1000), ('dave', 900)],
+	        'decay_ratings')
+	_expect(database.read_player('Alice').version, 2, 'decay_ratings increments versions')
+
+	_run_chunks(lambda after, amount: database.archive_standings('1', after, amount))
+	_run_chunks(lambda after, amount: database.soft_reset_ratings(1000, 0.5, after, amount))
+	database.commit()
+	_expect([(player.name, player.rating) for player in database.get_leaderboard(2)],
+	        [('bob', 1200), ('Alice', 1095)], 'soft_reset_ratings')
+	_expect(database.get_season_standings('1', 2, 1), [('Alice', 1190, 1), ('Eve', 1100, 0)],
+	        'get_season_standings')
+	_expect(database.get_season_standings('2'), [], 'get_season_standings of another season')
+
+	_expect(database.get_maintenance_state('season'), None, 'get_maintenance_state of a new job')
+	database.set_maintenance_state('season', {'season': '1', 'after': 'bob'}).commit()
+	_expect(database.get_maintenance_state('season'), {'season': '1', 'after': 'bob'},
+	        'get_maintenance_state')
+
+def _expect_histogram(database, what):
+	expected = RatingHistogram.from_ratings(player.rating for player in database.export_players())
+	_expect(database.get_rating_histogram().counts, expected.counts, what)
+
+def check_rating_histogram(database):
+	"""Check that the rating histogram follows every kind of change to players' ratings."""
+	_expect(database.get_rating_histogram().total, 0, 'empty histogram')
+	database.import_players([Player('Alice', 1200), Player('Bob', 1400), Player('Charlie', 900)])
+	database.commit()
+	_expect_histogram(database, 'histogram after import')
+
+	database.update_player(Player('Alice', 1450)).update_player(Player('Dave', 5000)).commit()
+	_expect_histogram(database, 'histogram after update')
+	_expect(database.get_rating_histogram().get_top_fraction(1450), 0.5, 'get_top_fraction')
+
+	database.compare_and_swap_players([Player('Eve', -50)])
+	database.delete_player('Charlie').commit()
+	_expect_histogram(database, 'histogram after delete')
+
+	_run_chunks(lambda after, amount: database.soft_reset_ratings(1000, 0.5, after, amount))
+	database.commit()
+	_expect_histogram(database, 'histogram after soft reset')
+	_expect(database.get_rating_histogram().total, 4, 'histogram total')
+
+def check_deferred_indexes(db_file, own_connection=False):
+	"""
+	Check that an SQLiteDatabase opened with defer_indexes builds what was missing later (with
+	create_indexes_on_own_connection if own_connection, otherwise create_indexes).
+	"""
+	database = SQLiteDatabase(db_file)
+	database.import_players([Player('Alice', 1200), Player('Bob', 1400)])
+	# As if made by an older version: no name index, and no rating index
+	database.conn.execute('DELETE FROM name_trigrams')
+	database.conn.execute('DROP INDEX players_rating')
+	database.commit()
+
+	database = SQLiteDatabase(db_file, defer_indexes=True)
+	database.update_player(Player('Charlie', 1000))
+	database.commit()
+	_expect(database.get_ranking(database.read_player('Bob')), 1, 'ranking before create_indexes')
+	if own_connection:
+		database.create_indexes_on_own_connection()
+	else:
+		database.create_indexes()
+	indexes = set(row[0] for row in database.conn.execute("SELECT name FROM sqlite_master "
+	                                                      "WHERE type = 'index'"))
+	_expect('players_rating' in indexes, True, 'create_indexes creates missing indexes')
+	_expect(database.search_players('Alice')[:1], ['Alice'],
+	        'create_indexes rebuilds the name index, even after players were saved')
+
+def _schema(database):
+	return sorted(database.conn.execute("SELECT type, name FROM sqlite_master "
+	                                    "WHERE type IN ('index', 'trigger')").fetchall())
+
+def check_failed_import(database):
+	"""Check that an SQLiteDatabase bulk import which fails keeps its indexes and triggers."""
+	database.import_players([Player('Alice', 1200)]).commit()
+	schema = _schema(database)
+
+	def failing_players():
+		yield Player('Bob', 1400)
+		raise ValueError('bad row')
+	try:
+		database.import_players(failing_players())
+	except ValueError:
+		pass
+	_expect(_schema(database), schema, 'indexes and triggers after a failed import')
+	_expect(database.read_player('Bob', create_if_not_found=False), None,
+	        'a failed import saves nothing')
+
+def check_old_schema(db_file):
+	"""
+	Check that players saved before the players table had versions can still be rated, and that
+	stats saved before last_played was kept get it from the games.
+	"""
+	conn = sqlite3.connect(db_file)
+	conn.execute('CREATE TABLE players (name TEXT PRIMARY KEY, rating REAL)')
+	conn.execute("INSERT INTO players VALUES('Alice', 1100.0)")
+	conn.execute('CREATE TABLE games (id INTEGER PRIMARY KEY, timestamp REAL)')
+	conn.execute('CREATE TABLE game_results '
+	             '(game_id INTEGER, name TEXT, score REAL, rating_delta REAL)')
+	conn.execute('CREATE TABLE player_stats (name TEXT PRIMARY KEY COLLATE NOCASE, '
+	             'games_played INTEGER, wins INTEGER, placement_sum INTEGER, peak_rating REAL, '
+	             'streak INTEGER, best_streak INTEGER)')
+	conn.executemany('INSERT INTO games VALUES(?, ?)', [(1, 10.0), (2, 20.0)])
+	conn.executemany('INSERT INTO game_results VALUES(?, ?, ?, ?)',
+	                 [(1, 'alice', 5.0, 1.0), (2, 'Alice', 5.0, 1.0), (2, 'Bob', 1.0, -1.0)])
+	conn.execute("INSERT INTO player_stats VALUES('Alice', 2, 2, 2, 1100.0, 2, 2)")
+	conn.commit()
+	conn.close()
+
+	database = SQLiteDatabase(db_file)
+	alice = database.read_player('Alice', create_if_not_found=False)
+	_expect((alice.rating, alice.version), (1100.0, 1), 'migrated player')
+	alice.rating = 1110.0
+	_expect(database.compare_and_swap_players([alice]), True, 'compare_and_swap of a migrated player')
+	database.commit()
+	_expect(database.read_player('Alice').rating, 1110.0, 'migrated player after compare_and_swap')
+	_expect(database.read_player_stats(['Alice'])[0].last_played, 20.0, 'backfilled last_played')
+
+def check_database(make_database):
+	"""Run every check, each against a new empty database from make_database()."""
+	for check in (check_players, check_games, check_player_stats, check_head_to_head,
+	              check_compare_and_swap, check_maintenance, check_rating_histogram):
+		check(make_database())
+
+def _main():
+	with tempfile.TemporaryDirectory() as temp_dir:
+		databases = [('MemoryDatabase', MemoryDatabase),
+		             ('SQLiteDatabase', lambda: SQLiteDatabase(':memory:'))]
+		for (name, make_database) in databases:
+			check_database(make_database)
+			print('%s: ok' % name)
+
+		check_failed_import(SQLiteDatabase(':memory:'))
+		print('SQLiteDatabase failed bulk import: ok')
+
+		db_file = os.path.join(temp_dir, 'players.db')
+		check_compare_and_swap(SQLiteDatabase(db_file), SQLiteDatabase(db_file))
+		print('SQLiteDatabase compare and swap across connections: ok')
+
+		check_deferred_indexes(os.path.join(temp_dir, 'deferred.db'))
+		print('SQLiteDatabase deferred indexes: ok')
+		check_deferred_indexes(os.path.join(temp_dir, 'deferred_elsewhere.db'), own_connection=True)
+		print('SQLiteDatabase deferred indexes on their own connection: ok')
+
+		check_old_schema(os.path.join(temp_dir, 'old.db'))
+		print('SQLiteDatabase old schema: ok')
+
+		snapshot_dir = os.path.join(temp_dir, 'snapshot')
+		database = MemoryDatabase(snapshot_dir=snapshot_dir, snapshot_interval=0)
+		check_games(database)
+		check_head_to_head(database)
+		reloaded = MemoryDatabase(snapshot_dir=snapshot_dir)
+		_expect([game.timestamp for game in reloaded.export_games()], [2.0, 3.0], 'reloaded snapshot')
+		_expect(reloaded.read_player_stats(['Charlie'])[0].games_played, 2, 'reloaded player stats')
+		_expect([(rival.opponent, rival.get_games_played()) for rival in reloaded.get_rivals('Alice')],
+		        [('Bob', 2)], 'reloaded head-to-head')
+		reloaded = MemoryDatabase(snapshot_dir=snapshot_dir, snapshot_interval=0)
+		_expect(len(list(reloaded.export_games())), 2, 'reloading does not overwrite the snapshot')
+		empty_dir = os.path.join(temp_dir, 'empty')
+		os.makedirs(empty_dir)
+		_expect(MemoryDatabase(snapshot_dir=empty_dir).count_players(), 0, 'empty snapshot_dir')
+		print('MemoryDatabase snapshot reload: ok')
+
+if __name__ == '__main__':
+	_main()
@@ -1,42 +1,365 @@
 #! /usr/bin/env python3
 """Fetches and stores player information."""
 
+import bisect
+import copy
+import json
+import os
+import time
+
 from model import DatabaseInterface
-from entities import Player
+from entities import Player, HeadToHead, RatingHistogram, compute_player_stats, combine_outcomes
+from entities import fold_name
+from . import bulk
+from .name_index import TrigramIndex
 
 class MemoryDatabase(DatabaseInterface):
-	"""Uses an in-memory python dict to store data."""
-	def __init__(self):
+	"""
+	Uses in-memory python data structures to store data.
+
+	Players are looked up by lowercased name, and also kept in a list of (-rating, lowercased name)
+	sorted by rating, so rankings and leaderboard pages are found by binary search. Names are also
+	indexed by trigram for fuzzy search, and each player's games by (lowercased) name.
+
+	If snapshot_dir is given, the data is loaded from it on start-up, and written back to it on
+	commit, at most once every snapshot_interval seconds.
+	"""
+	def __init__(self, snapshot_dir=None, snapshot_interval=60.0):
 		self.players = {}
+		self.rating_index = []
+		self.rating_histogram = RatingHistogram()
+		self.name_index = TrigramIndex()
+		self.player_stats = {}
+		self.head_to_head = {}
+		self.opponents = {}
+		self.season_standings = {}
+		self.maintenance_state = {}
+		self.sorted_names = None
+		self.games = {}
+		self.match_ids = set()
+		self.game_ids = []
+		self.player_games = {}
+		self.next_game_id = 1
+
+		self.snapshot_dir = snapshot_dir
+		self.snapshot_interval = snapshot_interval
+		self.last_snapshot = time.monotonic()
+		self.loading_snapshot = False
 		DatabaseInterface.__init__(self)
 
+		if snapshot_dir is not None:
+			self.load_snapshot()
+
 	def read_player(self, name, create_if_not_found=True):
-		if name not in self.players:
-			if not create_if_not_found:
-				return None
-			player = Player(name)
-			self.players[name] = player
-		return self.players[name]
+		player = self.players.get(name.lower())
+		if player is not None:
+			return copy.copy(player)
+
+		if not create_if_not_found:
+			return None
+		return Player(name)
+
+	def read_players(self, names):
+		return [self.read_player(name, create_if_not_found=False) for name in names]
 
 	def update_player(self, player):
-		self.players[player.name] = player
+		previous = self._remove_player(player.name)
+		self._rename_in_index(previous, player.name)
+		stored = copy.copy(player)
+		stored.version = previous.version + 1 if previous is not None else 1
+		self.players[player.name.lower()] = stored
+		if previous is None:
+			self.sorted_names = None
+		bisect.insort(self.rating_index, MemoryDatabase._rating_key(stored))
+		self.rating_histogram.add(stored.rating)
 		return self
 
+	def compare_and_swap_players(self, players):
+		for player in players:
+			stored = self.players.get(player.name.lower())
+			if (stored.version if stored is not None else 0) != player.version:
+				return False
+		for player in players:
+			self.update_player(player)
+			player.version += 1
+		return True
+
 	def delete_player(self, name):
-		del self.players[name]
+		stored = self._remove_player(name)
+		if stored is not None:
+			self.name_index.remove(stored.name)
+			self.sorted_names = None
+		self.player_stats.pop(name.lower(), None)
+		for opponent in self.opponents.pop(fold_name(name), ()):
+			self.opponents[opponent].discard(fold_name(name))
+			self.head_to_head.pop(tuple(sorted((fold_name(name), opponent))))
+		return self
+
+	def decay_ratings(self, inactive_since, decay, floor, after=None, amount=5000):
+		chunk = self._chunk(after, amount)
+		for lower_name in chunk:
+			stats = self.player_stats.get(lower_name)
+			player = self.players[lower_name]
+			if stats is not None and stats.last_played is not None \
+			   and stats.last_played < inactive_since and player.rating > floor:
+				player = copy.copy(player)
+				player.rating = max(floor, player.rating - decay)
+				self.update_player(player)
+		return chunk[-1] if chunk else None
+
+	def soft_reset_ratings(self, center, factor, after=None, amount=5000):
+		chunk = self._chunk(after, amount)
+		for lower_name in chunk:
+			player = copy.copy(self.players[lower_name])
+			player.rating = center + (player.rating - center) * factor
+			self.update_player(player)
+		return chunk[-1] if chunk else None
+
+	def archive_standings(self, season, after=None, amount=5000):
+		chunk = self._chunk(after, amount)
+		standings = self.season_standings.setdefault(season, {})
+		for lower_name in chunk:
+			(player, stats) = (self.players[lower_name], self.player_stats.get(lower_name))
+			standings[lower_name] = (player.name, player.rating,
+			                         stats.games_played if stats is not None else 0)
+		return chunk[-1] if chunk else None
+
+	def get_season_standings(self, season, amount=20, offset=0):
+		standings = sorted(self.season_standings.get(season, {}).values(),
+		                   key=lambda row: row[1], reverse=True)
+		return standings[offset:offset + amount]
+
+	def get_maintenance_state(self, job):
+		state = self.maintenance_state.get(job)
+		return json.loads(state) if state is not None else None
+
+	def set_maintenance_state(self, job, state):
+		self.maintenance_state[job] = json.dumps(state)
+		return self
+
+	def search_players(self, query, amount=10):
+		return self.name_index.search(query, amount)
+
+	def get_rating_histogram(self):
+		return self.rating_histogram
+
+	def get_ranking(self, player):
+		rating = player.get_rating()
+		count = bisect.bisect_left(self.rating_index, (-rating,))
+		stored = self.players.get(player.name.lower())
+		if stored is not None and stored.rating > rating:
+			count -= 1
+		return count + 1
+
+	def count_players(self):
+		return len(self.players)
+
+	def get_leaderboard(self, amount=20, offset=0):
+		for (_, lower_name) in self.rating_index[offset:offset + amount]:
+			yield copy.copy(self.players[lower_name])
+
+	def read_player_stats(self, names):
+		return [copy.copy(self.player_stats.get(name.lower())) for name in names]
+
+	def update_player_stats(self, stats):
+		for player_stats in stats:
+			self.player_stats[player_stats.name.lower()] = copy.copy(player_stats)
+		return self
+
+	def replace_player_stats(self, stats):
+		self.player_stats = {}
+		return self.update_player_stats(stats)
+
+	def update_head_to_head(self, outcomes):
+		for (key, delta) in combine_outcomes(outcomes).items():
+			if key not in self.head_to_head:
+				self._add_head_to_head(key, copy.copy(delta))
+			else:
+				record = self.head_to_head[key]
+				record.wins += delta.wins
+				record.losses += delta.losses
+				record.draws += delta.draws
 		return self
 
-	def get_leaderboard(self, amount, offset=0):
-		pass #TODO
+	def get_head_to_head(self, name1, name2):
+		(folded1, folded2) = (fold_name(name1), fold_name(name2))
+		record = self.head_to_head.get((min(folded1, folded2), max(folded1, folded2)))
+		if record is None:
+			return None
+		return copy.copy(record) if fold_name(record.player) == folded1 else record.reversed()
+
+	def get_rivals(self, name, amount=5):
+		records = [self.get_head_to_head(name, opponent)
+		           for opponent in self.opponents.get(fold_name(name), ())]
+		records.sort(key=lambda record: record.get_games_played(), reverse=True)
+		return records[:amount]
 
 	def create_game(self, game):
-		pass #TODO
+		if game.game_id is None:
+			game.game_id = self.next_game_id
+		self.next_game_id = max(self.next_game_id, game.game_id + 1)
+
+		self.games[game.game_id] = game
+		if game.match_id is not None:
+			self.match_ids.add(game.match_id)
+		MemoryDatabase._insert_id(self.game_ids, game.game_id)
+		for name in game.get_player_names():
+			MemoryDatabase._insert_id(self.player_games.setdefault(name.lower(), []), game.game_id)
+		return self
+
+	def has_match(self, match_id):
+		return match_id in self.match_ids
 
 	def delete_game(self, game_id):
-		pass #TODO
+		game = self.games.pop(game_id)
+		self.match_ids.discard(game.match_id)
+		self.game_ids.remove(game_id)
+		for name in game.get_player_names():
+			self.player_games[name.lower()].remove(game_id)
+		return self
 
 	def get_games(self, amount, offset=0, player_name=None):
-		pass #TODO
+		if player_name is None:
+			game_ids = self.game_ids
+		else:
+			game_ids = self.player_games.get(player_name.lower(), [])
+		end = len(game_ids) - offset
+		for game_id in reversed(game_ids[max(end - amount, 0):max(end, 0)]):
+			yield self.games[game_id]
+
+	def import_players(self, players):
+		# The spelling each imported name was saved with before, so the index is updated once at the end
+		saved_names = {}
+		for player in players:
+			previous = self.players.get(player.name.lower())
+			saved_names.setdefault(player.name.lower(), previous.name if previous is not None else None)
+			stored = copy.copy(player)
+			stored.version = previous.version + 1 if previous is not None else 1
+			self.players[player.name.lower()] = stored
+		new_names = []
+		for key, saved_name in saved_names.items():
+			name = self.players[key].name
+			if name != saved_name:
+				if saved_name is not None:
+					self.name_index.remove(saved_name)
+				new_names.append(name)
+		self.name_index.add_many(new_names)
+		self.sorted_names = None
+		self.rating_index = sorted(MemoryDatabase._rating_key(player)
+		                           for player in self.players.values())
+		self.rating_histogram = RatingHistogram.from_ratings(player.rating
+		                                                     for player in self.players.values())
+		return self
+
+	def export_players(self):
+		yield from list(self.players.values())
+
+	def import_games(self, games):
+		for game in games:
+			self.create_game(game)
+		return self
+
+	def export_games(self):
+		for game_id in list(self.game_ids):
+			yield self.games[game_id]
 
 	def commit(self):
+		# Committing while loading a snapshot would overwrite the parts not loaded yet
+		if self.snapshot_dir is None or self.loading_snapshot:
+			return self
+		if time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+			self.write_snapshot()
 		return self
+
+	def get_profile_report(self):
+		return None
+
+	def load_snapshot(self):
+		"""
+		Load the players, games and head-to-head records saved in snapshot_dir, if any (and rebuild
+		player stats from the games). No snapshot is written while loading.
+		"""
+		self.loading_snapshot = True
+		try:
+			for kind in ('players', 'games'):
+				path = os.path.join(self.snapshot_dir, kind + '.jsonl')
+				if os.path.isfile(path):
+					bulk.import_file(self, kind, path)
+			self.replace_player_stats(compute_player_stats(self.export_games()).values())
+			path = os.path.join(self.snapshot_dir, 'head_to_head.jsonl')
+			if os.path.isfile(path):
+				self._load_head_to_head(path)
+		finally:
+			self.loading_snapshot = False
+		return self
+
+	def write_snapshot(self):
+		"""Save every player, game and head-to-head record to snapshot_dir, replacing the last one."""
+		os.makedirs(self.snapshot_dir, exist_ok=True)
+		for kind in ('players', 'games', 'head_to_head'):
+			path = os.path.join(self.snapshot_dir, kind + '.jsonl')
+			if kind == 'head_to_head':
+				self._write_head_to_head(path + '.tmp')
+			else:
+				bulk.export_file(self, kind, path + '.tmp')
+			os.replace(path + '.tmp', path)
+		self.last_snapshot = time.monotonic()
+		return self
+
+	def _load_head_to_head(self, path):
+		"""Replace the head-to-head records with those in a file written by _write_head_to_head."""
+		(self.head_to_head, self.opponents) = ({}, {})
+		with open(path, encoding='utf-8') as file:
+			for line in file:
+				if line.strip():
+					record = HeadToHead(*json.loads(line))
+					self._add_head_to_head((fold_name(record.player), fold_name(record.opponent)), record)
+
+	def _write_head_to_head(self, path):
+		"""Write every head-to-head record, as JSON-lines [player, opponent, wins, losses, draws]."""
+		with open(path, 'w', encoding='utf-8') as file:
+			file.writelines(json.dumps([record.player, record.opponent, record.wins, record.losses,
+			                            record.draws]) + '\n'
+			                for record in self.head_to_head.values())
+
+	def _add_head_to_head(self, key, record):
+		self.head_to_head[key] = record
+		self.opponents.setdefault(key[0], set()).add(key[1])
+		self.opponents.setdefault(key[1], set()).add(key[0])
+
+	@staticmethod
+	def _rating_key(player):
+		return (-player.rating, player.name.lower())
+
+	@staticmethod
+	def _insert_id(game_ids, game_id):
+		"""Insert into a sorted list of ids, cheaply in the usual case of a new highest id."""
+		if len(game_ids) == 0 or game_ids[-1] < game_id:
+			game_ids.append(game_id)
+		else:
+			bisect.insort(game_ids, game_id)
+
+	def _chunk(self, after, amount):
+		"""Returns the next <amount> lowercased names, in order, after the lowercased name <after>."""
+		# Sorted once for a whole maintenance job, as ratings change but not who the players are
+		if self.sorted_names is None:
+			self.sorted_names = sorted(self.players)
+		start = bisect.bisect_right(self.sorted_names, after) if after is not None else 0
+		return self.sorted_names[start:start + amount]
+
+	def _rename_in_index(self, previous, name):
+		"""Index a saved player's name, replacing the spelling it was saved with before (if any)."""
+		if previous is not None and previous.name == name:
+			return
+		if previous is not None:
+			self.name_index.remove(previous.name)
+		self.name_index.add(name)
+
+	def _remove_player(self, name):
+		"""Remove a player (if they exist) from the players dict and the rating index, returning them."""
+		stored = self.players.pop(name.lower(), None)
+		if stored is not None:
+			key = MemoryDatabase._rating_key(stored)
+			del self.rating_index[bisect.bisect_left(self.rating_index, key)]
+			self.rating_histogram.remove(stored.rating)
+		return stored
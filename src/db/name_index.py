@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+"""Fuzzy player name search, by comparing the trigrams (3-letter substrings) of names."""
+
+import heapq
+from operator import itemgetter
+
+# Candidate names are found by the query's rarest trigrams, reading at most this many names in all
+# (so a fragment whose trigrams are in most names stays fast), plus the rarest trigram in any case
+MAX_SCANNED_NAMES = 20000
+
+# How many candidates (sharing the most of those trigrams) are ranked for each result wanted
+CANDIDATES_PER_RESULT = 5
+
+def trigrams(name):
+	"""Returns the set of trigrams in a name, lowercased, padded like PostgreSQL's pg_trgm."""
+	padded = '  %s ' % name.lower()
+	return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def choose_search_trigrams(counts):
+	"""
+	Returns the trigrams to find candidate names by: the rarest, while they are in at most
+	MAX_SCANNED_NAMES names in all (but always at least the rarest one).
+
+	counts -- dict of the query's trigrams -> the number of names containing them
+	"""
+	chosen = []
+	scanned = 0
+	for trigram in sorted(counts, key=counts.get):
+		if chosen and scanned + counts[trigram] > MAX_SCANNED_NAMES:
+			break
+		chosen.append(trigram)
+		scanned += counts[trigram]
+	return chosen
+
+def rank_matches(query, candidates, amount):
+	"""
+	Sort the candidate names by how well they match the query, best first.
+
+	Names are ranked by the fraction of the query's trigrams they contain, then by their overall
+	similarity (shared trigrams over all trigrams), so both fragments and typos find their names.
+
+	candidates -- iterable of names
+	returns up to <amount> names
+	"""
+	query_trigrams = trigrams(query)
+	query_size = len(query_trigrams)
+	scored = []
+	for name in candidates:
+		name_trigrams = trigrams(name)
+		shared = len(query_trigrams & name_trigrams)
+		similarity = shared / (query_size + len(name_trigrams) - shared)
+		scored.append((-shared / query_size, -similarity, name))
+	scored.sort()
+	return [name for (_, _, name) in scored[:amount]]
+
+class TrigramIndex:
+	"""An in-memory index of names by trigram."""
+	def __init__(self):
+		self.names = {}
+
+	def add(self, name):
+		"""Add a name to the index (ignored if it is already there)."""
+		for trigram in trigrams(name):
+			self.names.setdefault(trigram, set()).add(name)
+
+	def add_many(self, names):
+		"""Add many names (like add, but with the trigrams worked out inline, for bulk imports)."""
+		index = self.names
+		for name in names:
+			padded = '  %s ' % name.lower()
+			for i in range(len(padded) - 2):
+				trigram = padded[i:i + 3]
+				trigram_names = index.get(trigram)
+				if trigram_names is None:
+					index[trigram] = {name}
+				else:
+					trigram_names.add(name)
+
+	def remove(self, name):
+		"""Remove a name from the index."""
+		for trigram in trigrams(name):
+			names = self.names.get(trigram)
+			if names is not None:
+				names.discard(name)
+				if len(names) == 0:
+					del self.names[trigram]
+
+	def search(self, query, amount=10):
+		"""Returns up to <amount> names which best match the query, best first."""
+		counts = {trigram: len(self.names[trigram]) for trigram in trigrams(query)
+		          if trigram in self.names}
+		shared = {}
+		for trigram in choose_search_trigrams(counts):
+			for name in self.names[trigram]:
+				shared[name] = shared.get(name, 0) + 1
+		candidates = heapq.nlargest(amount * CANDIDATES_PER_RESULT, shared.items(), key=itemgetter(1))
+		return rank_matches(query, (name for (name, _) in candidates), amount)
@@ -0,0 +1,199 @@
+#! /usr/bin/env python3
+"""Profiles the statements run on an SQLite connection, to find what makes the database slow."""
+
+import contextlib
+import re
+import sqlite3
+import time
+
+# Statements taking at least this long (in seconds) have their query plan captured
+SLOW_STATEMENT_SECONDS = 0.01
+
+# The progress handler is called every this many SQLite virtual machine instructions
+PROGRESS_INTERVAL = 1000
+
+# Only these statements can be explained (not BEGIN, COMMIT, PRAGMA, CREATE, ...)
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+# A bound NULL (but not IS NULL, which is part of the statement)
+_NULL_PARAMETER = re.compile(r'([(,=<>]\s*)NULL\b')
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w.])')
+_PARAMETER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_sql(sql):
+	"""
+	Returns the statement with its literals replaced by ?, lists of parameters (e.g. for IN)
+	collapsed to one, and whitespace collapsed, so that every run of it is counted together.
+	"""
+	sql = _STRING_LITERAL.sub('?', sql)
+	sql = _NUMBER_LITERAL.sub('?', sql)
+	sql = _NULL_PARAMETER.sub(r'\1?', sql)
+	sql = _PARAMETER_LIST.sub('?, ...', sql)
+	return _WHITESPACE.sub(' ', sql).strip().rstrip(';')
+
+class StatementStats:
+	"""
+	The time spent in one (normalized) statement.
+
+	calls -- the number of timed calls (one executemany is one call)
+	executions -- the number of times SQLite ran it (from the trace callback, including every row
+		of an executemany, and statements run outside of the timers). SQLite traces a trigger with
+		the text of the statement that fired it, so this also counts the triggers it fired.
+	steps -- roughly how many virtual machine instructions it took (from the progress handler)
+	"""
+	def __init__(self, sql):
+		self.sql = sql
+		self.calls = 0
+		self.executions = 0
+		self.steps = 0
+		self.total_time = 0.0
+		self.max_time = 0.0
+		self.plan = None
+
+	def add_call(self, elapsed):
+		self.calls += 1
+		self.total_time += elapsed
+		self.max_time = max(self.max_time, elapsed)
+
+	def get_mean_time(self):
+		return self.total_time / self.calls if self.calls > 0 else 0.0
+
+class SQLiteProfiler:
+	"""
+	Aggregates the time, executions and work of each statement run on a connection.
+
+	The database times its own calls with timed(), and the connection's trace callback and progress
+	handler count every statement SQLite runs (whichever way it was executed). The query plan of a
+	statement is captured the first time a call to it is slow.
+	"""
+	def __init__(self, conn, slow_threshold=SLOW_STATEMENT_SECONDS,
+	             progress_interval=PROGRESS_INTERVAL):
+		self.conn = conn
+		self.slow_threshold = slow_threshold
+		self.progress_interval = progress_interval
+		self.stats = {}
+		self.current = None
+		self.paused = False
+		self.started = time.time()
+
+	def install(self):
+		self.conn.set_trace_callback(self._trace)
+		self.conn.set_progress_handler(self._progress, self.progress_interval)
+		return self
+
+	def uninstall(self):
+		self.conn.set_trace_callback(None)
+		self.conn.set_progress_handler(None, self.progress_interval)
+
+	def reset(self):
+		self.stats = {}
+		self.current = None
+		self.started = time.time()
+
+	@contextlib.contextmanager
+	def timed(self, sql, params=None):
+		"""Time a call running the given statement (params are used to explain it, if it is slow)."""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			stats = self._get_stats(sql)
+			stats.add_call(elapsed)
+			if elapsed >= self.slow_threshold and stats.plan is None:
+				stats.plan = self._explain(sql, params)
+
+	def get_stats(self):
+		"""Returns every statement's StatementStats, the most total time first."""
+		return sorted(self.stats.values(), key=lambda stats: (-stats.total_time, -stats.executions))
+
+	def report(self, amount=15):
+		"""Returns a text report of the <amount> statements taking the most time."""
+		all_stats = self.get_stats()
+		total_time = sum(stats.total_time for stats in all_stats)
+		lines = ['SQLite profile over %.0fs: %.3fs in %d timed calls, %d statements run' % (
+			time.time() - self.started, total_time, sum(stats.calls for stats in all_stats),
+			sum(stats.executions for stats in all_stats))]
+		lines.append('%9s %7s %8s %8s %8s %8s  %s' % ('total ms', 'calls', 'runs', 'mean ms',
+		                                               'max ms', 'ksteps', 'statement'))
+		for stats in all_stats[:amount]:
+			lines.append('%9.1f %7d %8d %8.3f %8.2f %8d  %s' % (
+				stats.total_time * 1000, stats.calls, stats.executions, stats.get_mean_time() * 1000,
+				stats.max_time * 1000, stats.steps * self.progress_interval // 1000, stats.sql[:80]))
+
+		slow = [stats for stats in all_stats[:amount] if stats.plan]
+		if slow:
+			lines.append('')
+			lines.append('Query plans of slow statements (at least %.0fms):'
+			             % (self.slow_threshold * 1000))
+		for stats in slow:
+			lines.append('%s (max %.2fms)' % (stats.sql, stats.max_time * 1000))
+			lines.extend('    ' + line for line in stats.plan)
+		return '\n'.join(lines)
+
+	def _get_stats(self, sql):
+		key = normalize_sql(sql)
+		stats = self.stats.get(key)
+		if stats is None:
+			stats = self.stats[key] = StatementStats(key)
+		return stats
+
+	def _trace(self, sql):
+		if self.paused:
+			return
+		# Triggers are traced as comments when their statement's text isn't available
+		if sql.startswith('--'):
+			return
+		self.current = self._get_stats(sql)
+		self.current.executions += 1
+
+	def _progress(self):
+		if self.current is not None and not self.paused:
+			self.current.steps += 1
+		# Returning a true value would abort the statement
+		return 0
+
+	def _explain(self, sql, params):
+		"""Returns the statement's query plan as a list of lines (None if it can't be explained)."""
+		if not sql.lstrip().upper().startswith(EXPLAINABLE):
+			return None
+		if not isinstance(params, (tuple, list)):
+			# Unknown (e.g. an executemany's rows): explain it for NULL parameters
+			params = (None,) * sql.count('?')
+
+		self.paused = True
+		try:
+			rows = self.conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+		except sqlite3.Error as exc:
+			return ['(could not explain: %s)' % exc]
+		finally:
+			self.paused = False
+
+		depths = {0: -1}
+		lines = []
+		for (node_id, parent_id, _, detail) in rows:
+			depths[node_id] = depths.get(parent_id, -1) + 1
+			lines.append('  ' * depths[node_id] + detail)
+		return lines
+
+def _main():
+	conn = sqlite3.connect(':memory:')
+	profiler = SQLiteProfiler(conn, slow_threshold=0).install()
+	conn.execute('CREATE TABLE players (name TEXT PRIMARY KEY, rating REAL)')
+	rows = [('player%d' % i, 1000 + i % 500) for i in range(20000)]
+	with profiler.timed('INSERT INTO players VALUES(?, ?)'):
+		conn.executemany('INSERT INTO players VALUES(?, ?)', rows)
+	for rating in (1100, 1200, 1300):
+		sql = 'SELECT COUNT(*) FROM players WHERE rating > ?'
+		with profiler.timed(sql, (rating,)):
+			conn.execute(sql, (rating,)).fetchone()
+	for name in ('player5', 'player77'):
+		sql = 'SELECT name, rating FROM players WHERE name LIKE ?'
+		with profiler.timed(sql, (name,)):
+			conn.execute(sql, (name,)).fetchone()
+	print(profiler.report())
+
+if __name__ == '__main__':
+	_main()
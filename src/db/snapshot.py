@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+"""Reads and writes compact, memory-mappable snapshots of every player's rating.
+
+A snapshot lets read-only worker processes answer leaderboard, ranking and lookup queries without
+opening SQLite, and without copying anything out of the file. The layout (little-endian) is:
+
+	header   -- magic, player count, name blob size (SNAPSHOT_HEADER)
+	records  -- (rating, player id) for every player, sorted by rating, highest first
+	offsets  -- player id -> start of their name in the blob (one extra entry for the end)
+	ranks    -- player id -> index of their record
+	names    -- utf-8 names, one after another, in case-insensitive order (so player ids are too)
+
+Each section starts on an 8-byte boundary.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from entities import Player
+
+SNAPSHOT_MAGIC = b'JRSNAP01'
+SNAPSHOT_HEADER = struct.Struct('<8sQQ')
+RECORD_DTYPE = np.dtype([('rating', '<f8'), ('id', '<u4')], align=True)
+
+def _padding(size):
+	return -size % 8
+
+def write_snapshot(path, rows):
+	"""
+	Writes a snapshot of the given players, atomically replacing any existing snapshot at path.
+
+	rows -- iterable of (name, rating)
+	"""
+	(names, ratings) = ([], [])
+	for (name, rating) in rows:
+		names.append(name)
+		ratings.append(rating)
+	ratings = np.array(ratings, dtype='<f8')
+	count = len(names)
+
+	lower_names = np.array([name.lower() for name in names], dtype=str)
+	name_order = np.argsort(lower_names, kind='stable')
+	player_ids = np.empty(count, dtype='<u4')
+	player_ids[name_order] = np.arange(count, dtype='<u4')
+
+	rating_order = np.argsort(-ratings, kind='stable')
+	records = np.zeros(count, dtype=RECORD_DTYPE)
+	records['rating'] = ratings[rating_order]
+	records['id'] = player_ids[rating_order]
+	ranks = np.empty(count, dtype='<u4')
+	ranks[records['id']] = np.arange(count, dtype='<u4')
+
+	encoded = [names[i].encode('utf-8') for i in name_order]
+	offsets = np.zeros(count + 1, dtype='<u8')
+	np.cumsum([len(name) for name in encoded], out=offsets[1:])
+	blob = b''.join(encoded)
+
+	temp_path = '%s.%d.tmp' % (path, os.getpid())
+	with open(temp_path, 'wb') as file:
+		file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, count, len(blob)))
+		for section in (records.tobytes(), offsets.tobytes(), ranks.tobytes()):
+			file.write(section)
+			file.write(b'\0' * _padding(len(section)))
+		file.write(blob)
+	os.replace(temp_path, path)
+
+class _LowerNames:
+	"""A read-only sequence of the snapshot's lowercased names, for bisect."""
+	def __init__(self, snapshot):
+		self.snapshot = snapshot
+
+	def __len__(self):
+		return self.snapshot.count
+
+	def __getitem__(self, player_id):
+		return self.snapshot.get_name(player_id).lower()
+
+class _NegatedRatings:
+	"""A read-only sequence of the snapshot's negated ratings (ascending), for bisect."""
+	def __init__(self, snapshot):
+		self.snapshot = snapshot
+
+	def __len__(self):
+		return self.snapshot.count
+
+	def __getitem__(self, index):
+		return -float(self.snapshot.records[index]['rating'])
+
+class RatingsSnapshot:
+	"""A read-only, memory-mapped view of a ratings snapshot."""
+	def __init__(self, path):
+		self.path = path
+		self.stat = None
+		self.count = 0
+		(self._file, self._mmap) = (None, None)
+		(self.records, self.offsets, self.ranks, self.names) = (None, None, None, None)
+		self.refresh()
+
+	def refresh(self):
+		"""Re-map the snapshot if it has been replaced since it was last mapped. Returns self."""
+		stat = os.stat(self.path)
+		if self.stat is not None and (stat.st_ino, stat.st_mtime_ns) == self.stat:
+			return self
+
+		self.close()
+		self._file = open(self.path, 'rb')
+		self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.stat = (stat.st_ino, stat.st_mtime_ns)
+
+		(magic, count, blob_size) = SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+		if magic != SNAPSHOT_MAGIC:
+			raise ValueError('%s is not a ratings snapshot' % self.path)
+
+		self.count = count
+		offset = SNAPSHOT_HEADER.size
+		self.records = np.frombuffer(self._mmap, dtype=RECORD_DTYPE, count=count, offset=offset)
+		offset += self.records.nbytes + _padding(self.records.nbytes)
+		self.offsets = np.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=offset)
+		offset += self.offsets.nbytes + _padding(self.offsets.nbytes)
+		self.ranks = np.frombuffer(self._mmap, dtype='<u4', count=count, offset=offset)
+		offset += self.ranks.nbytes + _padding(self.ranks.nbytes)
+		self.names = memoryview(self._mmap)[offset:offset + blob_size]
+		return self
+
+	def close(self):
+		"""Unmap the snapshot."""
+		if self._mmap is None:
+			return
+		# The numpy views must be released before the mmap can be closed
+		(self.records, self.offsets, self.ranks) = (None, None, None)
+		self.names.release()
+		self._mmap.close()
+		self._file.close()
+		(self._file, self._mmap, self.names) = (None, None, None)
+
+	def get_name(self, player_id):
+		"""Returns the name of the player with the given id."""
+		return str(self.names[int(self.offsets[player_id]):int(self.offsets[player_id + 1])], 'utf-8')
+
+	def find_player_id(self, name):
+		"""Returns the id of the player with the given name (case-insensitive), or None."""
+		lower_name = name.lower()
+		player_id = bisect.bisect_left(_LowerNames(self), lower_name)
+		if player_id < self.count and self.get_name(player_id).lower() == lower_name:
+			return player_id
+		return None
+
+	def read_player(self, name):
+		"""Returns the player with the given name (case-insensitive), or None if not found."""
+		player_id = self.find_player_id(name)
+		if player_id is None:
+			return None
+		record = self.records[self.ranks[player_id]]
+		return Player(self.get_name(player_id), rating=float(record['rating']))
+
+	def get_ranking(self, player):
+		"""Get the ranking of the player, the same way as SQLiteDatabase.get_ranking."""
+		# Binary search straight over the mapped records, without copying the rating column out
+		count = bisect.bisect_left(_NegatedRatings(self), -player.get_rating())
+		player_id = self.find_player_id(player.name)
+		if player_id is not None and self.records[self.ranks[player_id]]['rating'] > player.get_rating():
+			count -= 1
+		return count + 1
+
+	def get_leaderboard(self, amount=20, offset=0):
+		"""Fetch the top <amount> players by rating (offset by [offset])."""
+		for record in self.records[offset:offset + amount]:
+			yield Player(self.get_name(record['id']), rating=float(record['rating']))
+
+	def count_players(self):
+		"""Returns the number of players in the snapshot."""
+		return self.count
+
+class SnapshotWriter:
+	"""
+	Writes a database's snapshot in a background thread, at most once every min_interval seconds.
+
+	read_rows -- function returning the (name, rating) rows to snapshot, called in the writer's
+		thread (so it mustn't share the caller's SQLite connection)
+	"""
+	def __init__(self, path, read_rows, min_interval=10.0):
+		self.path = path
+		self.read_rows = read_rows
+		self.min_interval = min_interval
+		self.last_write = None
+		self.pending = False
+		self.closed = False
+		self.condition = threading.Condition()
+		self.thread = None
+
+	def request_write(self):
+		"""
+		Ask for a snapshot of what is committed now. It is written straight away if min_interval
+		has passed since the last one, or else once it has, so the last changes are never left out.
+		"""
+		with self.condition:
+			self.pending = True
+			if self.thread is None:
+				self.thread = threading.Thread(target=self._run, name='snapshot writer', daemon=True)
+				self.thread.start()
+			self.condition.notify()
+
+	def close(self):
+		"""Write any requested snapshot straight away, and stop the writer's thread."""
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		if self.thread is not None:
+			self.thread.join()
+
+	def _run(self):
+		while True:
+			with self.condition:
+				while not self.pending and not self.closed:
+					self.condition.wait()
+				if not self.pending:
+					return
+				if not self.closed and self.last_write is not None:
+					wait = self.last_write + self.min_interval - time.monotonic()
+					if wait > 0:
+						self.condition.wait(wait)
+						continue
+				self.pending = False
+
+			self.last_write = time.monotonic()
+			try:
+				write_snapshot(self.path, self.read_rows())
+			except Exception: #pylint: disable=broad-except
+				# Keep the thread going: the next commit asks for another snapshot
+				traceback.print_exc()
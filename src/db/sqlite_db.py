@@ -1,11 +1,96 @@
 #! /usr/bin/env python3
 """Fetches and stores player information."""
 
+import contextlib
+import itertools
+import json
 import sys
 import sqlite3
+import time
 
 from model import DatabaseInterface
-from entities import Player
+from entities import Player, PlayerStats, Game, HeadToHead, RatingHistogram, combine_outcomes
+from entities import fold_name
+from entities.rating_histogram import HISTOGRAM_LOW, BUCKET_WIDTH, NUM_BUCKETS
+from .name_index import CANDIDATES_PER_RESULT, choose_search_trigrams, trigrams, rank_matches
+from .profiler import SQLiteProfiler
+from .snapshot import SnapshotWriter
+
+# Stay under SQLite's default limit on host parameters in a single statement
+MAX_SQL_VARIABLES = 500
+
+PLAYER_COLUMNS = 'name,rating,rd,volatility,version'
+
+# Columns added to the players table since it was first created, with their definitions
+# (version 0 means a player not saved yet, so players saved before versions existed start at 1)
+PLAYER_COLUMN_MIGRATIONS = [('rd', 'REAL NOT NULL DEFAULT 350'),
+                            ('volatility', 'REAL NOT NULL DEFAULT 0.06'),
+                            ('version', 'INTEGER NOT NULL DEFAULT 1')]
+
+# Saves a player whatever their stored version, incrementing it
+PLAYER_UPSERT = 'INSERT INTO players(%s) VALUES(?, ?, ?, ?, 1) ON CONFLICT(name) DO UPDATE SET ' \
+                'rating=excluded.rating, rd=excluded.rd, volatility=excluded.volatility, ' \
+                'version=version + 1' % PLAYER_COLUMNS
+
+# Secondary indexes, which bulk imports drop and rebuild afterwards: name -> (table, definition)
+INDEXES = {'players_rating': ('players', 'players(rating)'),
+           'players_name_nocase': ('players', 'players(name COLLATE NOCASE)'),
+           'games_match_id': ('games', 'games(match_id)'),
+           'game_results_game': ('game_results', 'game_results(game_id)'),
+           'game_results_name': ('game_results', 'game_results(name, game_id)'),
+           'name_trigrams_name': ('name_trigrams', 'name_trigrams(name)'),
+           'head_to_head_player2': ('head_to_head', 'head_to_head(player2)'),
+           'season_standings_rating': ('season_standings', 'season_standings(season, rating)')}
+
+def _bucket_sql(rating):
+	"""SQL for the histogram bucket of a rating (the same as entities.get_bucket)."""
+	return 'MIN(MAX(CAST((%s - %d) / %d.0 AS INTEGER), 0), %d)' \
+	       % (rating, HISTOGRAM_LOW, BUCKET_WIDTH, NUM_BUCKETS - 1)
+
+# Triggers keeping the rating_histogram table up to date, which bulk imports drop and rebuild
+# afterwards: name -> (table, definition)
+TRIGGERS = {
+	'players_histogram_insert': ('players', 'AFTER INSERT ON players BEGIN UPDATE rating_histogram '
+	                             'SET count = count + 1 WHERE bucket = %s; END'
+	                             % _bucket_sql('NEW.rating')),
+	'players_histogram_update': ('players', 'AFTER UPDATE OF rating ON players '
+	                             'WHEN %s != %s BEGIN '
+	                             'UPDATE rating_histogram SET count = count - 1 WHERE bucket = %s; '
+	                             'UPDATE rating_histogram SET count = count + 1 WHERE bucket = %s; END'
+	                             % (_bucket_sql('OLD.rating'), _bucket_sql('NEW.rating'),
+	                                _bucket_sql('OLD.rating'), _bucket_sql('NEW.rating'))),
+	'players_histogram_delete': ('players', 'AFTER DELETE ON players BEGIN UPDATE rating_histogram '
+	                             'SET count = count - 1 WHERE bucket = %s; END'
+	                             % _bucket_sql('OLD.rating')),
+}
+
+PLAYER_STATS_COLUMNS = 'name,games_played,wins,placement_sum,peak_rating,streak,best_streak,' \
+                       'last_played'
+PLAYER_STATS_INSERT = 'INSERT OR REPLACE INTO player_stats(%s) VALUES(?, ?, ?, ?, ?, ?, ?, ?)' \
+                      % PLAYER_STATS_COLUMNS
+
+# Columns added to the player_stats table since it was first created, with their definitions
+PLAYER_STATS_COLUMN_MIGRATIONS = [('last_played', 'REAL')]
+
+# Columns added to the games table since it was first created, with their definitions
+GAME_COLUMN_MIGRATIONS = [('match_id', 'TEXT')]
+
+# Columns added to the game_results table since it was first created, with their definitions
+GAME_RESULT_COLUMN_MIGRATIONS = [('rating', 'REAL')]
+
+GAME_RESULTS_INSERT = 'INSERT INTO game_results(game_id, name, score, rating_delta, rating) ' \
+                      'VALUES(?, ?, ?, ?, ?)'
+GAME_INSERT = 'INSERT INTO games(id, timestamp, match_id) VALUES(?, ?, ?)'
+GAME_ROWS_SELECT = 'SELECT id, timestamp, match_id, name, score, rating_delta, rating FROM games ' \
+                   'JOIN game_results ON games.id = game_results.game_id'
+
+# The number of rows handed to each executemany call during bulk imports
+IMPORT_BATCH_SIZE = 50000
+
+# How many times to try taking the write lock while other connections keep it busy for longer
+# than the connection timeout, and the delay before the first retry (doubling after each one)
+LOCKED_ATTEMPTS = 5
+LOCKED_RETRY_DELAY = 0.1
 
 def dump(*args, **kwargs):
 	"""Alias for print and flush stdout."""
@@ -13,18 +98,93 @@ def dump(*args, **kwargs):
 	sys.stdout.flush()
 
 class SQLiteDatabase(DatabaseInterface):
-	"""Uses SQLite to store player information."""
-	def __init__(self, db_file):
+	"""
+	Uses SQLite to store player information.
+
+	snapshot_path -- if given (with a db_file, not ':memory:'), a RatingsSnapshot is kept there,
+		rewritten in the background after commits, at most once every snapshot_interval seconds
+	profile -- if True, time every statement with an SQLiteProfiler (see get_profile_report)
+	defer_indexes -- if True, leave creating any missing secondary indexes (and the name index, if
+		it is empty) until create_indexes() is called, as they can take a while on a large database
+	"""
+	def __init__(self, db_file, snapshot_path=None, snapshot_interval=10.0, profile=False,
+	             defer_indexes=False):
+		self.db_file = db_file
 		self.conn = sqlite3.connect(db_file)
+		self.snapshot_writer = None
+		self.histogram_cache = (None, None)
+		self.profiler = SQLiteProfiler(self.conn).install() if profile else None
+		if snapshot_path is not None:
+			self.snapshot_writer = SnapshotWriter(snapshot_path, lambda: _read_ratings(db_file),
+			                                      snapshot_interval)
+		if db_file != ':memory:':
+			# Let reads carry on while another connection writes (e.g. building indexes)
+			self._exec_sql('PRAGMA journal_mode=WAL')
 		self._exec_sql('CREATE TABLE IF NOT EXISTS players (name TEXT PRIMARY KEY, rating REAL)')
-		self.commit()
+		self._migrate_table('players', PLAYER_COLUMN_MIGRATIONS)
+		self._exec_sql('CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, timestamp REAL)')
+		self._migrate_table('games', GAME_COLUMN_MIGRATIONS)
+		self._exec_sql('CREATE TABLE IF NOT EXISTS game_results '
+		               '(game_id INTEGER, name TEXT, score REAL, rating_delta REAL)')
+		self._migrate_table('game_results', GAME_RESULT_COLUMN_MIGRATIONS)
+		self._exec_sql('CREATE TABLE IF NOT EXISTS player_stats (name TEXT PRIMARY KEY COLLATE NOCASE, '
+		               'games_played INTEGER, wins INTEGER, placement_sum INTEGER, peak_rating REAL, '
+		               'streak INTEGER, best_streak INTEGER)')
+		if 'last_played' in self._migrate_table('player_stats', PLAYER_STATS_COLUMN_MIGRATIONS):
+			self._backfill_last_played()
+		self._exec_sql('CREATE TABLE IF NOT EXISTS head_to_head (player1 TEXT COLLATE NOCASE, '
+		               'player2 TEXT COLLATE NOCASE, wins1 INTEGER, wins2 INTEGER, draws INTEGER, '
+		               'PRIMARY KEY (player1, player2)) WITHOUT ROWID')
+		self._exec_sql('CREATE TABLE IF NOT EXISTS name_trigrams '
+		               '(trigram TEXT, name TEXT, PRIMARY KEY (trigram, name)) WITHOUT ROWID')
+		self._exec_sql('CREATE TABLE IF NOT EXISTS season_standings (season TEXT, name TEXT, '
+		               'rating REAL, games_played INTEGER, PRIMARY KEY (season, name)) WITHOUT ROWID')
+		self._exec_sql('CREATE TABLE IF NOT EXISTS maintenance_state '
+		               '(job TEXT PRIMARY KEY, state TEXT) WITHOUT ROWID')
+		# Checked now, as players saved before create_indexes() add to the name index
+		self.name_index_empty = self._exec_sql(
+			'SELECT NOT EXISTS (SELECT 1 FROM name_trigrams)').fetchone()[0] == 1
+		self._exec_sql('CREATE TABLE IF NOT EXISTS rating_histogram '
+		               '(bucket INTEGER PRIMARY KEY, count INTEGER NOT NULL)')
+		if self._exec_sql('SELECT NOT EXISTS (SELECT 1 FROM rating_histogram)').fetchone()[0]:
+			self._rebuild_rating_histogram()
+		self._create_triggers()
+		self._commit_transaction()
+		if not defer_indexes:
+			self.create_indexes()
+
+	def create_indexes(self):
+		"""Create any missing secondary indexes, and build the name index if it was empty."""
+		self._create_indexes()
+		if self.name_index_empty:
+			self.rebuild_name_index()
+			self.name_index_empty = False
+		self._commit_transaction()
+		return self
+
+	def create_indexes_on_own_connection(self):
+		"""
+		Like create_indexes(), but on a new connection of its own, so that it can run in another
+		thread while this connection carries on (its writes wait for each index to be written).
+		"""
+		if self.db_file == ':memory:':
+			raise ValueError('An in-memory database can only be reached through its own connection')
+		database = SQLiteDatabase(self.db_file, defer_indexes=True)
+		try:
+			# Players saved here since opening are in the name index, but the rest may not be
+			database.name_index_empty = self.name_index_empty
+			database.create_indexes()
+		finally:
+			database.close()
+		self.name_index_empty = False
+		return self
 
 	def read_player(self, name, create_if_not_found=True):
-		cursor = self._exec_sql('SELECT name,rating FROM players WHERE name LIKE ?', (name,))
+		cursor = self._exec_sql('SELECT %s FROM players WHERE name LIKE ?' % PLAYER_COLUMNS, (name,))
 		row = cursor.fetchone()
 		if row is not None:
 			dump('Player %s exists with rating %s' % (name, row[1]))
-			return Player(row[0], rating=row[1])
+			return SQLiteDatabase._player_from_row(row)
 
 		if not create_if_not_found:
 			return None
@@ -32,15 +192,136 @@ class SQLiteDatabase(DatabaseInterface):
 		dump('Player %s does not exist, creating one' % name)
 		return Player(name)
 
+	def read_players(self, names):
+		found = {}
+		unique_names = list({name.lower(): name for name in names}.values())
+		for start in range(0, len(unique_names), MAX_SQL_VARIABLES):
+			chunk = unique_names[start:start + MAX_SQL_VARIABLES]
+			# Compared with NOCASE, like the players_name_nocase index, so the index can be used
+			cursor = self._exec_sql('SELECT %s FROM players WHERE name COLLATE NOCASE IN (%s)'
+			                        % (PLAYER_COLUMNS, ','.join('?' * len(chunk))), chunk)
+			for row in cursor.fetchall():
+				found[row[0].lower()] = SQLiteDatabase._player_from_row(row)
+		return [found.get(name.lower()) for name in names]
+
 	def update_player(self, player):
-		self._exec_sql('INSERT OR REPLACE INTO players(name, rating) VALUES(?, ?)',
-		               (player.name, player.rating))
+		self._exec_sql(PLAYER_UPSERT, (player.name, player.rating, player.rd, player.volatility))
+		self._insert_trigrams([player.name])
 		return self
 
+	def compare_and_swap_players(self, players):
+		# Take the write lock now, so no other connection can change the players mid-swap
+		began = not self.conn.in_transaction
+		if began:
+			self._begin_immediate()
+		self._exec_sql('SAVEPOINT compare_and_swap')
+		for player in players:
+			if player.version == 0:
+				cursor = self._exec_sql('INSERT INTO players(%s) SELECT ?, ?, ?, ?, 1 WHERE NOT EXISTS '
+				                        '(SELECT 1 FROM players WHERE name = ? COLLATE NOCASE)'
+				                        % PLAYER_COLUMNS, (player.name, player.rating, player.rd,
+				                                           player.volatility, player.name))
+			else:
+				cursor = self._exec_sql('UPDATE players SET rating=?, rd=?, volatility=?, '
+				                        'version=version + 1 WHERE name=? AND version=?',
+				                        (player.rating, player.rd, player.volatility, player.name,
+				                         player.version))
+			if cursor.rowcount != 1:
+				self._exec_sql('ROLLBACK TO compare_and_swap')
+				self._exec_sql('RELEASE compare_and_swap')
+				if began:
+					# Nothing else was written, so release the write lock
+					self._commit_transaction()
+				return False
+		self._exec_sql('RELEASE compare_and_swap')
+
+		self._insert_trigrams(player.name for player in players if player.version == 0)
+		for player in players:
+			player.version += 1
+		return True
+
 	def delete_player(self, name):
 		self._exec_sql('DELETE from players WHERE name=?', (name,))
+		self._exec_sql('DELETE from name_trigrams WHERE name=?', (name,))
+		self._exec_sql('DELETE from player_stats WHERE name=?', (name,))
+		self._exec_sql('DELETE from head_to_head WHERE player1=? OR player2=?', (name, name))
+		return self
+
+	def decay_ratings(self, inactive_since, decay, floor, after=None, amount=5000):
+		end = self._chunk_end(after, amount)
+		if end is not None:
+			self._exec_sql('UPDATE players SET rating=MAX(?, rating - ?), version=version + 1 '
+			               'WHERE name > ? AND name <= ? AND rating > ? AND EXISTS (SELECT 1 '
+			               'FROM player_stats WHERE player_stats.name = players.name '
+			               'AND last_played < ?)', (floor, decay, after or '', end, floor, inactive_since))
+		return end
+
+	def soft_reset_ratings(self, center, factor, after=None, amount=5000):
+		end = self._chunk_end(after, amount)
+		if end is not None:
+			self._exec_sql('UPDATE players SET rating=? + (rating - ?) * ?, version=version + 1 '
+			               'WHERE name > ? AND name <= ?', (center, center, factor, after or '', end))
+		return end
+
+	def archive_standings(self, season, after=None, amount=5000):
+		end = self._chunk_end(after, amount)
+		if end is not None:
+			self._exec_sql('INSERT OR REPLACE INTO season_standings(season, name, rating, games_played) '
+			               'SELECT ?, players.name, rating, COALESCE(games_played, 0) FROM players '
+			               'LEFT JOIN player_stats ON player_stats.name = players.name '
+			               'WHERE players.name > ? AND players.name <= ?', (season, after or '', end))
+		return end
+
+	def get_season_standings(self, season, amount=20, offset=0):
+		cursor = self._exec_sql('SELECT name, rating, games_played FROM season_standings '
+		                        'WHERE season=? ORDER BY rating DESC LIMIT ? OFFSET ?',
+		                        (season, amount, offset))
+		return cursor.fetchall()
+
+	def get_maintenance_state(self, job):
+		cursor = self._exec_sql('SELECT state FROM maintenance_state WHERE job=?', (job,))
+		row = cursor.fetchone()
+		return json.loads(row[0]) if row is not None else None
+
+	def set_maintenance_state(self, job, state):
+		self._exec_sql('INSERT OR REPLACE INTO maintenance_state(job, state) VALUES(?, ?)',
+		               (job, json.dumps(state)))
 		return self
 
+	def search_players(self, query, amount=10):
+		query_trigrams = list(trigrams(query))
+		cursor = self._exec_sql('SELECT trigram, COUNT(*) FROM name_trigrams WHERE trigram IN (%s) '
+		                        'GROUP BY trigram' % ','.join('?' * len(query_trigrams)), query_trigrams)
+		search_trigrams = choose_search_trigrams(dict(cursor.fetchall()))
+		if not search_trigrams:
+			return []
+		# Only the names sharing the most of them can be the best matches, so fetch just those
+		cursor = self._exec_sql('SELECT name FROM name_trigrams WHERE trigram IN (%s) '
+		                        'GROUP BY name ORDER BY COUNT(*) DESC LIMIT ?'
+		                        % ','.join('?' * len(search_trigrams)),
+		                        search_trigrams + [amount * CANDIDATES_PER_RESULT])
+		return rank_matches(query, (row[0] for row in cursor), amount)
+
+	def rebuild_name_index(self):
+		"""Rebuild the name trigram index from the players table."""
+		with self._bulk_import('name_trigrams'):
+			self._exec_sql('DELETE FROM name_trigrams')
+			# Only start reading now: the indexes can't be dropped while a statement is running
+			self._insert_trigrams_sorted(row[0] for row in self.conn.execute('SELECT name FROM players'))
+		return self
+
+	def get_rating_histogram(self):
+		# Cache the histogram until a row changes: total_changes counts this connection's changes,
+		# and data_version changes when another connection commits to the file
+		version = (self.conn.total_changes,
+		           self._exec_sql('PRAGMA data_version').fetchone()[0])
+		(cached_version, histogram) = self.histogram_cache
+		if cached_version != version:
+			cursor = self._exec_sql('SELECT count FROM rating_histogram ORDER BY bucket')
+			histogram = RatingHistogram(row[0] for row in cursor)
+			self.histogram_cache = (version, histogram)
+		return histogram
+
 	def get_ranking(self, player):
 		cursor = self._exec_sql('SELECT COUNT(*) FROM players WHERE rating > ? AND name != ?',
 		                        (player.get_rating(), player.name))
@@ -52,34 +333,321 @@ class SQLiteDatabase(DatabaseInterface):
 		return cursor.fetchone()[0]
 
 	def get_leaderboard(self, amount=20, offset=0):
-		cursor = self._exec_sql('SELECT name,rating FROM players ORDER BY rating DESC LIMIT ? OFFSET ?',
-		                        (amount, offset))
-		for (name, rating) in cursor.fetchall():
-			yield Player(name, rating=rating)
+		cursor = self._exec_sql('SELECT %s FROM players ORDER BY rating DESC LIMIT ? OFFSET ?'
+		                        % PLAYER_COLUMNS, (amount, offset))
+		for row in cursor.fetchall():
+			yield SQLiteDatabase._player_from_row(row)
+
+	def read_player_stats(self, names):
+		found = {}
+		for start in range(0, len(names), MAX_SQL_VARIABLES):
+			chunk = names[start:start + MAX_SQL_VARIABLES]
+			cursor = self._exec_sql('SELECT %s FROM player_stats WHERE name IN (%s)'
+			                        % (PLAYER_STATS_COLUMNS, ','.join('?' * len(chunk))), chunk)
+			for row in cursor.fetchall():
+				found[row[0].lower()] = PlayerStats(*row)
+		return [found.get(name.lower()) for name in names]
+
+	def update_player_stats(self, stats):
+		self._exec_many(PLAYER_STATS_INSERT, (SQLiteDatabase._player_stats_row(player_stats)
+		                                      for player_stats in stats))
+		return self
+
+	def replace_player_stats(self, stats):
+		rows = (SQLiteDatabase._player_stats_row(player_stats) for player_stats in stats)
+		with self._bulk_import('player_stats'):
+			self._exec_sql('DELETE FROM player_stats')
+			for batch in _batches(rows, IMPORT_BATCH_SIZE):
+				self._exec_many(PLAYER_STATS_INSERT, batch)
+		return self
+
+	def update_head_to_head(self, outcomes):
+		self._exec_many('INSERT INTO head_to_head(player1, player2, wins1, wins2, draws) '
+		                'VALUES(?, ?, ?, ?, ?) ON CONFLICT(player1, player2) DO UPDATE SET '
+		                'wins1 = wins1 + excluded.wins1, wins2 = wins2 + excluded.wins2, '
+		                'draws = draws + excluded.draws',
+		                [(record.player, record.opponent, record.wins, record.losses, record.draws)
+		                 for record in combine_outcomes(outcomes).values()])
+		return self
+
+	def get_head_to_head(self, name1, name2):
+		# Records are stored under the pair's order once folded, see combine_outcomes
+		ordered = sorted((name1, name2), key=fold_name)
+		cursor = self._exec_sql('SELECT player1, player2, wins1, wins2, draws FROM head_to_head '
+		                        'WHERE player1=? AND player2=?', ordered)
+		row = cursor.fetchone()
+		return None if row is None else SQLiteDatabase._head_to_head_from_row(row, name1)
+
+	def get_rivals(self, name, amount=5):
+		columns = 'player1, player2, wins1, wins2, draws, wins1 + wins2 + draws AS games'
+		cursor = self._exec_sql('SELECT %s FROM head_to_head WHERE player1=? UNION ALL '
+		                        'SELECT %s FROM head_to_head WHERE player2=? ORDER BY games DESC LIMIT ?'
+		                        % (columns, columns), (name, name, amount))
+		return [SQLiteDatabase._head_to_head_from_row(row[:5], name) for row in cursor.fetchall()]
 
 	def create_game(self, game):
-		raise NotImplementedError
+		cursor = self._exec_sql(GAME_INSERT, (game.game_id, game.timestamp, game.match_id))
+		game.game_id = cursor.lastrowid
+		self._exec_many(GAME_RESULTS_INSERT, [(game.game_id,) + tuple(result)
+		                                      for result in game.results])
+		return self
+
+	def has_match(self, match_id):
+		cursor = self._exec_sql('SELECT EXISTS (SELECT 1 FROM games WHERE match_id=?)', (match_id,))
+		return cursor.fetchone()[0] == 1
 
 	def delete_game(self, game_id):
-		raise NotImplementedError
+		self._exec_sql('DELETE FROM game_results WHERE game_id=?', (game_id,))
+		self._exec_sql('DELETE FROM games WHERE id=?', (game_id,))
+		return self
 
 	def get_games(self, amount, offset=0, player_name=None):
-		raise NotImplementedError
+		if player_name is None:
+			cursor = self._exec_sql('SELECT id FROM games ORDER BY id DESC LIMIT ? OFFSET ?',
+			                        (amount, offset))
+		else:
+			cursor = self._exec_sql('SELECT game_id FROM game_results WHERE name=? '
+			                        'ORDER BY game_id DESC LIMIT ? OFFSET ?', (player_name, amount, offset))
+		game_ids = [row[0] for row in cursor.fetchall()]
+		if len(game_ids) == 0:
+			return
+
+		cursor = self._exec_sql(GAME_ROWS_SELECT + ' WHERE id IN (%s) '
+		                        'ORDER BY id DESC, game_results.rowid'
+		                        % ','.join('?' * len(game_ids)), game_ids)
+		yield from SQLiteDatabase._games_from_rows(cursor)
+
+	def import_players(self, players):
+		rows = ((player.name, player.rating, player.rd, player.volatility) for player in players)
+		names = []
+		with self._bulk_import('players', 'name_trigrams'):
+			for batch in _batches(rows, IMPORT_BATCH_SIZE):
+				self._exec_many(PLAYER_UPSERT, batch)
+				names.extend(name for (name, _, _, _) in batch)
+			self._insert_trigrams_sorted(names)
+		return self
+
+	def export_players(self):
+		yield from (SQLiteDatabase._player_from_row(row)
+		            for row in self._exec_sql('SELECT %s FROM players' % PLAYER_COLUMNS))
+
+	def import_games(self, games):
+		next_id = self._exec_sql('SELECT COALESCE(MAX(id), 0) + 1 FROM games').fetchone()[0]
+		with self._bulk_import('game_results'):
+			for batch in _batches(games, IMPORT_BATCH_SIZE):
+				for game in batch:
+					if game.game_id is None:
+						game.game_id = next_id
+					next_id = max(next_id, game.game_id + 1)
+				self._exec_many(GAME_INSERT, ((game.game_id, game.timestamp, game.match_id)
+				                              for game in batch))
+				self._exec_many(GAME_RESULTS_INSERT,
+				                ((game.game_id,) + tuple(result)
+				                 for game in batch for result in game.results))
+		return self
+
+	def export_games(self):
+		cursor = self._exec_sql(GAME_ROWS_SELECT + ' ORDER BY id, game_results.rowid')
+		yield from SQLiteDatabase._games_from_rows(cursor)
 
 	def commit(self):
-		self.conn.commit()
+		self._commit_transaction()
+		if self.snapshot_writer is not None:
+			self.snapshot_writer.request_write()
 		return self
 
-	def _exec_sql(self, *args, **kwargs):
+	def close(self):
+		"""Finish writing any snapshot, and close the connection."""
+		if self.snapshot_writer is not None:
+			self.snapshot_writer.close()
+		self.conn.close()
+
+	def get_profile_report(self):
+		if self.profiler is None:
+			return None
+		return self.profiler.report()
+
+	@staticmethod
+	def _player_from_row(row):
+		"""Build a Player from a row of PLAYER_COLUMNS."""
+		(name, rating, rating_deviation, volatility, version) = row
+		return Player(name, rating=rating, rd=rating_deviation, volatility=volatility, version=version)
+
+	@staticmethod
+	def _player_stats_row(stats):
+		return (stats.name, stats.games_played, stats.wins, stats.placement_sum, stats.peak_rating,
+		        stats.streak, stats.best_streak, stats.last_played)
+
+	@staticmethod
+	def _head_to_head_from_row(row, name):
+		"""Build a HeadToHead from a head_to_head row, from the point of view of the named player."""
+		record = HeadToHead(*row)
+		return record if fold_name(record.player) == fold_name(name) else record.reversed()
+
+	@staticmethod
+	def _trigram_rows(name):
+		return [(trigram, name) for trigram in trigrams(name)]
+
+	def _insert_trigrams(self, names):
+		"""Index many names by trigram."""
+		self._exec_many('INSERT OR IGNORE INTO name_trigrams(trigram, name) VALUES(?, ?)',
+		                (row for name in names for row in SQLiteDatabase._trigram_rows(name)))
+
+	def _insert_trigrams_sorted(self, names):
+		"""
+		Index very many names by trigram: the rows are appended to a scratch table, then inserted
+		in one pass in trigram order, instead of each going to a random place in name_trigrams.
+		"""
+		self._exec_sql('CREATE TEMP TABLE new_trigrams (trigram TEXT, name TEXT)')
+		for batch in _batches(names, IMPORT_BATCH_SIZE):
+			self._exec_many('INSERT INTO new_trigrams(trigram, name) VALUES(?, ?)',
+			                (row for name in batch for row in SQLiteDatabase._trigram_rows(name)))
+		self._exec_sql('INSERT OR IGNORE INTO name_trigrams(trigram, name) '
+		               'SELECT trigram, name FROM new_trigrams ORDER BY trigram, name')
+		self._exec_sql('DROP TABLE new_trigrams')
+
+	@staticmethod
+	def _games_from_rows(rows):
+		"""Group consecutive (id, timestamp, match_id, name, score, rating_delta, rating) rows."""
+		for ((game_id, timestamp, match_id), results) in itertools.groupby(rows,
+		                                                                   key=lambda row: row[:3]):
+			yield Game([row[3:] for row in results],
+			           game_id=game_id, timestamp=timestamp, match_id=match_id)
+
+	def _chunk_end(self, after, amount):
+		"""Returns the last name in the next <amount> players by name after <after> (None if none)."""
+		cursor = self._exec_sql('SELECT MAX(name) FROM '
+		                        '(SELECT name FROM players WHERE name > ? ORDER BY name LIMIT ?)',
+		                        (after or '', amount))
+		return cursor.fetchone()[0]
+
+	def _create_indexes(self, tables=None):
+		"""Create the secondary indexes (on the given tables, or every table)."""
+		for (index, (index_table, definition)) in INDEXES.items():
+			if tables is None or index_table in tables:
+				self._exec_sql('CREATE INDEX IF NOT EXISTS %s ON %s' % (index, definition))
+
+	def _drop_indexes(self, tables):
+		"""Drop the secondary indexes on the given tables."""
+		for (index, (index_table, _)) in INDEXES.items():
+			if index_table in tables:
+				self._exec_sql('DROP INDEX IF EXISTS %s' % index)
+
+	def _create_triggers(self, tables=None):
+		"""Create the triggers (on the given tables, or every table)."""
+		for (trigger, (trigger_table, definition)) in TRIGGERS.items():
+			if tables is None or trigger_table in tables:
+				self._exec_sql('CREATE TRIGGER IF NOT EXISTS %s %s' % (trigger, definition))
+
+	def _drop_triggers(self, tables):
+		"""Drop the triggers on the given tables."""
+		for (trigger, (trigger_table, _)) in TRIGGERS.items():
+			if trigger_table in tables:
+				self._exec_sql('DROP TRIGGER IF EXISTS %s' % trigger)
+
+	def _rebuild_rating_histogram(self):
+		"""Recount the rating_histogram table from the players table, in one pass."""
+		self._exec_sql('DELETE FROM rating_histogram')
+		self._exec_many('INSERT INTO rating_histogram(bucket, count) VALUES(?, 0)',
+		                ((bucket,) for bucket in range(NUM_BUCKETS)))
+		self._exec_sql('UPDATE rating_histogram SET count = counted.count FROM (SELECT %s AS bucket, '
+		               'COUNT(*) AS count FROM players GROUP BY 1) AS counted '
+		               'WHERE rating_histogram.bucket = counted.bucket' % _bucket_sql('rating'))
+
+	@contextlib.contextmanager
+	def _bulk_import(self, *tables):
+		"""Runs a bulk import into tables as one transaction, rebuilding their indexes at the end."""
+		self.commit()
+		# Begin explicitly, or the DROPs would commit on their own and a failed import would leave
+		# the indexes and triggers dropped
+		self._exec_sql('BEGIN')
+		try:
+			self._drop_indexes(tables)
+			self._drop_triggers(tables)
+			yield
+			self._create_indexes(tables)
+			if 'players' in tables:
+				self._rebuild_rating_histogram()
+			self._create_triggers(tables)
+			self.commit()
+		except BaseException:
+			self.conn.rollback()
+			raise
+
+	def _begin_immediate(self):
+		"""Begin a transaction holding the write lock, retrying while the database is locked."""
+		for attempt in range(LOCKED_ATTEMPTS):
+			try:
+				self._exec_sql('BEGIN IMMEDIATE')
+				return
+			except sqlite3.OperationalError as exc:
+				if 'locked' not in str(exc) or attempt == LOCKED_ATTEMPTS - 1:
+					raise
+			time.sleep(LOCKED_RETRY_DELAY * 2 ** attempt)
+
+	def _migrate_table(self, table, column_migrations):
+		"""
+		Add any columns missing from a table created by an older version of the schema, returning
+		the names of the columns added.
+		"""
+		cursor = self._exec_sql('PRAGMA table_info(%s)' % table)
+		existing_columns = set(row[1] for row in cursor.fetchall())
+		added = []
+		for (column, definition) in column_migrations:
+			if column not in existing_columns:
+				self._exec_sql('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, definition))
+				added.append(column)
+		return added
+
+	def _backfill_last_played(self):
+		"""Fill in the players' last_played from their latest game (stats saved before it was kept)."""
+		self._exec_sql('UPDATE player_stats SET last_played = latest.timestamp FROM '
+		               '(SELECT lower(name) AS name, MAX(timestamp) AS timestamp FROM game_results '
+		               'JOIN games ON games.id = game_results.game_id GROUP BY lower(name)) AS latest '
+		               'WHERE lower(player_stats.name) = latest.name')
+
+	def _exec_sql(self, sql, params=()):
 		cursor = self.conn.cursor()
-		cursor.execute(*args, **kwargs)
+		with self._timed(sql, params):
+			cursor.execute(sql, params)
 		return cursor
 
+	def _exec_many(self, sql, rows):
+		with self._timed(sql):
+			return self.conn.executemany(sql, rows)
+
+	def _commit_transaction(self):
+		with self._timed('COMMIT'):
+			self.conn.commit()
+
+	def _timed(self, sql, params=None):
+		"""Time a statement with the profiler (if profiling)."""
+		if self.profiler is None:
+			return contextlib.nullcontext()
+		return self.profiler.timed(sql, params)
+
+def _read_ratings(db_file):
+	"""Read every (name, rating) on a connection of its own (for the snapshot writer's thread)."""
+	conn = sqlite3.connect(db_file)
+	try:
+		return conn.execute('SELECT name, rating FROM players').fetchall()
+	finally:
+		conn.close()
+
+def _batches(iterable, size):
+	"""Split an iterable into lists of up to size items, lazily."""
+	iterator = iter(iterable)
+	while True:
+		batch = list(itertools.islice(iterator, size))
+		if len(batch) == 0:
+			return
+		yield batch
+
 def _dummy_init(sqldb):
 	alice = Player("Alice", 1200)
 	bob = Player("Bob", 1400)
 	charlie = Player("Charlie", 1600)
-	return sqldb.save(alice).save(bob).save(charlie)
+	return sqldb.import_players([alice, bob, charlie])
 
 def _delete_player(sqldb, name):
 	cursor = sqldb.conn.cursor()
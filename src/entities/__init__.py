@@ -1,3 +1,10 @@
 from .player import Player
+from .game import Game
+from .player_stats import PlayerStats, compute_player_stats, get_placements
 from .elo import Elo
+from .head_to_head import HeadToHead, combine_outcomes, fold_name, get_matchup_outcomes
 from .logger import MyLogger
+from .simulator import PlacementSimulator
+from .rating_engine import RatingEngine
+from .glicko2 import Glicko2
+from .rating_histogram import RatingHistogram, get_bucket
@@ -1,16 +1,29 @@
 #! /usr/bin/env python3
 """Manages the calculations regarding Elo skill ratings."""
 
+import numpy as np
+
 from . import Player
+from .rating_engine import RatingEngine
 
 def clamp(num, smallest, largest):
 	"""Clamps num between the given bounds."""
 	return max(smallest, min(num, largest))
 
-class Elo:
-	"""Manages the calculations regarding Elo skill ratings."""
-	def __init__(self, d=400):
+class Elo(RatingEngine):
+	"""
+	Manages the calculations regarding Elo skill ratings.
+
+	d -- the rating difference at which the stronger player is expected to score 10 times as much
+	max_diff -- rating differences are clamped to +/- this when estimating scores
+	k_mult_power -- in a game of n players, each matchup's k-factor is multiplied by
+		1 / (n - 1) ** k_mult_power (1 keeps a player's total change within k, 0 gives each
+		matchup the full k)
+	"""
+	def __init__(self, d=400, max_diff=400, k_mult_power=1.0):
 		self.d_const = d
+		self.max_diff = max_diff
+		self.k_mult_power = k_mult_power
 
 	def report_game(self, players_scores):
 		"""Given the result of a game, adjust the players' skill ratings according to performance.
@@ -22,7 +35,7 @@ class Elo:
 		if num_players <= 1:
 			return None
 
-		k_mult = 1 / (num_players - 1)
+		k_mult = self.get_k_multiplier(num_players)
 
 		# For each matchup, simulate a game
 		for i in range(num_players - 1):
@@ -60,6 +73,10 @@ class Elo:
 
 		return (p1_rating_delta, p2_rating_delta)
 
+	def get_k_multiplier(self, num_players):
+		"""The multiplier of each player's k-factor for one matchup, in a game of num_players."""
+		return 1 / (num_players - 1) ** self.k_mult_power
+
 	@staticmethod
 	def get_actual_score(player_score, opponent_score):
 		"""Calculate a player's performance rating given his and his opponent's score."""
@@ -69,9 +86,49 @@ class Elo:
 			return 0
 		return 0.5
 
+	def estimate_score(self, player, opponent):
+		return self.estimate_score_vs_one(player.rating, opponent.rating)
+
 	def estimate_score_vs_one(self, player_rating, opponent_rating):
 		"""Estimate a player's performance rating if they were to play against opponent."""
-		return 1 / (1 + pow(10, clamp(opponent_rating - player_rating, -400, 400) / self.d_const))
+		diff = clamp(opponent_rating - player_rating, -self.max_diff, self.max_diff)
+		return 1 / (1 + pow(10, diff / self.d_const))
+
+	def win_probability_matrix(self, ratings):
+		"""Estimate every pairwise performance rating among the given ratings in one pass.
+
+		ratings -- sequence of numeric ratings
+		returns an (n, n) array, where [i][j] is player i's estimated score against player j
+		"""
+		ratings = np.asarray(ratings, dtype=float)
+		diffs = np.clip(ratings[np.newaxis, :] - ratings[:, np.newaxis], -self.max_diff, self.max_diff)
+		probs = 1 / (1 + np.power(10, diffs / self.d_const))
+		np.fill_diagonal(probs, 0.5)
+		return probs
+
+	def forecast(self, players):
+		"""Forecast a game between the given players, before it is played.
+
+		players -- list of Player
+		returns (win_matrix, expected_scores, place_deltas), where expected_scores[i] is the number
+		of opponents player i is expected to beat, and place_deltas[i][p] is the rating change
+		player i would get for finishing in place p (0-indexed, ignoring ties)
+		"""
+		num_players = len(players)
+		if num_players <= 1:
+			return None
+
+		win_matrix = self.win_probability_matrix([player.rating for player in players])
+		expected_scores = win_matrix.sum(axis=1) - 0.5
+
+		# Finishing in place p means beating (num_players - 1 - p) opponents, see report_game
+		k_mult = self.get_k_multiplier(num_players)
+		k_factors = np.array([player.k for player in players], dtype=float) * k_mult
+		opponents_beaten = np.arange(num_players - 1, -1, -1, dtype=float)
+		place_deltas = k_factors[:, np.newaxis] * (opponents_beaten[np.newaxis, :]
+		                                           - expected_scores[:, np.newaxis])
+
+		return (win_matrix, expected_scores, place_deltas)
 
 def main():
 	"""Test the Elo module."""
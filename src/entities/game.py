@@ -0,0 +1,18 @@
+#! /usr/bin/env python3
+
+import time
+
+class Game:
+	def __init__(self, results, game_id=None, timestamp=None, match_id=None):
+		"""
+		results -- list of (player_name, score, rating_delta, rating after the game)
+		match_id -- the id the game was given when it was watched (None if it has none), which
+			marks it as processed, so a match delivered again after a restart isn't rated twice
+		"""
+		self.game_id = game_id
+		self.timestamp = timestamp if timestamp is not None else time.time()
+		self.results = results
+		self.match_id = match_id
+
+	def get_player_names(self):
+		return [result[0] for result in self.results]
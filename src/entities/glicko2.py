@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+"""Manages the calculations regarding Glicko-2 skill ratings.
+
+See Mark Glickman's "Example of the Glicko-2 system" for the algorithm, which is applied here to
+all the games of a rating period at once, treating each game as a set of pairwise matches.
+"""
+
+import math
+
+import numpy as np
+
+from . import Player
+from .rating_engine import RatingEngine
+
+# Converts between the Glicko and Glicko-2 rating scales
+SCALE = 173.7178
+
+# The rd of an unrated player, which a player's rd never grows past while they don't play
+MAX_RD = 350
+
+_PAIR_CACHE = {}
+
+def _pairs(num_players):
+	"""Returns the (i, j) indices of every matchup between num_players, with i < j."""
+	if num_players not in _PAIR_CACHE:
+		_PAIR_CACHE[num_players] = np.triu_indices(num_players, k=1)
+	return _PAIR_CACHE[num_players]
+
+def _g(phi):
+	return 1 / np.sqrt(1 + 3 * phi * phi / (math.pi * math.pi))
+
+class Glicko2(RatingEngine):
+	"""Manages the calculations regarding Glicko-2 skill ratings."""
+	def __init__(self, tau=0.5, center=1000, epsilon=0.000001, max_iterations=100):
+		self.tau = tau
+		self.center = center
+		self.epsilon = epsilon
+		self.max_iterations = max_iterations
+
+	def report_game(self, players_scores):
+		"""Given the result of a game, adjust the players' skill ratings, as its own rating period.
+
+		players_scores -- list of (player, score), player is a Player, score is numeric
+		"""
+		if len(players_scores) <= 1:
+			return None
+
+		changes = self.process_rating_period([players_scores])
+		(players, scores) = zip(*players_scores)
+		return (players, scores, [changes[player] for player in players])
+
+	def estimate_score(self, player, opponent):
+		mu = (player.rating - self.center) / SCALE
+		opp_mu = (opponent.rating - self.center) / SCALE
+		phi = math.hypot(player.rd, opponent.rd) / SCALE
+		return float(1 / (1 + np.exp(-_g(phi) * (mu - opp_mu))))
+
+	def process_rating_period(self, games, rated_players=()):
+		"""Adjust the players' skill ratings according to all the games played in a rating period.
+
+		Every player's rating, rd and volatility are updated from the values at the start of the
+		period, in one vectorized pass over all of the period's matchups. Rated players who didn't
+		play only have their rd widened by their volatility (step 6), up to MAX_RD.
+
+		games -- list of players_scores lists, as passed to report_game
+		rated_players -- every rated player, whether or not they played in the period
+		returns a dict of player -> total rating change over the period
+		"""
+		(players, player_idx, opp_idx, actual, weight) = self._collect_matchups(games)
+		Glicko2._widen_idle(rated_players, set(players))
+		if len(players) == 0:
+			return {}
+
+		ratings = np.array([player.rating for player in players], dtype=float)
+		mu = (ratings - self.center) / SCALE
+		phi = np.array([player.rd for player in players], dtype=float) / SCALE
+		sigma = np.array([player.volatility for player in players], dtype=float)
+
+		# Steps 3 and 4: estimated variance and improvement, summed over every matchup
+		g_opp = _g(phi[opp_idx])
+		expected = 1 / (1 + np.exp(-g_opp * (mu[player_idx] - mu[opp_idx])))
+		inv_v = np.bincount(player_idx, weight * g_opp * g_opp * expected * (1 - expected),
+		                    minlength=len(players))
+		improvement = np.bincount(player_idx, weight * g_opp * (actual - expected),
+		                          minlength=len(players))
+
+		played = inv_v > 0
+		variance = np.full(len(players), np.inf)
+		variance[played] = 1 / inv_v[played]
+		delta = np.where(played, variance * improvement, 0.0)
+
+		# Steps 5 to 8: new volatility, rating deviation, and rating
+		new_sigma = np.where(played, self._new_volatilities(phi, sigma, variance, delta, played), sigma)
+		phi_star = np.sqrt(phi * phi + new_sigma * new_sigma)
+		new_phi = np.where(played, 1 / np.sqrt(1 / (phi_star * phi_star) + inv_v), phi_star)
+		new_mu = mu + new_phi * new_phi * improvement
+
+		new_ratings = new_mu * SCALE + self.center
+		for (i, player) in enumerate(players):
+			player.rating = float(new_ratings[i])
+			player.rd = float(new_phi[i] * SCALE)
+			player.volatility = float(new_sigma[i])
+
+		return dict(zip(players, (new_ratings - ratings).tolist()))
+
+	@staticmethod
+	def _widen_idle(rated_players, active):
+		"""Step 6 for the players who didn't play: phi grows to sqrt(phi^2 + sigma^2)."""
+		idle = [player for player in rated_players if player not in active]
+		if len(idle) == 0:
+			return
+		phi = np.array([player.rd for player in idle], dtype=float) / SCALE
+		sigma = np.array([player.volatility for player in idle], dtype=float)
+		new_rd = np.minimum(np.sqrt(phi * phi + sigma * sigma) * SCALE, MAX_RD)
+		for (player, rd) in zip(idle, new_rd.tolist()):
+			player.rd = max(rd, player.rd)
+
+	@staticmethod
+	def _collect_matchups(games):
+		"""Flatten the games into arrays describing each matchup from both players' points of view.
+
+		Each player in a game of n players gets a weight of 1/(n-1) per matchup, like the Elo k
+		multiplier, so that one game counts as about one result no matter how many played.
+
+		returns (players, player_idx, opp_idx, actual_score, weight)
+		"""
+		indices = {}
+		players = []
+		(firsts, seconds, actuals, weights) = ([], [], [], [])
+
+		for players_scores in games:
+			num_players = len(players_scores)
+			if num_players <= 1:
+				continue
+
+			game_idx = np.empty(num_players, dtype=np.int64)
+			scores = np.empty(num_players, dtype=float)
+			for (i, (player, score)) in enumerate(players_scores):
+				if player not in indices:
+					indices[player] = len(players)
+					players.append(player)
+				game_idx[i] = indices[player]
+				scores[i] = score
+
+			(first, second) = _pairs(num_players)
+			firsts.append(game_idx[first])
+			seconds.append(game_idx[second])
+			actuals.append(0.5 + 0.5 * np.sign(scores[first] - scores[second]))
+			weights.append(np.full(len(first), 1 / (num_players - 1)))
+
+		if len(players) == 0:
+			return ([], None, None, None, None)
+
+		(first, second) = (np.concatenate(firsts), np.concatenate(seconds))
+		actual = np.concatenate(actuals)
+		weight = np.concatenate(weights)
+		return (players,
+		        np.concatenate((first, second)),
+		        np.concatenate((second, first)),
+		        np.concatenate((actual, 1 - actual)),
+		        np.concatenate((weight, weight)))
+
+	def _new_volatilities(self, phi, sigma, variance, delta, active):
+		"""Step 5: find each active player's new volatility, with the Illinois algorithm, in lockstep."""
+		tau_sq = self.tau * self.tau
+		(phi, sigma, variance, delta) = (phi[active], sigma[active], variance[active], delta[active])
+		(phi_sq, delta_sq) = (phi * phi, delta * delta)
+		alpha = np.log(sigma * sigma)
+
+		def func(x):
+			exp_x = np.exp(x)
+			denom = phi_sq + variance + exp_x
+			return exp_x * (delta_sq - denom) / (2 * denom * denom) - (x - alpha) / tau_sq
+
+		low = alpha.copy()
+		big = delta_sq > phi_sq + variance
+		high = np.where(big, np.log(np.maximum(delta_sq - phi_sq - variance, 1e-300)), alpha - self.tau)
+		# Step down until f(alpha - k * tau) >= 0 for the players where delta is not big
+		for _ in range(self.max_iterations):
+			needs_step = ~big & (func(high) < 0)
+			if not needs_step.any():
+				break
+			high = np.where(needs_step, high - self.tau, high)
+
+		(a_val, b_val) = (low, high)
+		(f_a, f_b) = (func(a_val), func(b_val))
+		for _ in range(self.max_iterations):
+			unconverged = np.abs(b_val - a_val) > self.epsilon
+			if not unconverged.any():
+				break
+			c_val = a_val + (a_val - b_val) * f_a / (f_b - f_a)
+			f_c = func(c_val)
+			swap = f_c * f_b <= 0
+			a_val = np.where(unconverged & swap, b_val, a_val)
+			f_a = np.where(unconverged & swap, f_b, np.where(unconverged, f_a / 2, f_a))
+			b_val = np.where(unconverged, c_val, b_val)
+			f_b = np.where(unconverged, f_c, f_b)
+
+		new_sigma = np.zeros(len(active))
+		new_sigma[active] = np.exp(a_val / 2)
+		return new_sigma
+
+def main():
+	"""Test the Glicko-2 module, with the example from Glickman's paper."""
+	glicko = Glicko2(center=1500)
+	player = Player("Derg", 1500, rd=200)
+	opponents = [Player("Starlis", 1400, rd=30),
+	             Player("Pepega", 1550, rd=100),
+	             Player("Ether", 1700, rd=300),]
+	games = [[(player, 1), (opponents[0], 0)],
+	         [(player, 0), (opponents[1], 1)],
+	         [(player, 0), (opponents[2], 1)],]
+
+	idle = Player("Lurker", 1500, rd=50)
+	glicko.process_rating_period(games, [player, idle] + opponents)
+	# Expect rating 1464.06, rd 151.52, volatility 0.05999
+	print("%s: %.2f (rd %.2f, volatility %.5f)" % (player.name, player.rating, player.rd,
+	                                                 player.volatility))
+	# Expect rd 51.07, from not playing
+	print("%s: %.2f (rd %.2f)" % (idle.name, idle.rating, idle.rd))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+
+import string
+
+from .elo import Elo
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def fold_name(name):
+	"""Returns the name with just its ASCII letters lowercased, as SQLite's NOCASE compares names."""
+	return name.translate(_ASCII_LOWER)
+
+def get_matchup_outcomes(names, scores):
+	"""
+	Returns the outcome of every matchup in a game, the same pairs that Elo.report_game compares.
+
+	returns a list of (name1, name2, actual score of name1), the actual score being 1, 0.5 or 0
+	"""
+	outcomes = []
+	for i in range(len(names) - 1):
+		for j in range(i + 1, len(names)):
+			outcomes.append((names[i], names[j], Elo.get_actual_score(scores[i], scores[j])))
+	return outcomes
+
+class HeadToHead:
+	def __init__(self, player, opponent, wins=0, losses=0, draws=0):
+		"""A player's record against one opponent (by name)."""
+		self.player = player
+		self.opponent = opponent
+		self.wins = wins
+		self.losses = losses
+		self.draws = draws
+
+	def get_games_played(self):
+		return self.wins + self.losses + self.draws
+
+	def reversed(self):
+		"""Returns the same record, from the opponent's point of view."""
+		return HeadToHead(self.opponent, self.player, self.losses, self.wins, self.draws)
+
+def combine_outcomes(outcomes):
+	"""
+	Combine matchup outcomes into one HeadToHead per pair of players, to be added to their records.
+
+	Each pair's record is from the point of view of the name that sorts first, once folded with
+	fold_name (so that pairs are keyed the same way as in SQLite).
+	returns a dict of (folded name, folded opponent name) -> HeadToHead
+	"""
+	records = {}
+	for (name1, name2, score1) in outcomes:
+		if fold_name(name1) > fold_name(name2):
+			(name1, name2, score1) = (name2, name1, 1 - score1)
+		key = (fold_name(name1), fold_name(name2))
+		if key not in records:
+			records[key] = HeadToHead(name1, name2)
+
+		if score1 == 1:
+			records[key].wins += 1
+		elif score1 == 0:
+			records[key].losses += 1
+		else:
+			records[key].draws += 1
+	return records
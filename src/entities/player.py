@@ -1,10 +1,17 @@
 #! /usr/bin/env python3
 
 class Player:
-	def __init__(self, name, rating=1000, k=32):
+	# Without a __dict__ per player, large numbers of players take much less memory
+	__slots__ = ('name', 'rating', 'k', 'rd', 'volatility', 'version')
+
+	def __init__(self, name, rating=1000, k=32, rd=350, volatility=0.06, version=0):
+		"""version -- how many times the player was saved, as of reading them (0 if never saved)"""
 		self.name = str(name)
 		self.rating = rating
 		self.k = k
+		self.rd = rd
+		self.volatility = volatility
+		self.version = version
 
 	def get_rating(self):
 		return int(round(self.rating))
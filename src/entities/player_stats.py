@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+
+def get_placements(scores):
+	"""Returns each score's place (1 is best), with tied scores sharing the higher place."""
+	return [1 + sum(1 for other in scores if other > score) for score in scores]
+
+class PlayerStats:
+	def __init__(self, name, games_played=0, wins=0, placement_sum=0, peak_rating=None,
+	             streak=0, best_streak=0, last_played=None):
+		"""
+		streak -- the number of games won in a row (or, if negative, not won in a row)
+		last_played -- the timestamp of the player's latest game (None if unknown)
+		"""
+		self.name = str(name)
+		self.games_played = games_played
+		self.wins = wins
+		self.placement_sum = placement_sum
+		self.peak_rating = peak_rating
+		self.streak = streak
+		self.best_streak = best_streak
+		self.last_played = last_played
+
+	def record_game(self, place, rating, timestamp=None):
+		"""Update the stats with a finished game, given the place and the rating afterwards."""
+		self.games_played += 1
+		if timestamp is not None and (self.last_played is None or timestamp > self.last_played):
+			self.last_played = timestamp
+		self.placement_sum += place
+		if self.peak_rating is None or rating > self.peak_rating:
+			self.peak_rating = rating
+
+		if place == 1:
+			self.wins += 1
+			self.streak = self.streak + 1 if self.streak > 0 else 1
+			self.best_streak = max(self.best_streak, self.streak)
+		else:
+			self.streak = self.streak - 1 if self.streak < 0 else -1
+
+	def get_win_rate(self):
+		return self.wins / self.games_played if self.games_played > 0 else 0.0
+
+	def get_average_placement(self):
+		return self.placement_sum / self.games_played if self.games_played > 0 else 0.0
+
+def compute_player_stats(games, starting_rating=1000):
+	"""
+	Compute every player's stats from scratch, in one pass over their games (oldest first).
+
+	Games recorded without the players' ratings afterwards use a running total of rating changes.
+	A player listed more than once in a game counts once, with their first result, as when the
+	game was rated.
+	returns a dict of lowercased name -> PlayerStats
+	"""
+	stats = {}
+	ratings = {}
+	for game in games:
+		(seen_names, results) = (set(), [])
+		for result in game.results:
+			if result[0].lower() not in seen_names:
+				seen_names.add(result[0].lower())
+				results.append(result)
+		placements = get_placements([result[1] for result in results])
+		for ((name, _, delta, rating), place) in zip(results, placements):
+			key = name.lower()
+			if rating is None:
+				rating = ratings.get(key, starting_rating) + delta
+			ratings[key] = rating
+			stats.setdefault(key, PlayerStats(name)).record_game(place, rating, game.timestamp)
+	return stats
@@ -0,0 +1,38 @@
+#! /usr/bin/env python3
+"""The abstract interface for a skill rating system."""
+
+from abc import ABC, abstractmethod
+
+class RatingEngine(ABC):
+	"""Adjusts players' skill ratings according to game results."""
+
+	@abstractmethod
+	def report_game(self, players_scores):
+		"""
+		Given the result of a game, adjust the players' skill ratings according to performance.
+
+		players_scores -- list of (player, score), player is a Player, score is numeric
+		returns (players, scores, score_changes), or None if there were not enough players
+		"""
+
+	@abstractmethod
+	def estimate_score(self, player, opponent):
+		"""Estimate a player's performance rating (0 to 1) if they were to play against opponent."""
+
+	def process_rating_period(self, games, rated_players=()):
+		"""
+		Adjust the players' skill ratings according to all the games played in a rating period.
+
+		games -- list of players_scores lists, as passed to report_game
+		rated_players -- every rated player, including those who didn't play in the period (whose
+			rating uncertainty grows, for engines which track it)
+		returns a dict of player -> total rating change over the period
+		"""
+		changes = {}
+		for players_scores in games:
+			result = self.report_game(players_scores)
+			if result is None:
+				continue
+			for (player, _, delta) in zip(*result):
+				changes[player] = changes.get(player, 0.0) + delta
+		return changes
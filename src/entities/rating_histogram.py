@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+
+import itertools
+
+# The histogram covers ratings from HISTOGRAM_LOW, in NUM_BUCKETS buckets of BUCKET_WIDTH (ratings
+# outside that range are counted in the first or last bucket)
+HISTOGRAM_LOW = 0
+BUCKET_WIDTH = 10
+NUM_BUCKETS = 400
+
+def get_bucket(rating):
+	"""Returns the index of the bucket a rating is counted in."""
+	return min(max(int((rating - HISTOGRAM_LOW) // BUCKET_WIDTH), 0), NUM_BUCKETS - 1)
+
+class RatingHistogram:
+	"""
+	The number of players in each fixed-width rating bucket, updated one rating change at a time.
+
+	The running totals needed for percentiles are rebuilt (in O(NUM_BUCKETS)) on the first lookup
+	after a change, so each lookup after that is O(1).
+	"""
+	def __init__(self, counts=None):
+		self.counts = list(counts) if counts is not None else [0] * NUM_BUCKETS
+		self.total = sum(self.counts)
+		self.counts_below = None
+
+	@staticmethod
+	def from_ratings(ratings):
+		histogram = RatingHistogram()
+		for rating in ratings:
+			histogram.counts[get_bucket(rating)] += 1
+		histogram.total = sum(histogram.counts)
+		return histogram
+
+	def add(self, rating):
+		self.counts[get_bucket(rating)] += 1
+		self.total += 1
+		self.counts_below = None
+
+	def remove(self, rating):
+		self.counts[get_bucket(rating)] -= 1
+		self.total -= 1
+		self.counts_below = None
+
+	def get_top_fraction(self, rating):
+		"""
+		Returns the fraction of players rated at least <rating> (assuming the ratings within a
+		bucket are spread evenly), e.g. 0.05 for a player in the top 5%.
+		"""
+		if self.total == 0:
+			return 1.0
+		if self.counts_below is None:
+			self.counts_below = list(itertools.accumulate(self.counts, initial=0))
+
+		bucket = get_bucket(rating)
+		bucket_low = HISTOGRAM_LOW + bucket * BUCKET_WIDTH
+		fraction_of_bucket = min(max((rating - bucket_low) / BUCKET_WIDTH, 0.0), 1.0)
+		below = self.counts_below[bucket] + self.counts[bucket] * fraction_of_bucket
+		return min(max((self.total - below) / self.total, 1 / self.total), 1.0)
+
+	def get_buckets(self, width=100):
+		"""
+		Returns the counts in buckets of <width> (rounded down to a multiple of BUCKET_WIDTH), as a
+		list of (lowest rating, highest rating, count), from the lowest to the highest non-empty
+		bucket.
+		"""
+		merge = max(width // BUCKET_WIDTH, 1)
+		merged = [(HISTOGRAM_LOW + start * BUCKET_WIDTH, HISTOGRAM_LOW + (start + merge) * BUCKET_WIDTH,
+		           sum(self.counts[start:start + merge]))
+		          for start in range(0, NUM_BUCKETS, merge)]
+		non_empty = [i for (i, (_, _, count)) in enumerate(merged) if count > 0]
+		return merged[non_empty[0]:non_empty[-1] + 1] if non_empty else []
@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+"""Simulates the finishing places of multi-player games using the Elo model."""
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import Player, Elo
+
+# The samples are always split into this many chunks, each with its own seed, so results for a seed
+# don't depend on how many worker processes share the chunks
+NUM_CHUNKS = 16
+
+def _sample_placements(log_strengths, num_samples, seed, batch_size, time_budget):
+	"""Draw up to num_samples random finishing orders, stopping early after time_budget seconds.
+
+	Finishing orders follow the Plackett-Luce model, whose pairwise odds are exactly the Elo odds
+	(without the rating difference clamp), sampled all at once with the Gumbel-max trick.
+
+	returns (counts, samples_drawn), where counts[i][p] is how often player i finished in place p
+	"""
+	# A duration rather than a deadline, as perf_counter() values differ between processes
+	deadline = time.perf_counter() + time_budget
+	rng = np.random.default_rng(seed)
+	num_players = len(log_strengths)
+	counts = np.zeros(num_players * num_players, dtype=np.int64)
+	places = np.arange(num_players)
+	samples_drawn = 0
+
+	while samples_drawn < num_samples:
+		batch = min(batch_size, num_samples - samples_drawn)
+		keys = log_strengths + rng.gumbel(size=(batch, num_players))
+		order = np.argsort(-keys, axis=1)
+		counts += np.bincount((order * num_players + places).ravel(), minlength=counts.size)
+		samples_drawn += batch
+		if time.perf_counter() > deadline:
+			break
+
+	return (counts.reshape(num_players, num_players), samples_drawn)
+
+def _sample_chunks(log_strengths, chunks, batch_size, time_budget):
+	"""Run _sample_placements on each (num_samples, seed) chunk in turn, sharing one time budget.
+
+	returns (counts, samples_drawn), summed over the chunks
+	"""
+	deadline = time.perf_counter() + time_budget
+	counts = 0
+	samples_drawn = 0
+	for (num_samples, seed) in chunks:
+		remaining = deadline - time.perf_counter()
+		if remaining <= 0 and samples_drawn > 0:
+			break
+		(chunk_counts, chunk_drawn) = _sample_placements(log_strengths, num_samples, seed,
+		                                                 batch_size, max(remaining, 0))
+		counts = counts + chunk_counts
+		samples_drawn += chunk_drawn
+	return (counts, samples_drawn)
+
+class PlacementSimulator:
+	"""
+	Estimates the chance of each player finishing in each place, by simulating many games.
+
+	Simulations of at least parallel_threshold samples are split between a pool of worker
+	processes, which is started on first use and kept for later simulations (see close()). The
+	workers are spawned rather than forked, as simulations run in executor threads.
+	"""
+	def __init__(self, elo=None, batch_size=20000, time_budget=1.0, workers=None,
+	             parallel_threshold=100000):
+		self.elo = elo if elo is not None else Elo()
+		self.batch_size = batch_size
+		self.time_budget = time_budget
+		self.workers = workers if workers is not None else os.cpu_count()
+		self.parallel_threshold = parallel_threshold
+		self.pool = None
+		self.pool_lock = threading.Lock()
+
+	def close(self):
+		"""Shut down the worker processes (if they were started)."""
+		with self.pool_lock:
+			if self.pool is not None:
+				self.pool.shutdown()
+				self.pool = None
+
+	def simulate(self, players, num_samples=100000, seed=None):
+		"""Simulate num_samples games between the given players (fewer if time runs out).
+
+		Results are reproducible for a given seed, whatever the number of workers, as long as the
+		time budget is not exceeded.
+
+		players -- list of Player
+		returns (place_probs, expected_deltas, samples_drawn), where place_probs[i][p] is the chance
+		of player i finishing in place p (0-indexed), and expected_deltas[i] their expected rating change
+		"""
+		forecast = self.elo.forecast(players)
+		if forecast is None:
+			return None
+		if num_samples < 1:
+			raise ValueError('num_samples must be at least 1, not %r' % num_samples)
+		(_, _, place_deltas) = forecast
+
+		log_strengths = np.array([player.rating for player in players], dtype=float) \
+			* math.log(10) / self.elo.d_const
+
+		seeds = np.random.SeedSequence(seed).spawn(NUM_CHUNKS)
+		chunks = [(num_samples // NUM_CHUNKS + (1 if i < num_samples % NUM_CHUNKS else 0), chunk_seed)
+		          for (i, chunk_seed) in enumerate(seeds)]
+		chunks = [(share, chunk_seed) for (share, chunk_seed) in chunks if share > 0]
+		if num_samples >= self.parallel_threshold and self.workers > 1:
+			(counts, samples_drawn) = self._simulate_parallel(log_strengths, chunks)
+		else:
+			(counts, samples_drawn) = _sample_chunks(log_strengths, chunks, self.batch_size,
+			                                         self.time_budget)
+
+		place_probs = counts / samples_drawn
+		expected_deltas = (place_probs * place_deltas).sum(axis=1)
+		return (place_probs, expected_deltas, samples_drawn)
+
+	def _simulate_parallel(self, log_strengths, chunks):
+		"""Split the chunks of samples evenly between a pool of worker processes."""
+		# Simulations run in executor threads, so two could try to start the pool at once
+		with self.pool_lock:
+			if self.pool is None:
+				self.pool = ProcessPoolExecutor(max_workers=self.workers,
+				                                mp_context=multiprocessing.get_context('spawn'))
+		futures = [self.pool.submit(_sample_chunks, log_strengths, chunks[i::self.workers],
+		                            self.batch_size, self.time_budget)
+		           for i in range(min(self.workers, len(chunks)))]
+		results = [future.result() for future in futures]
+
+		counts = sum(worker_counts for (worker_counts, _) in results)
+		samples_drawn = sum(worker_drawn for (_, worker_drawn) in results)
+		return (counts, samples_drawn)
+
+def main():
+	"""Test the placement simulator."""
+	players = [Player("Derg", 1150),
+	           Player("Starlis", 1200),
+	           Player("Pepega", 1000),]
+	simulator = PlacementSimulator()
+
+	start = time.perf_counter()
+	(place_probs, expected_deltas, samples_drawn) = simulator.simulate(players, 1000000, seed=1)
+	elapsed = time.perf_counter() - start
+
+	simulator.close()
+
+	print("Simulated %d games in %.3fs" % (samples_drawn, elapsed))
+	for (i, player) in enumerate(players):
+		print("%s: %s (%+.2f)" % (player.name, ' '.join('%5.1f%%' % (100 * p) for p in place_probs[i]),
+		                          expected_deltas[i]))
+
+if __name__ == '__main__':
+	main()
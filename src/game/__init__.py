@@ -1 +1,8 @@
-from .jstris import Jstris
+from .results_log import ResultsLog, parse_game_results, read_results_log
+
+def __getattr__(name):
+	# jstris imports selenium, which is slow and only needed once a lobby is opened
+	if name == 'Jstris':
+		from .jstris import Jstris
+		return Jstris
+	raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -4,7 +4,9 @@
 import logging
 import pprint
 import sys
+import threading
 import time
+import uuid
 
 import asyncio
 
@@ -15,10 +17,21 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-from credentials import jstris_creds
 from model import GameInterface, GameState
+from .polling import PollingPolicy, PollingStats
+from .results_log import parse_game_results
+from .roster import GET_ROSTER_CHANGES_JS, HAVE_TWO_PLAYERS_JOINED_JS, ROSTER_SCRIPT, Roster
 
 JSTRIS_URL = 'https://jstris.jezevec10.com'
+
+# How long to wait for the result of a match which was running before a restart
+RESUMED_GAME_TIMEOUT = 600
+
+# The fixed intervals that were used before polling policies, to count the round trips saved
+OLD_WAIT_INTERVAL = 0.1
+OLD_GAME_END_INTERVAL = 0.5
+OLD_COUNTDOWN_INTERVAL = 10
+
 logger = logging.getLogger('detsbot')
 
 async def _run_in_executor(func, *args):
@@ -33,46 +46,136 @@ class QuitException(Exception):
 
 class Jstris(GameInterface):
 	"""Handles the interaction with the jstris website."""
-	def __init__(self):
-		profile = FirefoxProfile()
-		profile.set_preference('media.volume_scale', '0.0') # Mute audio
-		self.driver = Firefox(firefox_profile=profile)
+	def __init__(self, wait_polling=None, game_end_polling=None, results_log=None, checkpoint=None):
+		self._driver = None
+		self.driver_lock = threading.Lock()
 
 		self.clients = None
 		self.players = None
+		self.allowed_names = None
+		self.roster = Roster()
 		self.join_link = None
 		self.state = GameState.STOPPED
 
 		self.quit_flag = False
-
-	async def create_game(self, live=False):
+		self.forecaster = None
+		self.results_log = results_log
+		self.checkpoint = checkpoint
+		self.pending_results = None
+		self.pending_match_id = None
+
+		self.wait_polling = wait_polling if wait_polling is not None else PollingPolicy()
+		if game_end_polling is None:
+			game_end_polling = PollingPolicy(min_interval=0.25, max_interval=2.0, fast_window=10.0)
+		self.game_end_polling = game_end_polling
+		self.polling_stats = PollingStats()
+		self.typical_game_length = 90.0
+
+	@property
+	def driver(self):
+		"""The browser, which is only launched when first needed (it takes seconds to start)."""
+		# Executor threads may ask for it at the same time: only one of them launches it
+		with self.driver_lock:
+			if self._driver is None:
+				profile = FirefoxProfile()
+				profile.set_preference('media.volume_scale', '0.0') # Mute audio
+				self._driver = Firefox(firefox_profile=profile)
+			return self._driver
+
+	def close(self):
+		"""Quit the browser (if it was launched). Blocks, so run it in an executor."""
+		with self.driver_lock:
+			if self._driver is not None:
+				self._driver.quit()
+				self._driver = None
+
+	async def create_game(self, live=False, allowed_names=None):
 		await _run_in_executor(self._create_game, live)
+		if allowed_names is not None:
+			self.allowed_names = set(name.lower() for name in allowed_names)
 		self.state = GameState.CREATED
+		self.polling_stats = PollingStats()
+		self._save_checkpoint()
+
+		return self.get_join_link()
 
+	async def resume_game(self):
+		saved = self.checkpoint.load() if self.checkpoint is not None else {}
+		if saved.get('join_link') is None:
+			return None
+
+		try:
+			await _run_in_executor(self._reattach, saved['join_link'])
+		except (NoSuchElementException, TimeoutException):
+			logger.warning('Could not reattach to lobby %s', saved['join_link'])
+			self.checkpoint.clear()
+			await _run_in_executor(self._log_in)
+			return None
+
+		if saved['clients'] is not None:
+			self.clients = {int(pid): name for (pid, name) in saved['clients'].items()}
+		if saved['players'] is not None:
+			self.players = set(saved['players'])
+		if saved.get('allowed_names') is not None:
+			self.allowed_names = set(saved['allowed_names'])
+		self.pending_results = saved['pending_results']
+		self.pending_match_id = saved.get('pending_match_id')
+		self.typical_game_length = saved['typical_game_length']
+		self.state = GameState[saved['state']]
+		self.polling_stats = PollingStats()
 		return self.get_join_link()
 
 	def get_join_link(self):
 		return self.join_link
 
 	async def watch_and_get_results(self):
+		# After resume_game(), first deliver the result of the match that was interrupted
+		(pending, self.pending_results) = (self.pending_results, None)
+		(match_id, self.pending_match_id) = (self.pending_match_id, None)
+		if pending is None and self.state == GameState.RUNNING:
+			try:
+				pending = await asyncio.wait_for(self._wait_for_game_end(), RESUMED_GAME_TIMEOUT)
+			except asyncio.TimeoutError:
+				logger.warning('Gave up waiting for the result of the interrupted match')
 		self.state = GameState.WATCHING
 
 		while self.state != GameState.STOPPED and not self.quit_flag:
 			try:
-				result = await self._run_a_match()
+				if pending is not None:
+					(result, pending) = (pending, None)
+				else:
+					result = await self._run_a_match()
 				if result is not None:
-					yield result
+					match_id = match_id if match_id is not None else uuid.uuid4().hex
+					# Until the result has been processed, a restart should deliver it again
+					self._save_checkpoint(pending_results=result, pending_match_id=match_id)
+					yield (match_id, result)
+					self._save_checkpoint()
+				match_id = None
 			except QuitException:
 				break
+		logger.info(self.polling_stats.summary())
+		if self.checkpoint is not None:
+			self.checkpoint.clear()
 		await _run_in_executor(self._log_in)
 
 	async def quit(self): #TODO implement quit
 		self.quit_flag = True
 
 	async def force_quit(self): #TODO make this not break everything
+		if self.checkpoint is not None:
+			self.checkpoint.clear()
 		await _run_in_executor(self._log_in)
 		self.quit_flag = True
 
+	async def get_player_names(self):
+		if self.state == GameState.STOPPED:
+			return []
+		return await _run_in_executor(self._get_registered_player_names)
+
+	def set_forecaster(self, forecaster):
+		self.forecaster = forecaster
+
 	def get_state(self):
 		return self.state
 
@@ -93,8 +196,33 @@ class Jstris(GameInterface):
 		# Go to spectator mode
 		self._send_chat('/spec', private_only=False)
 
+	def _reattach(self, join_link):
+		"""Log in and rejoin a lobby (as a spectator), after a restart."""
+		self._log_in()
+		self.driver.get(JSTRIS_URL if join_link == 'live' else join_link)
+		self._wait_js('return typeof Live != "undefined" && typeof Game != "undefined"')
+		self._setup_script()
+		self.join_link = join_link
+		self._send_chat('/spec', private_only=False)
+
+	def _save_checkpoint(self, pending_results=None, pending_match_id=None):
+		"""Save the lobby state, so that resume_game() can pick it up after a restart."""
+		if self.checkpoint is None:
+			return
+		self.checkpoint.save({
+			'join_link': self.join_link,
+			'state': self.state.name,
+			'clients': self.clients,
+			'players': sorted(self.players) if self.players is not None else None,
+			'allowed_names': sorted(self.allowed_names) if self.allowed_names is not None else None,
+			'pending_results': pending_results,
+			'pending_match_id': pending_match_id,
+			'typical_game_length': self.typical_game_length,
+		})
+
 	def _log_in(self):
 		"""Ensures we are logged in, exits any lobby"""
+		from credentials import jstris_creds
 		self._reset_game_info()
 
 		self.driver.get(JSTRIS_URL + '/login')
@@ -109,6 +237,8 @@ class Jstris(GameInterface):
 		"""Reset any info we get in a game"""
 		self.clients = None
 		self.players = None
+		self.allowed_names = None
+		self.roster = Roster()
 		self.join_link = None
 		self.state = GameState.STOPPED
 
@@ -169,6 +299,8 @@ class Jstris(GameInterface):
 				dr.apply(this, arguments);
 				window.gameResults = arguments[0];
 			};""")
+		self.driver.execute_script(ROSTER_SCRIPT)
+		self.roster = Roster()
 		time.sleep(0.1) #TODO hacky
 
 	# Methods involved in running a match
@@ -182,6 +314,7 @@ class Jstris(GameInterface):
 
 			self._send_chat("Starting now!")
 			self.state = GameState.RUNNING
+			self._save_checkpoint()
 			result = await self._wait_for_game_end()
 			self.state = GameState.WATCHING
 			return result
@@ -216,42 +349,59 @@ class Jstris(GameInterface):
 		self._send_chat("Not enough registered players to start game.")
 		return False
 
-	_HAVE_TWO_PLAYERS_JOINED_JS = r"""
-		var players = [];
-		for (var i = 0; i < game.Live.players.length; i++) {
-			var player = game.Live.players[i];
-			var regex = /^<a href="\/u\/.+" target="_blank">.*<\/a>$/;
-			if (game.Live.getName(player).match(regex)) {
-				players.push(player);
-			}
-		}
-		return players.length >= 2;
-		"""
-
 	def _have_players_joined(self):
 		"""Check if 2 registered players have joined."""
-		return self.driver.execute_script(Jstris._HAVE_TWO_PLAYERS_JOINED_JS)
+		return self.driver.execute_script(HAVE_TWO_PLAYERS_JOINED_JS)
 
 	async def _wait_for_players_to_join(self, timeout):
 		"""Wait for 2 registered players to join, using async_wait."""
-		return await self._async_wait_js(Jstris._HAVE_TWO_PLAYERS_JOINED_JS, timeout=timeout)
+		return await self._async_wait_js(HAVE_TWO_PLAYERS_JOINED_JS, timeout=timeout)
 
 	async def _count_down_to_start_game(self):
-		"""Count down to the game start, checking intermittently if _have_players_joined()."""
+		"""
+		Count down to the game start in chat, checking if _have_players_joined() as often as
+		wait_polling says: quickly at first, when players are most likely to leave again, then
+		backing off (so a player leaving is noticed within wait_polling.max_interval).
+		"""
 		wait_time = 20
 		wait_incr = 10
-		time_waited = 0
 		starting_in = 'Starting next game in {:d} seconds...'
+		start_time = time.perf_counter()
+		next_message = 0
+		polls = 0
+		try:
+			while True:
+				polls += 1
+				if not self._have_players_joined():
+					return False
+				elapsed = time.perf_counter() - start_time
+				if elapsed >= wait_time:
+					return True
+
+				if elapsed >= next_message:
+					self._send_chat(starting_in.format(wait_time - next_message))
+					if next_message == 0:
+						self._send_forecast()
+					next_message += wait_incr
+				interval = self.wait_polling.next_interval(polls - 1)
+				await asyncio.sleep(min(interval, min(next_message, wait_time) - elapsed))
+		finally:
+			self.polling_stats.record(polls, time.perf_counter() - start_time, OLD_COUNTDOWN_INTERVAL)
+
+	def _send_forecast(self):
+		"""Send each registered player's odds for the upcoming game to the chat."""
+		if self.forecaster is None:
+			return
 
-		while time_waited < wait_time:
-			if not self._have_players_joined():
-				return False
-
-			self._send_chat(starting_in.format(wait_time - time_waited))
-			await asyncio.sleep(wait_incr)
-			time_waited += wait_incr
+		(players, _, forecast) = self.forecaster(self._get_registered_player_names())
+		if forecast is None:
+			return
 
-		return self._have_players_joined()
+		(_, expected_scores, place_deltas) = forecast
+		odds_msg = '{}: expected to beat {:.2f} of {:d}, {:+.2f} if 1st, {:+.2f} if last'
+		for (i, player) in enumerate(players):
+			self._send_chat(odds_msg.format(player.name, expected_scores[i], len(players) - 1,
+			                                place_deltas[i][0], place_deltas[i][-1]))
 
 	def _start_game(self):
 		self._click_button('res')
@@ -260,24 +410,30 @@ class Jstris(GameInterface):
 
 	def _start_game_setup(self):
 		self.driver.execute_script("window.gameResults = null")
-		self.clients = self._get_clients()
-
-		self.players = set()
-		player_ids = self._get_registered_players()
-		for player_id in player_ids:
-			self.players.add(player_id)
+		# Re-check every client rather than relying on join/leave events, as this decides who is rated
+		self._update_roster(force=True)
+		self.clients = self.roster.get_clients()
+		self.players = self.roster.get_registered_players()
 
 		print("Players:")
 		print(set(self.clients.get(pid, "UNKNOWN") for pid in self.players))
 		sys.stdout.flush()
 
 	async def _wait_for_game_end(self):
-		"""Wait for a tetris game to end."""
+		"""Wait for a tetris game to end, polling most often around the typical game length."""
+		start_time = time.perf_counter()
+		polls = 0
 		while True:
 			self._check_connection()
+			polls += 1
+			now = time.perf_counter()
 			if self._has_game_ended():
+				# Each poll is two round trips: checking the connection, and checking for results
+				self.polling_stats.record(polls, now - start_time, OLD_GAME_END_INTERVAL, 2)
+				self.typical_game_length = 0.8 * self.typical_game_length + 0.2 * (now - start_time)
 				return self._get_game_results()
-			await asyncio.sleep(0.5)
+			time_to_end = start_time + self.typical_game_length - now
+			await asyncio.sleep(self.game_end_polling.next_interval(polls - 1, time_to_end))
 
 	def _check_connection(self):
 		"""Raise an exception if the client javascript thinks we are disconnected."""
@@ -291,26 +447,19 @@ class Jstris(GameInterface):
 		"""Get the results of the last game that was played in this room."""
 		results = self.driver.execute_script("return window.gameResults")
 		self.driver.execute_script("window.oldGameResults = window.gameResults")
-		results_players = set()
+		if self.results_log is not None:
+			self.results_log.write(results, self.clients, self.players, lobby=self.join_link,
+			                       allowed_names=self.allowed_names)
 
-		results_list = []
 		for result in results:
-			player_id = result['c']
-			name = self.clients.get(player_id, 'UNKNOWN')
-			if result['forfeit']:
-				continue
-			if player_id not in self.players:
-				print('Ignoring %s, unregistered' % name)
-				continue
-
-			results_players.add(player_id)
-			results_list.append({'id': result['c'], 'name': name, 'score': float(result['t'])})
-
-		missing_players = self.players - results_players
-		for player_id in missing_players:
-			results_list.append({'id': player_id,
-			                     'name': self.clients.get(player_id, 'UNKNOWN'),
-			                     'score': 0.0})
+			if not result['forfeit'] and result['c'] not in self.players:
+				print('Ignoring %s, unregistered' % self.clients.get(result['c'], 'UNKNOWN'))
+		if self.allowed_names is not None:
+			for player_id in self.players:
+				name = self.clients.get(player_id, 'UNKNOWN')
+				if name.lower() not in self.allowed_names:
+					print('Ignoring %s, not matched into this lobby' % name)
+		results_list = parse_game_results(results, self.clients, self.players, self.allowed_names)
 
 		print("Results:")
 		pprinter = pprint.PrettyPrinter()
@@ -328,37 +477,14 @@ class Jstris(GameInterface):
 		if self.join_link != "live" or not private_only:
 			self.driver.find_element_by_id('chatInput').send_keys(text + Keys.ENTER)
 
-	def _get_clients(self):
-		"""Get the list of other people in the room, players or spectators.
+	def _update_roster(self, force=False):
+		"""Fetch the changes to the room's clients since the roster's version, and apply them."""
+		self.roster.apply(self.driver.execute_script(GET_ROSTER_CHANGES_JS, self.roster.version, force))
 
-		Returns a dictionary of player_id -> player_name
-		"""
-		raw_clients = self.driver.execute_script("""
-			var clients = {};
-			for (client in window.game.Live.clients) {
-				clients[client] = window.game.Live.clients[client].name;
-			};
-			return clients;
-		""")
-
-		clients = {}
-		for (pid_str, name) in raw_clients.items():
-			clients[int(pid_str)] = name
-		return clients
-
-	def _get_registered_players(self):
-		"""Get the list of players who are logged in."""
-		return self.driver.execute_script(r"""
-			var players = [];
-			for (var i = 0; i < game.Live.players.length; i++) {
-				var player = game.Live.players[i];
-				var regex = /^<a href="\/u\/.+" target="_blank">.*<\/a>$/;
-				if (game.Live.getName(player).match(regex)) {
-					players.push(player);
-				}
-			}
-			return players;
-		""")
+	def _get_registered_player_names(self):
+		"""Get the names of the players who are logged in."""
+		self._update_roster()
+		return self.roster.get_registered_player_names()
 
 	def _click_button(self, element_id):
 		"""Click a button on the page by element id."""
@@ -389,21 +515,28 @@ class Jstris(GameInterface):
 		return self._wait(lambda driver: driver.execute_script(javascript), timeout=timeout)
 
 	async def _async_wait(self, condition, message='', timeout=10):
-		"""Wait for a condition on the current webpage."""
-		end_time = time.perf_counter() + timeout
+		"""Wait for a condition on the current webpage, polling according to wait_polling."""
+		start_time = time.perf_counter()
+		end_time = start_time + timeout
 		screen = None
 		stacktrace = None
-		while True:
-			try:
-				value = condition(self.driver)
-				if value:
-					return value
-			except NoSuchElementException as exc:
-				screen = getattr(exc, 'screen', None)
-				stacktrace = getattr(exc, 'stacktrace', None)
-			await asyncio.sleep(0.1)
-			if time.perf_counter() > end_time:
-				raise TimeoutException(message, screen, stacktrace)
+		polls = 0
+		try:
+			while True:
+				polls += 1
+				try:
+					value = condition(self.driver)
+					if value:
+						return value
+				except NoSuchElementException as exc:
+					screen = getattr(exc, 'screen', None)
+					stacktrace = getattr(exc, 'stacktrace', None)
+				now = time.perf_counter()
+				if now > end_time:
+					raise TimeoutException(message, screen, stacktrace)
+				await asyncio.sleep(min(self.wait_polling.next_interval(polls - 1), end_time - now))
+		finally:
+			self.polling_stats.record(polls, time.perf_counter() - start_time, OLD_WAIT_INTERVAL)
 
 	async def _async_wait_js(self, javascript, timeout=10):
 		"""Wait for a javascript expression to return true."""
@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+"""Decides how often to poll the jstris page, and counts how many polls that saves."""
+
+import random
+import time
+
+class PollingPolicy:
+	"""
+	Backs off exponentially while nothing happens, but polls quickly around an expected event.
+
+	min_interval -- seconds between polls at first, and near an expected event
+	max_interval -- the longest wait between polls, once backed off
+	backoff -- how much longer each wait is than the last, while idle
+	fast_window -- polls at min_interval within this many seconds either side of an expected event
+	jitter -- each wait is randomly lengthened or shortened by up to this fraction
+	"""
+	def __init__(self, min_interval=0.1, max_interval=2.0, backoff=1.5, fast_window=3.0, jitter=0.2):
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.backoff = backoff
+		self.fast_window = fast_window
+		self.jitter = jitter
+
+	def next_interval(self, idle_polls, time_to_event=None):
+		"""
+		Returns how long to wait before the next poll.
+
+		idle_polls -- the number of polls made so far without the condition being met
+		time_to_event -- seconds until an expected event (negative if overdue), or None
+		"""
+		interval = min(self.min_interval * self.backoff ** idle_polls, self.max_interval)
+		if time_to_event is not None:
+			if abs(time_to_event) <= self.fast_window:
+				interval = self.min_interval
+			elif time_to_event > self.fast_window:
+				# Don't sleep through the start of the fast window
+				interval = min(interval, time_to_event - self.fast_window)
+		return max(interval * random.uniform(1 - self.jitter, 1 + self.jitter), 0.0)
+
+class PollingStats:
+	"""Counts the round trips made by polling, against polling at the old fixed intervals."""
+	def __init__(self):
+		self.started = time.perf_counter()
+		self.round_trips = 0
+		self.baseline_round_trips = 0.0
+
+	def record(self, polls, elapsed, baseline_interval, round_trips_per_poll=1):
+		"""Record a finished wait, which made <polls> polls over <elapsed> seconds."""
+		self.round_trips += polls * round_trips_per_poll
+		# Fixed-interval polling checks once straight away, then once after every interval
+		self.baseline_round_trips += (1 + int(elapsed / baseline_interval)) * round_trips_per_poll
+
+	def get_round_trips_saved(self):
+		return self.baseline_round_trips - self.round_trips
+
+	def get_round_trips_saved_per_hour(self):
+		hours = (time.perf_counter() - self.started) / 3600
+		return self.get_round_trips_saved() / hours if hours > 0 else 0.0
+
+	def summary(self):
+		return 'Polling: %d round trips (%d at fixed intervals), saving %.0f per lobby-hour' % (
+			self.round_trips, self.baseline_round_trips, self.get_round_trips_saved_per_hour())
@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+"""Records the raw results of jstris games to compressed JSON-lines files, and reads them back."""
+
+import glob
+import gzip
+import json
+import os
+import time
+import zlib
+
+def parse_game_results(raw_results, clients, players, allowed_names=None):
+	"""
+	Convert a raw jstris gameResults payload into the results that are rated.
+
+	Forfeits and unregistered players are left out, and registered players with no result get a
+	score of 0.
+
+	raw_results -- the list of result dicts from window.gameResults
+	clients -- dict of player_id -> name, for everyone in the room
+	players -- set of the ids of the registered players in the game
+	allowed_names -- if given, the lowercased names of the only players to keep (as in a
+		matchmade lobby)
+	returns a list of {'id': player_id, 'name': name, 'score': score}
+	"""
+	if allowed_names is not None:
+		players = set(player_id for player_id in players
+		              if clients.get(player_id, 'UNKNOWN').lower() in allowed_names)
+	results_players = set()
+	results_list = []
+	for result in raw_results:
+		player_id = result['c']
+		if result['forfeit'] or player_id not in players:
+			continue
+
+		results_players.add(player_id)
+		results_list.append({'id': player_id, 'name': clients.get(player_id, 'UNKNOWN'),
+		                     'score': float(result['t'])})
+
+	for player_id in players - results_players:
+		results_list.append({'id': player_id, 'name': clients.get(player_id, 'UNKNOWN'), 'score': 0.0})
+	return results_list
+
+class ResultsLog:
+	"""
+	Appends raw game results to gzipped JSON-lines files in a directory.
+
+	A new file is started once the current one reaches max_bytes, and old files are kept, so the
+	directory holds the whole history. Each record is flushed as it is written, so a crash loses
+	at most the record being written.
+	"""
+	def __init__(self, directory, max_bytes=16 * 1024 * 1024):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.file = None
+		self.path = None
+		os.makedirs(directory, exist_ok=True)
+
+	def write(self, raw_results, clients, players, lobby=None, allowed_names=None):
+		"""
+		Record one game's raw results, with the clients, players and allowed_names (see
+		parse_game_results) needed to parse them.
+		"""
+		record = {'time': time.time(), 'lobby': lobby, 'clients': clients,
+		          'players': sorted(players), 'results': raw_results,
+		          'allowed_names': sorted(allowed_names) if allowed_names is not None else None}
+		if self.file is None or os.path.getsize(self.path) >= self.max_bytes:
+			self._rotate()
+		self.file.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+		self.file.flush()
+
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	def _rotate(self):
+		"""Close the current file (if any) and start the next one."""
+		self.close()
+		paths = get_log_paths(self.directory)
+		number = int(os.path.basename(paths[-1]).split('-')[1].split('.')[0]) + 1 if paths else 1
+		self.path = os.path.join(self.directory, 'results-%06d.jsonl.gz' % number)
+		self.file = gzip.open(self.path, 'ab')
+
+def get_log_paths(directory):
+	"""Returns the paths of the log files in a directory, oldest first."""
+	return sorted(glob.glob(os.path.join(directory, 'results-*.jsonl.gz')))
+
+def read_results_log(directory):
+	"""
+	Yields every record in a results log directory, oldest first.
+
+	Client ids are converted back to ints, and players (and allowed_names, None in records from
+	before it was logged) back to sets. A record cut short by a crash (at the end of a file) is
+	skipped, and a file whose compressed data is cut short or corrupted is read up to that point.
+	"""
+	for path in get_log_paths(directory):
+		with gzip.open(path, 'rt', encoding='utf-8') as log_file:
+			try:
+				for line in log_file:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						continue
+					record['clients'] = {int(pid): name for (pid, name) in record['clients'].items()}
+					record['players'] = set(record['players'])
+					if record.get('allowed_names') is not None:
+						record['allowed_names'] = set(record['allowed_names'])
+					else:
+						record['allowed_names'] = None
+					yield record
+			except (EOFError, gzip.BadGzipFile, zlib.error):
+				pass
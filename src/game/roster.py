@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+"""Tracks who is in a jstris room, from versioned changes recorded in the page."""
+
+# The script injected into the lobby page, which keeps window.roster: every client in the room, and
+# whether they are a registered (logged in) player. Jstris' handler names aren't a public API, so
+# every Live method that looks like a join, leave or rename handler is wrapped to mark the roster
+# as changed; the roster is then only re-checked after one of those events (or every RESYNC_MS, in
+# case an event was missed). Re-checking compares each client to what is already known, and only
+# runs the registered player regex for clients who are new, renamed, or moved to/from spectating.
+# Each change gets a version, and the last MAX_CHANGES changes are kept, so that getChanges(since)
+# can return just what changed since the version the caller already has (or everyone, with reset
+# set, if that is too far back).
+ROSTER_SCRIPT = r"""
+	if (window.roster == null) {
+		window.roster = (function() {
+			var REGISTERED = /^<a href="\/u\/.+" target="_blank">.*<\/a>$/;
+			var HANDLER = /join|leave|left|rename/i;
+			var MAX_CHANGES = 500;
+			var RESYNC_MS = 1000;
+			var roster = {version: 0, firstVersion: 1, changes: [], clients: {}, registeredCount: 0,
+			              hooked: 0, dirty: true, lastSync: 0};
+
+			function record(change) {
+				roster.version++;
+				roster.changes.push(change);
+				if (roster.changes.length > MAX_CHANGES) {
+					roster.changes.shift();
+					roster.firstVersion++;
+				}
+			}
+
+			function set(id, name, playing, live) {
+				var known = roster.clients[id];
+				if (known && known.name === name && known.playing === playing) {
+					return;
+				}
+				var registered = playing && REGISTERED.test(live.getName(id));
+				if (known && known.registered) {
+					roster.registeredCount--;
+				}
+				if (registered) {
+					roster.registeredCount++;
+				}
+				roster.clients[id] = {name: name, playing: playing, registered: registered};
+				record(['set', id, name, registered]);
+			}
+
+			roster.sync = function(force) {
+				if (window.game == null) {
+					return;
+				}
+				var now = Date.now();
+				if (!force && roster.hooked > 0 && !roster.dirty && now - roster.lastSync < RESYNC_MS) {
+					return;
+				}
+				roster.dirty = false;
+				roster.lastSync = now;
+
+				var live = window.game.Live;
+				var playing = {};
+				for (var i = 0; i < live.players.length; i++) {
+					playing[live.players[i]] = true;
+				}
+				var seen = {};
+				for (var key in live.clients) {
+					var id = parseInt(key, 10);
+					seen[id] = true;
+					set(id, live.clients[key].name, playing[id] === true, live);
+				}
+				// Players who aren't in the clients list are still counted, without a name
+				for (var j = 0; j < live.players.length; j++) {
+					if (!seen[live.players[j]]) {
+						seen[live.players[j]] = true;
+						set(live.players[j], null, true, live);
+					}
+				}
+				for (var known in roster.clients) {
+					if (!seen[known]) {
+						if (roster.clients[known].registered) {
+							roster.registeredCount--;
+						}
+						delete roster.clients[known];
+						record(['remove', parseInt(known, 10)]);
+					}
+				}
+			};
+
+			roster.countRegistered = function() {
+				roster.sync(false);
+				return roster.registeredCount;
+			};
+
+			roster.getChanges = function(since, force) {
+				roster.sync(force);
+				if (since >= roster.firstVersion - 1 && since <= roster.version) {
+					return {version: roster.version, reset: false,
+					        changes: roster.changes.slice(since - roster.firstVersion + 1)};
+				}
+				var changes = [];
+				for (var id in roster.clients) {
+					var client = roster.clients[id];
+					changes.push(['set', parseInt(id, 10), client.name, client.registered]);
+				}
+				return {version: roster.version, reset: true, changes: changes};
+			};
+
+			Object.getOwnPropertyNames(Live.prototype).forEach(function(method) {
+				var original = Live.prototype[method];
+				if (typeof original == 'function' && HANDLER.test(method) && !/^get/.test(method)) {
+					Live.prototype[method] = function() {
+						roster.dirty = true;
+						return original.apply(this, arguments);
+					};
+					roster.hooked++;
+				}
+			});
+			return roster;
+		})();
+	}"""
+
+GET_ROSTER_CHANGES_JS = 'return window.roster.getChanges(arguments[0], arguments[1])'
+
+HAVE_TWO_PLAYERS_JOINED_JS = 'return window.roster != null && window.roster.countRegistered() >= 2'
+
+class Roster:
+	"""
+	The clients in a jstris room (players or spectators), and which of them are registered players.
+
+	Kept up to date by applying the changes from window.roster.getChanges(roster.version).
+	"""
+	def __init__(self):
+		self.version = 0
+		self.names = {}
+		self.registered = set()
+
+	def apply(self, update):
+		"""Apply the result of window.roster.getChanges()."""
+		if update['reset']:
+			self.names = {}
+			self.registered = set()
+		for change in update['changes']:
+			client_id = change[1]
+			if change[0] == 'remove':
+				self.names.pop(client_id, None)
+				self.registered.discard(client_id)
+				continue
+
+			self.names[client_id] = change[2]
+			if change[3]:
+				self.registered.add(client_id)
+			else:
+				self.registered.discard(client_id)
+		self.version = update['version']
+		return self
+
+	def get_clients(self):
+		"""Returns a dict of client id -> name, for everyone in the room (with a name)."""
+		return {client_id: name for (client_id, name) in self.names.items() if name is not None}
+
+	def get_registered_players(self):
+		"""Returns the set of the ids of the registered players."""
+		return set(self.registered)
+
+	def get_registered_player_names(self):
+		return [self.names[client_id] for client_id in sorted(self.registered)
+		        if self.names.get(client_id) is not None]
+
+def _main():
+	roster = Roster()
+	roster.apply({'version': 3, 'reset': False, 'changes': [['set', 1, 'Derg', True],
+	                                                        ['set', 2, 'Starlis', True],
+	                                                        ['set', 3, 'Lurker', False]]})
+	roster.apply({'version': 5, 'reset': False, 'changes': [['remove', 2],
+	                                                        ['set', 3, 'Pepega', True]]})
+	print('Version %d, clients %s, players %s' % (roster.version, roster.get_clients(),
+	                                                roster.get_registered_player_names()))
+	roster.apply({'version': 600, 'reset': True, 'changes': [['set', 4, 'Derg', True]]})
+	print('After a reset: clients %s, players %s' % (roster.get_clients(),
+	                                                 roster.get_registered_players()))
+
+if __name__ == '__main__':
+	_main()
@@ -4,37 +4,82 @@
 import asyncio
 import sys
 import time
+import traceback
 
 from db import SQLiteDatabase
-import ui
-from game import Jstris
-from model import JstrisModel
+import game
+from model import Checkpoint, JstrisModel
+
+# Startup is timed from once the modules are imported (tools/bench_startup.py times the imports).
+# ui (and so discord) is only imported by main(), but numpy is imported with the rating engine
+STARTED = time.perf_counter()
 
 def dump(*args, **kwargs):
 	"""Alias for print and flush stdout."""
 	print(*args, **kwargs)
 	sys.stdout.flush()
 
+def _since_start():
+	return time.perf_counter() - STARTED
+
+async def _create_indexes_when_ready(bot, database):
+	"""Build any missing database indexes once the bot has connected (they only speed up queries)."""
+	await bot.wait_until_ready()
+	dump('bot ready after %.2fs' % _since_start())
+	try:
+		# In another thread, so the bot keeps responding meanwhile
+		await asyncio.get_running_loop().run_in_executor(None,
+		                                                 database.create_indexes_on_own_connection)
+	except Exception:
+		# The bot still works without them, just slower
+		traceback.print_exc()
+		return
+	dump('database indexes ready after %.2fs' % _since_start())
+
 async def main():
 	"""Sets up everything from the different modules and starts the discord bot."""
+	bot = None
+	jstris = None
+	database = None
+	model = None
 	try:
-		database = SQLiteDatabase('players.db')
-		jstris = Jstris()
+		import ui
+		# Start connecting first, and set everything else up meanwhile: commands wait for the model
+		dump('starting bot...')
+		(bot, task) = await ui.start_bot(checkpoint=Checkpoint('bot.checkpoint'))
+		dump('bot connecting after %.2fs' % _since_start())
+
+		database = SQLiteDatabase('players.db', snapshot_path='players.snapshot',
+		                          profile='--profile-db' in sys.argv, defer_indexes=True)
+		# The browser is only launched when the first lobby is created or resumed. The lobby
+		# checkpoint is kept on shutdown, so a restart reattaches to the same lobby
+		jstris = game.Jstris(results_log=game.ResultsLog('results_log'),
+		                     checkpoint=Checkpoint('lobby.checkpoint'))
 		model = JstrisModel(jstris, database)
+		bot.get_cog('JstrisCog').set_model(model)
+		dump('model ready after %.2fs' % _since_start())
 
-		dump('starting bot...')
-		(bot, task) = await ui.start_bot(model)
-		dump('bot started...')
+		indexes_task = asyncio.create_task(_create_indexes_when_ready(bot, database))
 		await task
-		input('...')
+		indexes_task.cancel()
 
 	except Exception as exc:
 		print("Exc:", exc)
 		raise exc
 	finally:
-		time.sleep(5)
-		await bot.close()
-		jstris.driver.quit()
+		if bot is not None:
+			await bot.close()
+		if jstris is not None:
+			if jstris.results_log is not None:
+				jstris.results_log.close()
+			await asyncio.get_running_loop().run_in_executor(None, jstris.close)
+		if model is not None:
+			model.simulator.close()
+		if database is not None:
+			report = database.get_profile_report()
+			if report is not None:
+				dump(report)
+			database.close()
 
 if __name__ == '__main__':
 	asyncio.run(main())
@@ -1,3 +1,4 @@
 from .game_interface import GameInterface, GameState
-from .main_model import JstrisModel
+from .main_model import JstrisModel, ConcurrentUpdateError
 from .db_interface import DatabaseInterface
+from .checkpoint import Checkpoint
@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+"""A small JSON file of state, saved atomically, to pick up where we left off after a restart."""
+
+import json
+import os
+
+class Checkpoint:
+	"""
+	Keeps a dict of (JSON-serializable) fields in a file.
+
+	Every update rewrites the whole file, through a temporary file and an atomic rename, so the
+	file always holds either the old or the new fields, even if the process dies mid-write.
+	"""
+	def __init__(self, path):
+		self.path = path
+
+	def load(self):
+		"""Returns the saved fields (an empty dict if there is no checkpoint, or it is unreadable)."""
+		try:
+			with open(self.path, encoding='utf-8') as checkpoint_file:
+				return json.load(checkpoint_file)
+		except (OSError, ValueError):
+			return {}
+
+	def save(self, fields):
+		"""Replace the saved fields."""
+		temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+		with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+			json.dump(fields, checkpoint_file)
+		os.replace(temp_path, self.path)
+
+	def update(self, **fields):
+		"""Change some of the saved fields, keeping the rest."""
+		saved = self.load()
+		saved.update(fields)
+		self.save(saved)
+
+	def clear(self):
+		"""Delete the checkpoint."""
+		try:
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
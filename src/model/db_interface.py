@@ -10,14 +10,66 @@ class DatabaseInterface(ABC):
 	def read_player(self, name, create_if_not_found=True):
 		"""Fetch a player from the database by name (perhaps creating them if not found)"""
 
+	@abstractmethod
+	def read_players(self, names):
+		"""Fetch several players from the database at once (None for each name not found)"""
+
 	@abstractmethod
 	def update_player(self, player):
-		"""Update a player in the database"""
+		"""Update a player in the database (whatever their stored version)"""
+
+	@abstractmethod
+	def compare_and_swap_players(self, players):
+		"""
+		Update several players, but only if none were saved since they were read.
+
+		Either every player is saved (with their versions incremented) and True is returned, or
+		no player is saved (because one's version no longer matches the database) and False is.
+		"""
 
 	@abstractmethod
 	def delete_player(self, name):
 		"""Delete a player from the database (by name)"""
 
+	@abstractmethod
+	def decay_ratings(self, inactive_since, decay, floor, after=None, amount=5000):
+		"""
+		Lower by <decay> (but not below <floor>) the rating of each player not seen since the
+		timestamp <inactive_since>, for the next <amount> players after the position <after>.
+
+		The maintenance methods work through the players in chunks: each returns the position to
+		pass as <after> for the next chunk (None once every player is done), and leaves committing
+		to the caller.
+		"""
+
+	@abstractmethod
+	def soft_reset_ratings(self, center, factor, after=None, amount=5000):
+		"""Move the next chunk of players' ratings towards <center>, keeping <factor> of the gap"""
+
+	@abstractmethod
+	def archive_standings(self, season, after=None, amount=5000):
+		"""Copy the next chunk of players' ratings and games played into the season's standings"""
+
+	@abstractmethod
+	def get_season_standings(self, season, amount=20, offset=0):
+		"""Fetch the season's top <amount> (name, rating, games_played), offset by [offset]"""
+
+	@abstractmethod
+	def get_maintenance_state(self, job):
+		"""Fetch the state saved for a maintenance job (a JSON-compatible dict), or None if none"""
+
+	@abstractmethod
+	def set_maintenance_state(self, job, state):
+		"""Save the state of a maintenance job (without committing, like the maintenance methods)"""
+
+	@abstractmethod
+	def search_players(self, query, amount=10):
+		"""Returns the names of up to <amount> players whose names best match query, best first"""
+
+	@abstractmethod
+	def get_rating_histogram(self):
+		"""Returns the RatingHistogram of every player's rating (kept up to date, not to be changed)"""
+
 	@abstractmethod
 	def get_ranking(self, player):
 		"""Get the ranking of the player by querying the database"""
@@ -30,10 +82,38 @@ class DatabaseInterface(ABC):
 	def count_players(self):
 		"""Returns the number of players in the database"""
 
+	@abstractmethod
+	def read_player_stats(self, names):
+		"""Fetch several players' PlayerStats at once (None for each player without any)"""
+
+	@abstractmethod
+	def update_player_stats(self, stats):
+		"""Save an iterable of PlayerStats"""
+
+	@abstractmethod
+	def replace_player_stats(self, stats):
+		"""Replace every player's stats with an iterable of PlayerStats, in bulk"""
+
+	@abstractmethod
+	def update_head_to_head(self, outcomes):
+		"""Add matchup outcomes, (name1, name2, actual score of name1), to the head-to-head records"""
+
+	@abstractmethod
+	def get_head_to_head(self, name1, name2):
+		"""Fetch the HeadToHead record of player name1 against name2 (None if they never played)"""
+
+	@abstractmethod
+	def get_rivals(self, name, amount=5):
+		"""Fetch the HeadToHead records of the player against the <amount> opponents played most"""
+
 	@abstractmethod
 	def create_game(self, game):
 		"""Save a game to the database"""
 
+	@abstractmethod
+	def has_match(self, match_id):
+		"""Returns True if a game with the given match_id has been saved"""
+
 	@abstractmethod
 	def delete_game(self, game_id):
 		"""Delete a game from the database (by id)"""
@@ -42,6 +122,26 @@ class DatabaseInterface(ABC):
 	def get_games(self, amount, offset=0, player_name=None):
 		"""Fetch the last <amount> games played (offset by [offset]) played by [player_name]."""
 
+	@abstractmethod
+	def import_players(self, players):
+		"""Save players from an iterable in bulk, replacing any existing players with the same name"""
+
+	@abstractmethod
+	def export_players(self):
+		"""Iterate over every player in the database (as a generator)"""
+
+	@abstractmethod
+	def import_games(self, games):
+		"""Save games from an iterable in bulk, keeping their ids (if set)"""
+
+	@abstractmethod
+	def export_games(self):
+		"""Iterate over every game in the database, oldest first (as a generator)"""
+
 	@abstractmethod
 	def commit(self):
 		"""Writes saved changes to the database"""
+
+	@abstractmethod
+	def get_profile_report(self):
+		"""Returns a text report of where the database has spent its time (None if not profiling)"""
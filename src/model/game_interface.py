@@ -8,8 +8,22 @@ class GameInterface(ABC):
 	"""Manages the actual running of the games."""
 
 	@abstractmethod
-	async def create_game(self, live=False):
-		"""Create a new lobby for the game. Returns the join link (moves directly to CREATED state)"""
+	async def create_game(self, live=False, allowed_names=None):
+		"""
+		Create a new lobby for the game. Returns the join link (moves directly to CREATED state)
+
+		allowed_names -- if given, only these players' results are reported (e.g. for the players a
+			lobby was matchmade for), whoever else joins
+		"""
+
+	@abstractmethod
+	async def resume_game(self):
+		"""
+		Reattach to the lobby we were in before a restart, if there was one.
+
+		Returns the join link (None if there was no lobby to reattach to). If a match was running,
+		its result is the first one yielded by watch_and_get_results.
+		"""
 
 	@abstractmethod
 	def get_join_link(self):
@@ -24,7 +38,9 @@ class GameInterface(ABC):
 		Intermittently enters RUNNING state, while a match is running.
 		When the generator is done, will enter STOPPED state.
 
-		Is a generator, yields lists of [(Player, Score), ...]
+		Is a generator, yields (match_id, [(Player, Score), ...]) for each match, where match_id
+		is unique to the match (so that one delivered again after a restart can be recognised), or
+		None if the game can't tell its matches apart
 		"""
 
 	@abstractmethod
@@ -38,6 +54,17 @@ class GameInterface(ABC):
 	async def force_quit(self):
 		"""Stops running matches and leaves the lobby IMMEDIATELY (moves directly to STOPPED state)"""
 
+	@abstractmethod
+	async def get_player_names(self):
+		"""Get the names of the registered players currently in the lobby (empty if STOPPED)"""
+
+	@abstractmethod
+	def set_forecaster(self, forecaster):
+		"""
+		Announce each match's odds in the lobby before it starts, with forecaster(names) returning
+		(players, missing_names, forecast) like JstrisModel.forecast (or None for no forecasts)
+		"""
+
 	@abstractmethod
 	def get_state(self):
 		"""Get the current state of the game manager, as a GameState object"""
@@ -1,43 +1,134 @@
 #! /usr/bin/env python3
 """Mediates the interaction between UI (detsbot) and other layers (jstris, elo, etc)."""
 
+import asyncio
 import math
+import time
 
-from entities import Elo
+from entities import Elo, Game, PlacementSimulator, PlayerStats
+from entities import compute_player_stats, get_matchup_outcomes, get_placements
 from model import GameInterface, GameState
+from .matchmaking import MatchmakingQueue
+
+# How many times to re-rate a game whose players were changed by someone else in the meantime
+MAX_RATING_ATTEMPTS = 5
+
+# Maintenance jobs commit (and let other tasks run) after every chunk of this many players
+MAINTENANCE_CHUNK_SIZE = 5000
+
+# Inactivity decay: players who haven't played for DECAY_INACTIVE_DAYS lose DECAY_AMOUNT rating
+# on each run, down to DECAY_FLOOR
+DECAY_INACTIVE_DAYS = 28
+DECAY_AMOUNT = 5
+DECAY_FLOOR = 1000
+DECAY_INTERVAL = 24 * 60 * 60
+
+# A new season moves ratings towards SEASON_CENTER, keeping SEASON_RESET_FACTOR of the gap
+SEASON_CENTER = 1000
+SEASON_RESET_FACTOR = 0.5
+
+# The names the maintenance jobs save their progress under (see set_maintenance_state)
+DECAY_JOB = 'decay'
+SEASON_JOB = 'season'
+
+class ConcurrentUpdateError(Exception):
+	"""Raised if a game's players keep being saved by someone else while it is being rated."""
 
 class JstrisModel():
 	"""Mediates the interaction between UI (detsbot) and other layers (jstris, elo, etc)."""
-	def __init__(self, jstris: GameInterface, database):
+	def __init__(self, jstris: GameInterface, database, rating_engine=None, sessions=None):
+		"""sessions -- the games that matchmade lobbies can be run in (by default, just jstris)"""
 		self.jstris = jstris
+		self.sessions = sessions if sessions is not None else [jstris]
+		# Sessions a lobby is being created in: they still look STOPPED until create_game returns
+		self.starting_sessions = set()
+		# Held by the run of each maintenance job, as two runs would both resume from its state
+		self.job_locks = {DECAY_JOB: asyncio.Lock(), SEASON_JOB: asyncio.Lock()}
 		#pylint: disable=invalid-name
 		self.db = database
 		self.elo = Elo()
+		self.rating_engine = rating_engine if rating_engine is not None else self.elo
+		self.simulator = PlacementSimulator(self.elo)
+		self.matchmaking = MatchmakingQueue(self.rating_engine.estimate_score)
+		for session in set(self.sessions + [self.jstris]):
+			session.set_forecaster(self.forecast)
 
 	async def watch_live(self):
 		"""Starts watching live."""
-		if self.jstris.state != GameState.STOPPED:
+		if not self._is_free(self.jstris):
 			return
 
-		await self.jstris.create_game(live=True)
+		await self._start_lobby(self.jstris, lambda: self.jstris.create_game(live=True))
 
 	async def watch_lobby(self):
 		"""Creates a new lobby, returns the join link."""
-		if self.jstris.state != GameState.STOPPED:
+		if not self._is_free(self.jstris):
 			return
 
-		return await self.jstris.create_game()
+		return await self._start_lobby(self.jstris, self.jstris.create_game)
+
+	async def resume_lobby(self):
+		"""Reattaches to the lobby from before a restart, returns the join link (None if none)."""
+		if not self._is_free(self.jstris):
+			return None
+
+		return await self._start_lobby(self.jstris, self.jstris.resume_game)
+
+	async def run_matches(self, session=None):
+		"""Runs and processes the game matches (in session, or by default jstris)."""
+		session = session if session is not None else self.jstris
+		async for (match_id, result) in session.watch_and_get_results():
+			# A match delivered again after a restart may have been rated before the restart
+			if match_id is not None and self.db.has_match(match_id):
+				continue
+			yield self._process_game_results(result, match_id)
+
+
+	def join_queue(self, name, data=None):
+		"""Adds the player to the matchmaking queue. Returns False if they are already queued."""
+		return self.matchmaking.join(self.db.read_player(name), data)
 
-	async def run_matches(self):
-		"""Runs and processes the game matches."""
-		async for result in self.jstris.watch_and_get_results():
-			yield self._process_game_results(result)
+	def leave_queue(self, name):
+		"""Removes the player from the matchmaking queue. Returns False if they weren't queued."""
+		return self.matchmaking.leave(name)
 
+	def get_queue_status(self):
+		"""Returns (number of players queued, {percentile: seconds waited} or None)."""
+		return (self.matchmaking.get_depth(), self.matchmaking.get_wait_percentiles())
+
+	async def start_matched_lobbies(self):
+		"""
+		Forms balanced groups from the queue, and creates a lobby for each in a free session.
+
+		Only the group's players are rated in its lobby. Groups left over when every session is busy
+		(or whose lobby could not be created) go back in the queue.
+		returns a list of (group of QueueEntry, session, join link)
+		"""
+		lobbies = []
+		groups = self.matchmaking.form_lobbies()
+		free_sessions = [session for session in self.sessions if self._is_free(session)]
+		# Claim the sessions before awaiting, so nothing else starts a lobby in them meanwhile
+		claimed = list(zip(groups, free_sessions))
+		self.starting_sessions.update(session for (_, session) in claimed)
+		try:
+			for (group, session) in claimed:
+				join_link = await session.create_game(
+					allowed_names=[entry.player.name for entry in group])
+				lobbies.append((group, session, join_link))
+		finally:
+			self.starting_sessions.difference_update(session for (_, session) in claimed)
+			for group in groups[len(lobbies):]:
+				self.matchmaking.requeue(group)
+		return lobbies
 
 	def get_player(self, name):
 		"""Returns the player (None if not found)."""
 		return self.db.read_player(name, create_if_not_found=False)
 
+	def search_players(self, query, amount=10):
+		"""Returns the names of the players whose names best match query."""
+		return self.db.search_players(query, amount)
+
 	def set_player_rating(self, name, rating):
 		"""Sets the player's elo."""
 		player = self.get_player(name)
@@ -66,6 +157,128 @@ class JstrisModel():
 
 		return (player, self.db.get_ranking(player))
 
+	def get_rating_distribution(self):
+		"""Returns the RatingHistogram of every player's rating."""
+		return self.db.get_rating_histogram()
+
+	def get_top_percent(self, rating):
+		"""Returns the percentage of players rated at least <rating> (without reading any players)."""
+		return 100 * self.db.get_rating_histogram().get_top_fraction(rating)
+
+	def get_db_profile(self):
+		"""Returns the database's profiling report (None if it isn't being profiled)."""
+		return self.db.get_profile_report()
+
+	def get_player_stats(self, name):
+		"""Returns the player's PlayerStats (None if they have not played any games)."""
+		return self.db.read_player_stats([name])[0]
+
+	def rebuild_player_stats(self):
+		"""Recomputes every player's stats from the game history, in one streaming pass."""
+		self.db.replace_player_stats(compute_player_stats(self.db.export_games()).values())
+		self.db.commit()
+
+	def get_head_to_head(self, name1, name2):
+		"""Returns player name1's HeadToHead record against name2 (None if they never played)."""
+		return self.db.get_head_to_head(name1, name2)
+
+	def get_rivals(self, name, amount=5):
+		"""Returns the player's HeadToHead records against the opponents they played most."""
+		return self.db.get_rivals(name, amount)
+
+	async def decay_inactive_ratings(self, inactive_days=DECAY_INACTIVE_DAYS, decay=DECAY_AMOUNT,
+	                                 floor=DECAY_FLOOR):
+		"""
+		Lowers the rating of every inactive player, in chunks, between other tasks. Players with no
+		recorded game are never decayed.
+
+		If the last run was interrupted (by a restart), it is finished instead of starting a new one.
+		Returns False (doing nothing) if decay is already running.
+		"""
+		if self.job_locks[DECAY_JOB].locked():
+			return False
+		async with self.job_locks[DECAY_JOB]:
+			state = self.db.get_maintenance_state(DECAY_JOB)
+			if state is None or state['phase'] == 'done':
+				now = time.time()
+				state = {'phase': 'decay', 'after': None, 'started': now, 'decay': decay,
+				         'floor': floor, 'inactive_since': now - inactive_days * 24 * 60 * 60}
+			await self._run_in_chunks(DECAY_JOB, state, dict(state, phase='done', after=None),
+			                          lambda after: self.db.decay_ratings(
+				state['inactive_since'], state['decay'], state['floor'], after, MAINTENANCE_CHUNK_SIZE))
+		return True
+
+	async def run_scheduled_decay(self, interval=DECAY_INTERVAL):
+		"""Runs decay_inactive_ratings every <interval> seconds (across restarts too), forever."""
+		while True:
+			if self.job_locks[DECAY_JOB].locked():
+				# Decay was started by hand: wait for it to finish
+				async with self.job_locks[DECAY_JOB]:
+					pass
+			state = self.db.get_maintenance_state(DECAY_JOB)
+			if state is not None and state['phase'] == 'done':
+				delay = state['started'] + interval - time.time()
+				if delay > 0:
+					# Check again afterwards, in case decay was run by hand meanwhile
+					await asyncio.sleep(delay)
+					continue
+			await self.decay_inactive_ratings()
+
+	async def roll_over_season(self, season, factor=SEASON_RESET_FACTOR):
+		"""
+		Archives the standings of the season that is ending, then soft-resets every rating.
+
+		A roll-over of the season that was interrupted (by a restart or an error) picks up where it
+		stopped. Returns False (doing nothing) if the season was already rolled over. Raises
+		ValueError if another season is being rolled over, or this one already is.
+		"""
+		if self.job_locks[SEASON_JOB].locked():
+			raise ValueError('A season is already being rolled over')
+		async with self.job_locks[SEASON_JOB]:
+			return await self._roll_over_season(season, factor)
+
+	async def _roll_over_season(self, season, factor):
+		"""roll_over_season, once it holds the season job's lock."""
+		state = self.db.get_maintenance_state(SEASON_JOB)
+		if state is not None and state['season'] == season and state['phase'] == 'done':
+			return False
+		if state is not None and state['season'] != season and state['phase'] != 'done':
+			raise ValueError('Season %s has not finished rolling over' % state['season'])
+		if state is None or state['season'] != season:
+			state = {'phase': 'archive', 'after': None, 'season': season, 'factor': factor}
+
+		if state['phase'] == 'archive':
+			reset_state = dict(state, phase='reset', after=None)
+			await self._run_in_chunks(SEASON_JOB, state, reset_state, lambda after:
+				self.db.archive_standings(season, after, MAINTENANCE_CHUNK_SIZE))
+			state = reset_state
+		await self._run_in_chunks(SEASON_JOB, state, dict(state, phase='done', after=None), lambda after:
+			self.db.soft_reset_ratings(SEASON_CENTER, state['factor'], after, MAINTENANCE_CHUNK_SIZE))
+		return True
+
+	def get_season_standings(self, season, page=1, page_size=20):
+		"""Returns a page of an archived season's final (name, rating, games_played)."""
+		return self.db.get_season_standings(season, page_size, (page - 1) * page_size)
+
+	async def _run_in_chunks(self, job, state, done_state, step):
+		"""
+		Calls step(after) from state['after'] until it returns None, committing after each call.
+
+		Each commit also saves the job's state, with the position reached as 'after' (or done_state
+		once every player is done), so an interrupted job never repeats a chunk it has committed.
+		Between chunks, other tasks (like processing game results) get to run, so a job over every
+		player never holds up the bot for long.
+		"""
+		after = state['after']
+		while True:
+			after = step(after)
+			self.db.set_maintenance_state(job, dict(state, after=after) if after is not None
+			                              else done_state)
+			self.db.commit()
+			if after is None:
+				return
+			await asyncio.sleep(0)
+
 	def get_leaderboard(self, page=1, page_size=20):
 		"""Returns a list of the top rated players (20 per page by default)."""
 		return (list(self.db.get_leaderboard(page_size, (page - 1) * page_size)),
@@ -73,26 +286,114 @@ class JstrisModel():
 
 	def simulate_1v1(self, player1, player2):
 		"""Returns player1's estimated winrate against player2."""
-		return self.elo.estimate_score_vs_one(player1.rating, player2.rating)
+		return self.rating_engine.estimate_score(player1, player2)
 
-	def _process_game_results(self, raw_results):
-		# TODO fix the disaster that happens when people enter a game more than once
-		results = [(self.db.read_player(res['name']), res['score']) for res in raw_results]
+	def forecast(self, names):
+		"""
+		Forecasts a game between the given players (by name), with one database read.
 
-		elo_result = self.elo.report_game(results)
-		if elo_result is None:
-			return None
+		returns (players, missing_names, forecast), where forecast is the result of Elo.forecast
+		(None if fewer than two of the players were found)
+		"""
+		(players, missing_names) = self._read_named_players(names)
+		return (players, missing_names, self.elo.forecast(players))
 
-		(players, scores, score_changes) = elo_result
-		for player in players:
-			self.db.update_player(player)
+	async def simulate_placements(self, names, num_samples=200000, seed=None):
+		"""
+		Simulates many games between the given players (by name), off the event loop.
+
+		returns (players, missing_names, simulation), where simulation is the result of
+		PlacementSimulator.simulate (None if fewer than two of the players were found)
+		"""
+		(players, missing_names) = self._read_named_players(names)
+
+		loop = asyncio.get_running_loop()
+		simulation = await loop.run_in_executor(None, self.simulator.simulate,
+		                                        players, num_samples, seed)
+		return (players, missing_names, simulation)
+
+	async def get_lobby_player_names(self):
+		"""Returns the names of the registered players in the current lobby."""
+		return await self.jstris.get_player_names()
+
+	def _read_named_players(self, names):
+		"""
+		Reads the given players in one database read, each once however many times (or in whatever
+		case) their name was given. Returns (players, missing_names).
+		"""
+		seen_names = set()
+		unique_names = []
+		for name in names:
+			if name.lower() not in seen_names:
+				seen_names.add(name.lower())
+				unique_names.append(name)
+		found = self.db.read_players(unique_names)
+		players = [player for player in found if player is not None]
+		missing_names = [name for (name, player) in zip(unique_names, found) if player is None]
+		return (players, missing_names)
+
+	def _is_free(self, session):
+		"""Returns True if no lobby is running, or being started, in the session."""
+		return session.get_state() == GameState.STOPPED and session not in self.starting_sessions
+
+	async def _start_lobby(self, session, start):
+		"""Awaits start() (creating or rejoining a lobby in session), with the session marked busy."""
+		self.starting_sessions.add(session)
+		try:
+			return await start()
+		finally:
+			self.starting_sessions.discard(session)
+
+	def _process_game_results(self, raw_results, match_id=None):
+		# A player who entered the game more than once only counts once, with their first result
+		seen_names = set()
+		unique_results = []
+		for res in raw_results:
+			if res['name'].lower() not in seen_names:
+				seen_names.add(res['name'].lower())
+				unique_results.append(res)
+
+		# Other lobbies (or processes) may save the same players meanwhile: if so, re-read and re-rate
+		for _ in range(MAX_RATING_ATTEMPTS):
+			results = [(self.db.read_player(res['name']), res['score']) for res in unique_results]
+			rating_result = self.rating_engine.report_game(results)
+			if rating_result is None:
+				return None
+
+			(players, scores, score_changes) = rating_result
+			if self.db.compare_and_swap_players(players):
+				break
+		else:
+			raise ConcurrentUpdateError('Players %s kept changing while rating their game'
+			                            % ', '.join(sorted(seen_names)))
+		# The match is recorded as processed in the same commit as its ratings
+		game = Game([(player.name, score, delta, player.rating)
+		             for (player, score, delta) in zip(players, scores, score_changes)],
+		            match_id=match_id)
+		self._update_player_stats(players, scores, game.timestamp)
+		self.db.update_head_to_head(get_matchup_outcomes([player.name for player in players], scores))
+		self.db.create_game(game)
 		self.db.commit()
 
 		return zip(players, scores, score_changes)
 
-	async def quit_watching(self):
-		"""Quits watching matches"""
-		await self.jstris.quit()
+	def _update_player_stats(self, players, scores, timestamp):
+		"""Record a processed game in its players' stats (without committing)."""
+		all_stats = self.db.read_player_stats([player.name for player in players])
+		for (i, (player, place)) in enumerate(zip(players, get_placements(scores))):
+			if all_stats[i] is None:
+				all_stats[i] = PlayerStats(player.name)
+			all_stats[i].record_game(place, player.rating, timestamp)
+		self.db.update_player_stats(all_stats)
+
+	async def quit_watching(self, session=None):
+		"""Quits watching matches (in session, or by default jstris)"""
+		session = session if session is not None else self.jstris
+		await session.quit()
+
+	async def abandon_lobby(self, session):
+		"""Leaves the lobby in session straight away (e.g. if nobody could be told where it is)."""
+		await session.force_quit()
 
 	def run(self):
 		"""Set up the various modules and wait for input from detsbot."""
@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+"""Groups queued players into lobbies of similar skill."""
+
+import bisect
+import collections
+import time
+
+class QueueEntry:
+	"""A player waiting in the matchmaking queue."""
+	def __init__(self, player, joined_at, data=None):
+		"""data -- anything the caller wants back with the player's lobby (e.g. who to notify)"""
+		self.player = player
+		self.joined_at = joined_at
+		self.data = data
+
+	def get_key(self):
+		"""The entry's place in the queue: highest rated first, then longest waiting."""
+		return (-self.player.rating, self.joined_at, self.player.name.lower())
+
+class MatchmakingQueue:
+	"""
+	Keeps waiting players sorted by rating, and forms lobbies of neighbouring players.
+
+	A group is balanced if the strongest player's expected score against the weakest is at most
+	0.5 + tolerance. The tolerance starts at base_tolerance, and widens by widen_rate per second
+	that the longest waiting player in the group has waited, up to max_tolerance. Groups smaller
+	than lobby_size (but at least min_lobby_size) are only formed once someone has waited for
+	fill_timeout seconds.
+
+	estimate_score -- function(player, opponent) returning player's expected score against opponent
+	"""
+	def __init__(self, estimate_score, lobby_size=4, min_lobby_size=2, base_tolerance=0.1,
+	             widen_rate=0.005, max_tolerance=0.45, fill_timeout=60.0, wait_history=1000):
+		self.estimate_score = estimate_score
+		self.lobby_size = lobby_size
+		self.min_lobby_size = min_lobby_size
+		self.base_tolerance = base_tolerance
+		self.widen_rate = widen_rate
+		self.max_tolerance = max_tolerance
+		self.fill_timeout = fill_timeout
+
+		self.keys = []
+		self.entries = {}
+		self.waits = collections.deque(maxlen=wait_history)
+
+	def join(self, player, data=None, now=None):
+		"""Add a player to the queue. Returns False if they are already queued."""
+		if player.name.lower() in self.entries:
+			return False
+		entry = QueueEntry(player, now if now is not None else time.monotonic(), data)
+		self._insert(entry)
+		return True
+
+	def leave(self, name):
+		"""Remove a player from the queue (by name). Returns False if they weren't queued."""
+		entry = self.entries.pop(name.lower(), None)
+		if entry is None:
+			return False
+		del self.keys[bisect.bisect_left(self.keys, entry.get_key())]
+		return True
+
+	def requeue(self, entries):
+		"""Put entries back in the queue, keeping how long they waited (e.g. if no lobby was free)."""
+		for entry in entries:
+			if entry.player.name.lower() not in self.entries:
+				self._insert(entry)
+
+	def get_depth(self):
+		return len(self.entries)
+
+	def get_tolerance(self, wait):
+		return min(self.base_tolerance + self.widen_rate * wait, self.max_tolerance)
+
+	def form_lobbies(self, now=None):
+		"""
+		Take as many balanced groups as possible out of the queue, in one pass from the highest
+		rated player down. Returns a list of groups, each a list of QueueEntry, strongest first.
+		"""
+		now = now if now is not None else time.monotonic()
+		queued = [self.entries[key[2]] for key in self.keys]
+		groups = []
+		i = 0
+		while i <= len(queued) - self.min_lobby_size:
+			group = self._best_group(queued, i, now)
+			if group is None:
+				i += 1
+				continue
+			groups.append(group)
+			i += len(group)
+
+		taken = set()
+		for group in groups:
+			for entry in group:
+				taken.add(entry.player.name.lower())
+				del self.entries[entry.player.name.lower()]
+				self.waits.append(now - entry.joined_at)
+		self.keys = [key for key in self.keys if key[2] not in taken]
+		return groups
+
+	def get_wait_percentiles(self, percentiles=(50, 90, 99)):
+		"""Returns {percentile: seconds waited} over recently matched players (None if none yet)."""
+		if len(self.waits) == 0:
+			return None
+		waits = sorted(self.waits)
+		return {percentile: waits[min(int(len(waits) * percentile / 100), len(waits) - 1)]
+		        for percentile in percentiles}
+
+	def _best_group(self, queued, start, now):
+		"""Returns the largest balanced group starting at queued[start] (None if there is none)."""
+		largest = min(self.lobby_size, len(queued) - start)
+		for size in range(largest, self.min_lobby_size - 1, -1):
+			group = queued[start:start + size]
+			wait = now - min(entry.joined_at for entry in group)
+			if size < self.lobby_size and wait < self.fill_timeout:
+				continue
+			expected = self.estimate_score(group[0].player, group[-1].player)
+			if expected - 0.5 <= self.get_tolerance(wait):
+				return group
+		return None
+
+	def _insert(self, entry):
+		self.entries[entry.player.name.lower()] = entry
+		bisect.insort(self.keys, entry.get_key())
+
+def _main():
+	from entities import Elo, Player
+	queue = MatchmakingQueue(Elo().estimate_score)
+	for (i, rating) in enumerate([1500, 1480, 1200, 1000, 990, 700]):
+		queue.join(Player('Player%d' % i, rating), now=0)
+	for now in (1, 30, 61):
+		groups = queue.form_lobbies(now)
+		print('After %ds: %s' % (now, [[entry.player.rating for entry in group] for group in groups]))
+	print('Waits:', queue.get_wait_percentiles())
+
+if __name__ == '__main__':
+	_main()
@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+"""Compares the memory taken by Player objects with and without __slots__.
+
+Usage: python -m tools.bench_player [num_players]
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+
+from entities import Player
+
+class DictPlayer:
+	"""Player as it was before __slots__, with a __dict__ per instance."""
+	def __init__(self, name, rating=1000, k=32, rd=350, volatility=0.06, version=0):
+		self.name = name
+		self.rating = rating
+		self.k = k
+		self.rd = rd
+		self.volatility = volatility
+		self.version = version
+
+def _measure(build):
+	"""Returns (result of build(), bytes allocated by it, seconds taken)."""
+	tracemalloc.start()
+	start = time.perf_counter()
+	result = build()
+	elapsed = time.perf_counter() - start
+	(allocated, _) = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return (result, allocated, elapsed)
+
+def bench_memory(names, ratings):
+	"""Print the memory taken by the players (not counting the name strings)."""
+	print('%-22s %10s %10s' % ('memory', 'MB', 'build s'))
+	builds = [('Player (__dict__)', lambda: list(map(DictPlayer, names, ratings))),
+	          ('Player (__slots__)', lambda: list(map(Player, names, ratings)))]
+	for (label, build) in builds:
+		(_, allocated, elapsed) = _measure(build)
+		print('%-22s %10.1f %10.2f' % (label, allocated / 1e6, elapsed))
+
+def main():
+	"""Run the benchmark."""
+	num_players = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+	random.seed(0)
+	names = ['player%07d' % i for i in range(num_players)]
+	ratings = [random.gauss(1000, 200) for _ in range(num_players)]
+	print('%d players' % num_players)
+	bench_memory(names, ratings)
+
+if __name__ == '__main__':
+	main()
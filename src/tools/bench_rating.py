@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+"""Compares the throughput and predictive accuracy of the rating engines on the same game log.
+
+Usage: python -m tools.bench_rating [num_players] [num_games] [period_size]
+"""
+
+import contextlib
+import io
+import math
+import sys
+import time
+
+from entities import Player, Elo, Glicko2
+from tools.synthetic import generate_games
+
+def _periods(games, period_size):
+	for start in range(0, len(games), period_size):
+		yield games[start:start + period_size]
+
+def _with_players(games):
+	"""
+	Replace names with fresh Player objects, so each engine starts from the same ratings.
+
+	returns (every player, the games)
+	"""
+	players = {}
+	games = [[(players.setdefault(name, Player(name)), score) for (name, score) in game]
+	         for game in games]
+	return (list(players.values()), games)
+
+def measure_accuracy(engine, games, period_size):
+	"""
+	Replay the games, predicting every matchup in a rating period before processing the period.
+
+	returns (log_loss, accuracy), averaged over every matchup (accuracy ignores draws)
+	"""
+	(total_loss, matchups, correct, decisive) = (0.0, 0, 0, 0)
+	(_, games) = _with_players(games)
+	# Players are rated once they have played (a dict, to keep them in order)
+	rated_players = {}
+	for period in _periods(games, period_size):
+		for game in period:
+			for i in range(len(game) - 1):
+				for j in range(i + 1, len(game)):
+					((player1, score1), (player2, score2)) = (game[i], game[j])
+					prob = min(max(engine.estimate_score(player1, player2), 1e-12), 1 - 1e-12)
+					actual = Elo.get_actual_score(score1, score2)
+					total_loss -= actual * math.log(prob) + (1 - actual) * math.log(1 - prob)
+					matchups += 1
+					if actual != 0.5:
+						decisive += 1
+						correct += (prob > 0.5) == (actual == 1)
+		with contextlib.redirect_stdout(io.StringIO()):
+			engine.process_rating_period(period, rated_players)
+		rated_players.update((player, None) for game in period for (player, _) in game)
+	return (total_loss / matchups, correct / decisive)
+
+def measure_throughput(engine, games, period_size):
+	"""Returns the number of games processed per second (excluding predictions)."""
+	(players, games) = _with_players(games)
+	periods = list(_periods(games, period_size))
+	with contextlib.redirect_stdout(io.StringIO()):
+		start = time.perf_counter()
+		for period in periods:
+			engine.process_rating_period(period, players)
+		elapsed = time.perf_counter() - start
+	return len(games) / elapsed
+
+def main():
+	"""Run the benchmark."""
+	num_players = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+	num_games = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+	period_size = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+
+	(_, games) = generate_games(num_players, num_games)
+	print('%d games between %d players, rating periods of %d games' % (num_games, num_players, period_size))
+	print('%-8s %12s %10s %10s' % ('engine', 'games/s', 'log-loss', 'accuracy'))
+
+	# Elo updates after every game, Glicko-2 once per rating period
+	engines = [('elo', Elo, 1), ('glicko2', Glicko2, period_size)]
+	for (name, engine_class, engine_period_size) in engines:
+		throughput = measure_throughput(engine_class(), games, engine_period_size)
+		(log_loss, accuracy) = measure_accuracy(engine_class(), games, engine_period_size)
+		print('%-8s %12.0f %10.4f %9.2f%%' % (name, throughput, log_loss, 100 * accuracy))
+
+if __name__ == '__main__':
+	main()
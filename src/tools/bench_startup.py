@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+"""Times the bot's startup path, and fails if it is over budget.
+
+Usage: python -m tools.bench_startup [num_players] [runs]
+
+Each measurement runs in a fresh interpreter (so nothing is already imported), [runs] times, and
+the median is compared to its budget in BUDGETS. Startup is also checked to stay lazy: the browser
+driver (selenium), discord and the credentials must not be imported until they are needed. Exits
+with status 1 if anything is over budget or imported too early, or if a step couldn't be timed
+because its dependencies aren't installed.
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import sqlite3
+import tempfile
+import time
+
+from db import SQLiteDatabase
+from db.sqlite_db import INDEXES
+from entities import Game, Player
+
+# Seconds allowed for each step of startup
+BUDGETS = {
+	'import entities': 0.5,
+	'import db': 0.6,
+	'import model': 0.6,
+	'import game': 0.6,
+	'import ui': 1.5,
+	'import main': 2.0,
+	'open database': 0.25,
+	'build model': 0.1,
+}
+
+# Modules which must not have been imported after importing each module
+LAZY_IMPORTS = {
+	'game': ['selenium', 'game.jstris', 'credentials'],
+	'ui': ['credentials'],
+	'main': ['selenium', 'game.jstris', 'ui', 'discord', 'credentials'],
+}
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import %s
+print(time.perf_counter() - start)
+print(' '.join(sorted(sys.modules)))
+'''
+
+_STARTUP_SCRIPT = '''
+import sys, time
+from db import SQLiteDatabase
+from model import JstrisModel
+import game
+
+start = time.perf_counter()
+database = SQLiteDatabase(sys.argv[1], defer_indexes=True)
+opened = time.perf_counter()
+session = game.Jstris()
+JstrisModel(session, database)
+built = time.perf_counter()
+if getattr(session, '_driver', None) is not None:
+	raise AssertionError('the browser was launched at startup')
+print(opened - start)
+print(built - opened)
+'''
+
+class MissingModuleError(Exception):
+	"""A script couldn't run because a module isn't installed."""
+	def __init__(self, module):
+		super().__init__('%s is not installed' % module)
+		self.module = module
+
+def _run(script, *args):
+	"""Run a script in a fresh interpreter, returning its output lines."""
+	process = subprocess.run([sys.executable, '-c', script] + list(args), cwd=SRC_DIR,
+	                         capture_output=True, text=True, check=False)
+	if process.returncode != 0:
+		missing = re.search(r"ModuleNotFoundError: No module named '([\w.]+)'", process.stderr)
+		if missing is not None:
+			raise MissingModuleError(missing.group(1))
+		raise RuntimeError(process.stderr)
+	return process.stdout.splitlines()
+
+def time_import(module, runs):
+	"""Returns (median seconds to import module, the modules it imported)."""
+	times = []
+	for _ in range(runs):
+		output = _run(_IMPORT_SCRIPT % module)
+		times.append(float(output[0]))
+	return (statistics.median(times), set(output[1].split()))
+
+def time_startup(db_file, runs):
+	"""Returns the median seconds to (open the database, build the model)."""
+	results = [[float(line) for line in _run(_STARTUP_SCRIPT, db_file)] for _ in range(runs)]
+	return tuple(statistics.median(column) for column in zip(*results))
+
+def seed_database(db_file, num_players):
+	"""Create a database of players and a game for every four of them, with every index built."""
+	database = SQLiteDatabase(db_file)
+	database.import_players(Player('player%d' % i, 1000 + i % 800) for i in range(num_players))
+	database.import_games(Game([('player%d' % (i + j), 30.0 * j, 0.0, 1000.0) for j in range(4)])
+	                      for i in range(0, num_players - 3, 4))
+	database.close()
+
+def time_deferred_indexes(db_file):
+	"""Returns the seconds taken to build the indexes (as on a first run), which startup defers."""
+	# Take the database back to how an older version left it, before the indexes existed
+	conn = sqlite3.connect(db_file)
+	for index in INDEXES:
+		conn.execute('DROP INDEX IF EXISTS %s' % index)
+	conn.execute('DELETE FROM name_trigrams')
+	conn.commit()
+	conn.close()
+
+	database = SQLiteDatabase(db_file, defer_indexes=True)
+	start = time.perf_counter()
+	database.create_indexes()
+	elapsed = time.perf_counter() - start
+	database.close()
+	return elapsed
+
+def main():
+	"""Run the benchmark."""
+	num_players = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+	timings = {}
+	problems = []
+	for module in ('entities', 'db', 'model', 'game', 'ui', 'main'):
+		try:
+			(timings['import ' + module], imported) = time_import(module, runs)
+		except MissingModuleError as exc:
+			timings['import ' + module] = exc
+			if exc.module.split('.')[0] in LAZY_IMPORTS.get(module, []):
+				problems.append('importing %s imports %s' % (module, exc.module))
+			continue
+		for lazy_module in LAZY_IMPORTS.get(module, []):
+			if lazy_module in imported:
+				problems.append('importing %s imports %s' % (module, lazy_module))
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_file = os.path.join(temp_dir, 'players.db')
+		seed_database(db_file, num_players)
+		try:
+			(timings['open database'], timings['build model']) = time_startup(db_file, runs)
+		except MissingModuleError as exc:
+			timings['open database'] = timings['build model'] = exc
+		deferred = time_deferred_indexes(db_file)
+
+	print('%-18s %9s %9s' % ('step (%d runs)' % runs, 'median s', 'budget s'))
+	for (step, budget) in BUDGETS.items():
+		elapsed = timings[step]
+		if isinstance(elapsed, MissingModuleError):
+			print('%-18s %9s %9.3f  SKIPPED, budget not checked (%s)' % (step, '-', budget, elapsed))
+			problems.append('%s was not timed: %s' % (step, elapsed))
+			continue
+		over = elapsed > budget
+		print('%-18s %9.3f %9.3f%s' % (step, elapsed, budget, '  OVER BUDGET' if over else ''))
+		if over:
+			problems.append('%s took %.3fs (budget %.3fs)' % (step, elapsed, budget))
+
+	print('(building the indexes of %d players, deferred until connected: %.3fs)'
+	      % (num_players, deferred))
+
+	for problem in problems:
+		print('FAIL:', problem)
+	if problems:
+		sys.exit(1)
+	print('ok')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+"""Replays a results log through JstrisModel as fast as possible, without a browser.
+
+Usage: python -m tools.replay results_log_dir [players_export_file]
+
+Prints the throughput and a fingerprint of the final ratings, so a change to result handling or the
+rating rules can be checked against real games. The final ratings can also be exported (as with
+db.bulk) for a closer comparison.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import io
+import sys
+import time
+
+from db import MemoryDatabase, bulk
+from game.results_log import parse_game_results, read_results_log
+from model import GameInterface, GameState, JstrisModel
+
+class ReplayGame(GameInterface):
+	"""Plays back the games in a results log, as if they were being watched live."""
+	def __init__(self, directory):
+		self.directory = directory
+		self.state = GameState.STOPPED
+		self.quit_flag = False
+		self.forecaster = None
+
+	async def create_game(self, live=False, allowed_names=None):
+		self.state = GameState.CREATED
+		return self.get_join_link()
+
+	async def resume_game(self):
+		return None
+
+	def get_join_link(self):
+		return None if self.state == GameState.STOPPED else 'replay'
+
+	async def watch_and_get_results(self):
+		self.state = GameState.WATCHING
+		for record in read_results_log(self.directory):
+			if self.quit_flag:
+				break
+			yield (None, parse_game_results(record['results'], record['clients'], record['players'],
+			                                record['allowed_names']))
+		self.state = GameState.STOPPED
+
+	async def quit(self):
+		self.quit_flag = True
+
+	async def force_quit(self):
+		self.quit_flag = True
+
+	async def get_player_names(self):
+		return []
+
+	def set_forecaster(self, forecaster):
+		self.forecaster = forecaster
+
+	def get_state(self):
+		return self.state
+
+def ratings_fingerprint(database):
+	"""Returns a hash of every player's name and rating (to 6 decimal places)."""
+	digest = hashlib.sha256()
+	for player in sorted(database.export_players(), key=lambda player: player.name.lower()):
+		digest.update(('%s\t%.6f\n' % (player.name.lower(), player.rating)).encode('utf-8'))
+	return digest.hexdigest()
+
+async def replay(directory, database):
+	"""Replays every game in the log into the database. Returns (games, seconds taken)."""
+	model = JstrisModel(ReplayGame(directory), database)
+	await model.watch_lobby()
+	games = 0
+	start = time.perf_counter()
+	# The rating engine prints every game's rating changes, which would dominate the timing
+	with contextlib.redirect_stdout(io.StringIO()):
+		async for _ in model.run_matches():
+			games += 1
+	return (games, time.perf_counter() - start)
+
+def main():
+	"""Run the replay."""
+	if len(sys.argv) < 2:
+		print(__doc__)
+		return
+
+	database = MemoryDatabase()
+	(games, elapsed) = asyncio.run(replay(sys.argv[1], database))
+	print('%d games replayed in %.2fs (%.0f games/s)' % (games, elapsed, games / max(elapsed, 1e-9)))
+	print('%d players, ratings fingerprint %s' % (database.count_players(),
+	                                              ratings_fingerprint(database)))
+	if len(sys.argv) > 2:
+		bulk.export_file(database, 'players', sys.argv[2])
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+"""Soaks the bot's read commands with concurrent callers, and reports their latency.
+
+Usage: python -m tools.soak [concurrency] [seconds] [num_players] [match_interval] [database_file]
+
+JstrisCog's d/leaderboard, d/player and d/simulate callbacks are called directly with a stub
+context and bot (no Discord connection), by [concurrency] callers at once for [seconds], against a
+database seeded with synthetic games. If [match_interval] is above 0, a simulated match stream is
+processed alongside, finishing a game every [match_interval] seconds. Prints the p50/p95/p99
+latency of each command and the event loop's lag (how late a short sleep wakes up), and if
+[database_file] is given, the SQLite statement profile of the soak.
+"""
+
+import asyncio
+import contextlib
+import io
+import random
+import sys
+import time
+
+import numpy as np
+
+from db import MemoryDatabase, SQLiteDatabase
+from model import GameInterface, GameState, JstrisModel
+from tools.synthetic import generate_games
+from ui.detsbot import JstrisCog
+
+# How often the event loop lag is sampled, in seconds
+LAG_INTERVAL = 0.01
+
+class StubUser:
+	def __init__(self, user_id, name='soak'):
+		self.id = user_id
+		self.name = name
+		self.mention = '<@%d>' % user_id
+
+	def __str__(self):
+		return self.name
+
+class StubChannel:
+	def __init__(self, channel_id):
+		self.id = channel_id
+		self.sent = 0
+
+	async def send(self, content=None, embed=None):
+		self.sent += 1
+
+class StubContext:
+	"""Just enough of a commands.Context for the cog's commands: an author, channel and send()."""
+	def __init__(self, user_id, channel):
+		self.author = StubUser(user_id)
+		self.channel = channel
+		self.message = None
+
+	async def send(self, content=None, embed=None):
+		await self.channel.send(content, embed=embed)
+
+class StubBot:
+	"""Just enough of a commands.Bot for JstrisCog."""
+	def __init__(self):
+		self.command_prefix = ['d/']
+		self.user = StubUser(0, 'DetsBot')
+		self.channels = {}
+
+	def get_channel(self, channel_id):
+		return self.channels.get(channel_id)
+
+	async def change_presence(self, activity=None):
+		pass
+
+class SyntheticGame(GameInterface):
+	"""A lobby whose matches are synthetic games, one finishing every <interval> seconds."""
+	def __init__(self, games, interval):
+		self.games = games
+		self.interval = interval
+		self.state = GameState.STOPPED
+		self.quit_flag = False
+		self.forecaster = None
+
+	async def create_game(self, live=False, allowed_names=None):
+		self.state = GameState.CREATED
+		return self.get_join_link()
+
+	async def resume_game(self):
+		return None
+
+	def get_join_link(self):
+		return None if self.state == GameState.STOPPED else 'synthetic'
+
+	async def watch_and_get_results(self):
+		self.state = GameState.WATCHING
+		for game in self.games:
+			await asyncio.sleep(self.interval)
+			if self.quit_flag:
+				break
+			yield (None, [{'id': i, 'name': name, 'score': score}
+			              for (i, (name, score)) in enumerate(game)])
+		self.state = GameState.STOPPED
+
+	async def quit(self):
+		self.quit_flag = True
+
+	async def force_quit(self):
+		self.quit_flag = True
+
+	async def get_player_names(self):
+		return []
+
+	def set_forecaster(self, forecaster):
+		self.forecaster = forecaster
+
+	def get_state(self):
+		return self.state
+
+def seed_database(database, num_players, num_games, seed=0):
+	"""Rate synthetic games into the database. Returns the players' names and unplayed games."""
+	(true_ratings, games) = generate_games(num_players, 2 * num_games, seed=seed)
+	model = JstrisModel(SyntheticGame([], 0), database)
+	with contextlib.redirect_stdout(io.StringIO()):
+		for game in games[:num_games]:
+			model._process_game_results([{'name': name, 'score': score} for (name, score) in game])
+	return (list(true_ratings), games[num_games:])
+
+def get_commands(cog, names, num_pages):
+	"""Returns a list of (label, function returning a command's coroutine, given a context)."""
+	return [('leaderboard', lambda ctx: cog.leaderboard.callback(
+	             cog, ctx, random.randint(1, num_pages))),
+	        ('player', lambda ctx: cog.player.callback(cog, ctx, random.choice(names))),
+	        ('simulate', lambda ctx: cog.simulate.callback(cog, ctx, *random.sample(names, 2)))]
+
+async def run_caller(caller_id, commands, channel, deadline, latencies):
+	"""Call random commands back to back until the deadline, recording each one's latency."""
+	ctx = StubContext(caller_id, channel)
+	while time.monotonic() < deadline:
+		(label, command) = random.choice(commands)
+		start = time.perf_counter()
+		await command(ctx)
+		latencies[label].append(time.perf_counter() - start)
+		# Let the other callers (and the match stream) in between commands, like a real user would
+		await asyncio.sleep(0)
+
+async def measure_lag(deadline, lags):
+	"""Sample how late the event loop is to wake up from a short sleep."""
+	while time.monotonic() < deadline:
+		start = time.perf_counter()
+		await asyncio.sleep(LAG_INTERVAL)
+		lags.append(time.perf_counter() - start - LAG_INTERVAL)
+
+async def run_matches(model, deadline):
+	"""Process the simulated match stream until the deadline. Returns the number of games."""
+	await model.watch_lobby()
+	games = 0
+	async for _ in model.run_matches():
+		games += 1
+		if time.monotonic() >= deadline:
+			await model.quit_watching()
+	return games
+
+async def soak(database, names, games, concurrency, seconds, match_interval):
+	"""
+	Run the soak. Returns (latencies, lags, games processed, commands sent), where latencies is a
+	dict of command label -> list of seconds.
+	"""
+	model = JstrisModel(SyntheticGame(games, match_interval), database)
+	cog = JstrisCog(StubBot(), model)
+	(_, num_pages) = model.get_leaderboard(1, 15)
+	commands = get_commands(cog, names, num_pages)
+	channel = StubChannel(1)
+	latencies = {label: [] for (label, _) in commands}
+	lags = []
+
+	deadline = time.monotonic() + seconds
+	tasks = [run_caller(caller_id, commands, channel, deadline, latencies)
+	         for caller_id in range(1, concurrency + 1)]
+	tasks.append(measure_lag(deadline, lags))
+	if match_interval > 0:
+		tasks.append(run_matches(model, deadline))
+	results = await asyncio.gather(*tasks)
+	games_processed = results[-1] if match_interval > 0 else 0
+	return (latencies, lags, games_processed, channel.sent)
+
+def _percentiles_ms(samples):
+	if len(samples) == 0:
+		return (0.0, 0.0, 0.0, 0.0)
+	(p50, p95, p99) = np.percentile(samples, [50, 95, 99]) * 1000
+	return (p50, p95, p99, max(samples) * 1000)
+
+def print_report(latencies, lags, games, sent, seconds):
+	print('%-12s %8s %9s %9s %9s %9s' % ('command', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+	for (label, samples) in latencies.items():
+		print('%-12s %8d %9.2f %9.2f %9.2f %9.2f' % (label, len(samples), *_percentiles_ms(samples)))
+	print('%-12s %8d %9.2f %9.2f %9.2f %9.2f' % ('loop lag', len(lags), *_percentiles_ms(lags)))
+	print('%d messages sent (%.0f/s), %d games processed' % (sent, sent / seconds, games))
+
+def main():
+	"""Run the soak."""
+	concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+	num_players = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+	match_interval = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+	database = SQLiteDatabase(sys.argv[5], profile=True) if len(sys.argv) > 5 else MemoryDatabase()
+
+	random.seed(0)
+	start = time.perf_counter()
+	(names, games) = seed_database(database, num_players, 4 * num_players)
+	print('Seeded %d players in %.1fs' % (database.count_players(), time.perf_counter() - start))
+	if isinstance(database, SQLiteDatabase):
+		# Only profile the soak itself
+		database.profiler.reset()
+	print('%d callers for %.0fs, %s' % (concurrency, seconds, 'a game every %.2fs' % match_interval
+	                                   if match_interval > 0 else 'no matches'))
+
+	# The rating engine prints every game's rating changes
+	with contextlib.redirect_stdout(io.StringIO()):
+		results = asyncio.run(soak(database, names, games, concurrency, seconds, match_interval))
+	print_report(*results, seconds)
+	report = database.get_profile_report()
+	if report is not None:
+		print()
+		print(report)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,194 @@
+#! /usr/bin/env python3
+"""Sweeps Elo's parameters over the game history, in parallel, ranking them by predictive accuracy.
+
+Usage: python -m tools.sweep [players.db | results_log_dir] [processes] [top]
+
+Every combination in GRID (the rating difference clamp, the players' k-factor, and the power of the
+1 / (n - 1) k multiplier) replays the whole game history from scratch, predicting every matchup in
+a game before rating it. d stays fixed: scaling d, k and the clamp together only rescales every
+rating, so it predicts exactly the same, and other values of d are covered by the k and clamp grid.
+
+Each setting is scored on log-loss, expected calibration error (the average gap between predicted
+and observed win rates, over PROBABILITY_BINS bins) and accuracy. The history is written once to
+.npy files, which each worker process memory-maps read-only. With no history given, synthetic games
+are used.
+"""
+
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from entities import Elo, Player
+from game.results_log import parse_game_results, read_results_log
+from tools.synthetic import generate_games
+
+GRID = {
+	'd': [400],
+	'max_diff': [200, 400, 800, 1600, float('inf')],
+	'k': [8, 12, 16, 24, 32, 48, 64, 96, 128],
+	'k_mult_power': [0.5, 0.75, 1.0],
+}
+
+# The settings currently in use, marked in the report
+CURRENT = {'d': 400, 'max_diff': 400, 'k': 32, 'k_mult_power': 1.0}
+
+# The first games are predicted from mostly unrated players, whatever the settings, so aren't scored
+BURN_IN_FRACTION = 0.1
+
+PROBABILITY_BINS = 10
+
+LOG_FILES = ('players', 'scores', 'offsets')
+
+# The game log, memory-mapped read-only in each worker process
+_log = None
+
+def load_games(source=None):
+	"""Returns the game history as a list of [(name, score), ...], oldest first."""
+	if source is None:
+		(_, games) = generate_games(1000, 20000)
+		return games
+	if os.path.isdir(source):
+		games = []
+		for record in read_results_log(source):
+			results = parse_game_results(record['results'], record['clients'], record['players'],
+			                             record['allowed_names'])
+			games.append([(result['name'], result['score']) for result in results])
+		return games
+
+	# SQLite would create an empty database for a mistyped path
+	if not os.path.isfile(source):
+		raise FileNotFoundError('No players database or results log at %s' % source)
+	from db import SQLiteDatabase
+	with contextlib.redirect_stdout(io.StringIO()):
+		database = SQLiteDatabase(source)
+	return [[(name, score) for (name, score, _, _) in game.results]
+	        for game in database.export_games()]
+
+def write_log(games, directory):
+	"""
+	Write the games to .npy files in directory, as flat arrays of player ids and scores, and the
+	offset of each game's first result. Returns the number of players.
+	"""
+	ids = {}
+	players = []
+	scores = []
+	offsets = [0]
+	for game in games:
+		if len(game) < 2:
+			continue
+		for (name, score) in game:
+			players.append(ids.setdefault(name.lower(), len(ids)))
+			scores.append(score)
+		offsets.append(len(players))
+	arrays = (np.array(players, dtype=np.int32), np.array(scores, dtype=np.float64),
+	          np.array(offsets, dtype=np.int64))
+	for (name, array) in zip(LOG_FILES, arrays):
+		np.save(os.path.join(directory, name + '.npy'), array)
+	return len(ids)
+
+def _open_log(directory, num_players):
+	global _log
+	_log = tuple(np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+	             for name in LOG_FILES) + (num_players,)
+
+def evaluate(settings):
+	"""
+	Replay the game log with the given settings (a dict with the keys of GRID), rating each matchup
+	as Elo.report_game does.
+
+	returns (settings, log_loss, calibration_error, accuracy, seconds taken)
+	"""
+	start = time.perf_counter()
+	(players, scores, offsets, num_players) = _log
+	# Games are small, so plain Python numbers are faster than NumPy calls per game
+	offsets = offsets.tolist()
+	elo = Elo(settings['d'], settings['max_diff'], settings['k_mult_power'])
+	ratings = [Player('').rating] * num_players
+
+	burn_in = int(BURN_IN_FRACTION * (len(offsets) - 1))
+	predictions = []
+	outcomes = []
+	for game in range(len(offsets) - 1):
+		ids = players[offsets[game]:offsets[game + 1]].tolist()
+		game_scores = scores[offsets[game]:offsets[game + 1]].tolist()
+		k = settings['k'] * elo.get_k_multiplier(len(ids))
+		deltas = [0.0] * len(ids)
+		for i in range(len(ids) - 1):
+			for j in range(i + 1, len(ids)):
+				prob = elo.estimate_score_vs_one(ratings[ids[i]], ratings[ids[j]])
+				actual = Elo.get_actual_score(game_scores[i], game_scores[j])
+				deltas[i] += k * (actual - prob)
+				deltas[j] -= k * (actual - prob)
+				if game >= burn_in:
+					predictions.append(prob)
+					outcomes.append(actual)
+		for (player_id, delta) in zip(ids, deltas):
+			ratings[player_id] += delta
+
+	return (settings,) + score_predictions(predictions, outcomes) + (time.perf_counter() - start,)
+
+def score_predictions(predictions, outcomes):
+	"""Returns (log_loss, calibration_error, accuracy) of the predicted scores of matchups."""
+	probs = np.clip(np.array(predictions), 1e-12, 1 - 1e-12)
+	actual = np.array(outcomes)
+	if len(probs) == 0:
+		return (0.0, 0.0, 0.0)
+	log_loss = -np.mean(actual * np.log(probs) + (1 - actual) * np.log(1 - probs))
+	decided = actual != 0.5
+	accuracy = np.mean((probs[decided] > 0.5) == (actual[decided] == 1)) if decided.any() else 0.0
+
+	# Bin from the favourite's side, so each matchup is counted once
+	favourite = probs >= 0.5
+	probs = np.where(favourite, probs, 1 - probs)
+	actual = np.where(favourite, actual, 1 - actual)
+	bins = np.minimum(((probs - 0.5) * 2 * PROBABILITY_BINS).astype(int), PROBABILITY_BINS - 1)
+	gaps = np.bincount(bins, probs, PROBABILITY_BINS) - np.bincount(bins, actual, PROBABILITY_BINS)
+	calibration_error = np.sum(np.abs(gaps)) / len(probs)
+	return (float(log_loss), float(calibration_error), float(accuracy))
+
+def get_grid():
+	"""Returns every combination of the settings in GRID, as a list of dicts."""
+	return [dict(zip(GRID, values)) for values in itertools.product(*GRID.values())]
+
+def sweep(games, processes=None):
+	"""Evaluate every setting in the grid over the games. Returns the results, best log-loss first."""
+	with tempfile.TemporaryDirectory() as directory:
+		num_players = write_log(games, directory)
+		with concurrent.futures.ProcessPoolExecutor(processes, initializer=_open_log,
+		                                            initargs=(directory, num_players)) as executor:
+			results = list(executor.map(evaluate, get_grid()))
+	return sorted(results, key=lambda result: result[1])
+
+def print_report(results, top):
+	print('%4s %5s %8s %4s %6s %9s %9s %9s' % ('rank', 'd', 'max_diff', 'k', 'k_pow', 'log-loss',
+	                                           'calib', 'accuracy'))
+	for (rank, (settings, log_loss, calibration_error, accuracy, _)) in enumerate(results, 1):
+		if rank > top and settings != CURRENT:
+			continue
+		print('%4d %5g %8g %4g %6g %9.5f %9.5f %8.2f%%%s' % (
+			rank, settings['d'], settings['max_diff'], settings['k'], settings['k_mult_power'],
+			log_loss, calibration_error, 100 * accuracy, '  (current)' if settings == CURRENT else ''))
+
+def main():
+	"""Run the sweep."""
+	source = sys.argv[1] if len(sys.argv) > 1 else None
+	processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+	top = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+	games = load_games(source)
+	print('%d games, %d settings' % (len(games), len(get_grid())))
+	start = time.perf_counter()
+	results = sweep(games, processes)
+	elapsed = time.perf_counter() - start
+	print('Swept in %.1fs (%.1fs of replays)' % (elapsed, sum(result[4] for result in results)))
+	print_report(results, top)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,30 @@
+#! /usr/bin/env python3
+"""Generates synthetic players and games, for benchmarks."""
+
+import numpy as np
+
+def generate_games(num_players=1000, num_games=10000, min_size=2, max_size=6, seed=0):
+	"""
+	Generate a log of games between players with hidden "true" skill ratings.
+
+	Finishing orders are drawn from the Elo model (Plackett-Luce) using the true ratings, and each
+	player's score is how long they lasted, like a jstris result.
+
+	returns (true_ratings, games), where true_ratings is a dict of name -> rating, and games is a
+	list of [(name, score), ...] lists
+	"""
+	rng = np.random.default_rng(seed)
+	names = ['player%d' % i for i in range(num_players)]
+	ratings = rng.normal(1000, 200, num_players)
+	log_strengths = ratings * np.log(10) / 400
+
+	games = []
+	for _ in range(num_games):
+		size = int(rng.integers(min_size, max_size + 1))
+		lobby = rng.choice(num_players, size, replace=False)
+		keys = log_strengths[lobby] + rng.gumbel(size=size)
+		scores = np.empty(size)
+		scores[np.argsort(-keys)] = np.arange(size, 0, -1) * 30.0
+		games.append([(names[idx], float(score)) for (idx, score) in zip(lobby, scores)])
+
+	return (dict(zip(names, ratings.tolist())), games)
@@ -10,26 +10,62 @@ import discord
 from discord.ext import commands
 from discord import Embed, Game
 
-from credentials import discord_creds
-
 logger = logging.getLogger('detsbot')
 
+# Players rated in the top X% get a badge, for the smallest X of these
+TOP_PERCENT_BADGES = [1, 5, 10, 25]
+
+# How often to try to form lobbies from the matchmaking queue, in seconds
+MATCHMAKING_INTERVAL = 5
+
+DISCORD_MESSAGE_LIMIT = 2000
+
 # Discord.py:     https://discordpy.readthedocs.io/en/latest/api.html
 # Discord.py ext: https://discordpy.readthedocs.io/en/latest/ext/commands/api.html
 
 class JstrisCog(commands.Cog):
-	"""Discord.py Cog, which implements the discord bot interface"""
-	def __init__(self, bot, model=None):
+	"""
+	Discord.py Cog, which implements the discord bot interface
+
+	model -- the JstrisModel, or None to connect first and set it with set_model() once it is ready
+		(commands wait for it until then)
+	"""
+	def __init__(self, bot, model=None, checkpoint=None):
 		self.bot = bot
 		self.model = model
+		self.model_ready = asyncio.Event()
+		if model is not None:
+			self.model_ready.set()
 		self.join_link = None
 		self.quit_flag = False
+		self.checkpoint = checkpoint
+		self.resumed = False
+		self.decay_task = None
+		self.matchmaking_task = None
+		# Kept, as the event loop only holds weak references to tasks
+		self.watch_tasks = set()
+
+	def set_model(self, model):
+		self.model = model
+		self.model_ready.set()
+
+	async def cog_before_invoke(self, ctx):
+		"""Hold commands sent while still starting up until the model is ready."""
+		await self.model_ready.wait()
 
 	##### Bot Events #######################################################
 	@commands.Cog.listener()
 	async def on_ready(self):
 		"""Bot event that gets called after initialization completes"""
 		await self.bot.change_presence(activity=Game(name='%sjstris' % self.bot.command_prefix[0]))
+		await self.model_ready.wait()
+		if self.decay_task is None and self.model is not None:
+			self.decay_task = asyncio.create_task(self.model.run_scheduled_decay())
+		if self.matchmaking_task is None and self.model is not None:
+			self.matchmaking_task = asyncio.create_task(self.run_matchmaking())
+		if not self.resumed:
+			self.resumed = True
+			await self.resume_lobby()
 
 	@commands.Cog.listener()
 	async def on_message(self, message):
@@ -75,7 +111,8 @@ class JstrisCog(commands.Cog):
 
 		async for game_result in self.model.run_matches():
 			try:
-				await ctx.send(embed=JstrisCog.make_game_result_embed(game_result))
+				await ctx.send(embed=JstrisCog.make_game_result_embed(
+					game_result, self.model.get_rating_distribution()))
 				# TODO: what do I do if the message is too long? >2000
 			except Exception as exc:
 				await self.model.quit_watching()
@@ -88,8 +125,24 @@ class JstrisCog(commands.Cog):
 				self.join_link = None
 				return
 
+	def player_not_found(self, name):
+		"""Returns a "not found" message for the player name, suggesting similar names."""
+		suggestions = self.model.search_players(name, 3)
+		if len(suggestions) == 0:
+			return 'Player `{}` not found!'.format(name)
+		return 'Player `{}` not found! Did you mean {}?'.format(
+			name, ', '.join('`{}`'.format(suggestion) for suggestion in suggestions))
+
+	@staticmethod
+	def top_percent_badge(top_percent):
+		"""Returns a " top X%" badge for a player in the top X% (or '' if not in the top 25%)."""
+		for badge in TOP_PERCENT_BADGES:
+			if top_percent <= badge:
+				return ' `top {}%`'.format(badge)
+		return ''
+
 	@staticmethod
-	def make_game_result_embed(game_result):
+	def make_game_result_embed(game_result, histogram=None):
 		res_strs = []
 		if game_result is None:
 			res_strs.append('No change recorded (need at least 2 registered players)')
@@ -108,7 +161,11 @@ class JstrisCog(commands.Cog):
 
 				if score == 0.0:
 					place = 'DQ'
-				res_strs.append('**{} - {}**: {:.2f} ({:+.2f})'.format(place, player.name, player.rating, delta))
+				badge = ''
+				if histogram is not None:
+					badge = JstrisCog.top_percent_badge(100 * histogram.get_top_fraction(player.rating))
+				res_strs.append('**{} - {}**: {:.2f} ({:+.2f}){}'.format(place, player.name, player.rating,
+				                                                         delta, badge))
 		return Embed(title='New Game Result', description='\n'.join(res_strs))
 
 	@commands.command(aliases=['tetris'])
@@ -127,30 +184,109 @@ class JstrisCog(commands.Cog):
 			await ctx.send('Creating a lobby')
 			self.join_link = await self.model.watch_lobby()
 			await ctx.send('Join link: <%s>' % self.join_link)
-
-			async for game_result in self.model.run_matches():
-				try:
-					await ctx.send(embed=JstrisCog.make_game_result_embed(game_result))
-					# TODO: what do I do if the message is too long? >2000
-				except Exception as exc:
-					await self.model.quit_watching()
-					self.join_link = None
-					raise exc
-
-				if self.quit_flag:
-					await ctx.send('Stopping watching')
-					await self.model.quit_watching()
-					self.join_link = None
-					return
-
-			await ctx.send('Stopping watching (not enough players)')
-			await self.model.quit_watching()
-			self.join_link = None
+			await self.watch_matches(ctx.channel)
 		except Exception as exc:
 			logger.exception(exc)
 			logger.error('d/jstris error:' + ''.join(traceback.format_tb(exc.__traceback__)))
 			raise exc
 
+	async def resume_lobby(self):
+		"""Reattaches to the lobby we were watching before a restart, if there was one."""
+		saved = self.checkpoint.load() if self.checkpoint is not None else {}
+		channel = self.bot.get_channel(saved.get('channel_id'))
+		if channel is None:
+			return
+
+		try:
+			self.join_link = await self.model.resume_lobby()
+			if self.join_link is None:
+				self.checkpoint.clear()
+				return
+			await channel.send('Reattached to the lobby after a restart: <%s>' % self.join_link)
+			await self.watch_matches(channel)
+		except Exception as exc:
+			logger.exception(exc)
+			logger.error('Resume error:' + ''.join(traceback.format_tb(exc.__traceback__)))
+
+	async def watch_matches(self, channel, session=None):
+		"""
+		Sends the result of each match in the lobby to the channel, until we stop watching.
+
+		session -- the game the lobby is in (by default, the model's main one)
+		"""
+		if self.checkpoint is not None and session in (None, self.model.jstris):
+			self.checkpoint.save({'channel_id': channel.id})
+
+		async for game_result in self.model.run_matches(session):
+			try:
+				await channel.send(embed=JstrisCog.make_game_result_embed(
+					game_result, self.model.get_rating_distribution()))
+				# TODO: what do I do if the message is too long? >2000
+			except Exception as exc:
+				await self.model.quit_watching(session)
+				self._stop_watching(session)
+				raise exc
+
+			if self.quit_flag:
+				await channel.send('Stopping watching')
+				await self.model.quit_watching(session)
+				self._stop_watching(session)
+				return
+
+		await channel.send('Stopping watching (not enough players)')
+		await self.model.quit_watching(session)
+		self._stop_watching(session)
+
+	async def run_matchmaking(self):
+		"""Forever: forms lobbies from the matchmaking queue, and tells their players where to go."""
+		while True:
+			await asyncio.sleep(MATCHMAKING_INTERVAL)
+			try:
+				for (group, session, join_link) in await self.model.start_matched_lobbies():
+					if session is self.model.jstris:
+						self.join_link = join_link
+					mentions = ' '.join('<@{}> (`{}`)'.format(entry.data['user_id'], entry.player.name)
+					                    for entry in group)
+					# Players may have queued from different channels: tell each of them
+					channels = []
+					for channel_id in dict.fromkeys(entry.data['channel_id'] for entry in group):
+						try:
+							channel = await self._get_channel(channel_id)
+							await channel.send('Lobby ready for {}: <{}>'.format(mentions, join_link))
+							channels.append(channel)
+						except Exception as exc:
+							logger.exception(exc)
+					if not channels:
+						logger.error('No channel to report the lobby at %s in', join_link)
+						await self.model.abandon_lobby(session)
+						continue
+					task = asyncio.create_task(self.watch_matches(channels[0], session))
+					self.watch_tasks.add(task)
+					task.add_done_callback(self._watch_task_done)
+			except Exception as exc:
+				logger.exception(exc)
+
+	async def _get_channel(self, channel_id):
+		"""Returns the channel, fetching it if it isn't cached (e.g. just after connecting)."""
+		channel = self.bot.get_channel(channel_id)
+		if channel is None:
+			channel = await self.bot.fetch_channel(channel_id)
+		return channel
+
+	def _watch_task_done(self, task):
+		"""Forget a finished watch_matches task, logging why it failed (if it did)."""
+		self.watch_tasks.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			logger.error('Watching a matchmade lobby failed', exc_info=task.exception())
+
+	def _stop_watching(self, session=None):
+		"""Forget the lobby, if session is the main one (other lobbies aren't checkpointed)."""
+		if session not in (None, self.model.jstris):
+			return
+		self.join_link = None
+		if self.checkpoint is not None:
+			self.checkpoint.clear()
+
 	@commands.command()
 	async def leaderboard(self, ctx, page: int = 1):
 		"""Displays the top rated players."""
@@ -166,17 +302,85 @@ class JstrisCog(commands.Cog):
 			embed.set_footer(text='Page {} / {}'.format(page, num_pages))
 			await ctx.send(embed=embed)
 
+	@commands.command()
+	async def season(self, ctx, season: str, page: int = 1):
+		"""Displays the final standings of a past season."""
+		page_size = 15
+		standings = self.model.get_season_standings(season, page, page_size)
+
+		if len(standings) == 0 or page <= 0:
+			await ctx.send('No standings for season `{}` on page {}'.format(season, page))
+		else:
+			desc = '\n'.join('**#{} - {}** ({:.2f}, {} games)'.format(i + 1 + page_size*(page - 1), *row)
+			                 for (i, row) in enumerate(standings))
+			embed = Embed(title='Season {} Standings'.format(season), description=desc)
+			embed.set_footer(text='Page {}'.format(page))
+			await ctx.send(embed=embed)
+
 	@commands.command()
 	async def player(self, ctx, name: str):
 		"""Shows info about the given player (jstris name)."""
 		result = self.model.get_player_ranking(name)
 		if result is None:
-			await ctx.send('Player `{}` not found!'.format(name))
+			await ctx.send(self.player_not_found(name))
 			return
 
 		(player, ranking) = result
-		await ctx.send('Player `{}` with rating `{:.2f}` is \\#{} on the leaderboard!'.format(
-			player.name, player.rating, ranking))
+		message = 'Player `{}` with rating `{:.2f}` is \\#{} on the leaderboard (top `{:.1f}%`)!'.format(
+			player.name, player.rating, ranking, self.model.get_top_percent(player.rating))
+
+		stats = self.model.get_player_stats(player.name)
+		if stats is not None:
+			streak = '{} {}'.format(abs(stats.streak), 'wins' if stats.streak > 0 else 'games without a win')
+			message += '\nGames: `{}`, win rate: `{:.1%}`, average place: `{:.2f}`, peak rating: ' \
+				'`{:.2f}`, streak: `{}` (best: `{}` wins)'.format(
+					stats.games_played, stats.get_win_rate(), stats.get_average_placement(),
+					stats.peak_rating, streak, stats.best_streak)
+		await ctx.send(message)
+
+	@commands.group(invoke_without_command=True)
+	async def queue(self, ctx):
+		"""Shows the matchmaking queue. Use `queue join <name>` or `queue leave <name>` to queue."""
+		(depth, waits) = self.model.get_queue_status()
+		message = '`{}` players queued for matchmaking.'.format(depth)
+		if waits is not None:
+			message += ' Recent waits: median `{:.0f}s`, p90 `{:.0f}s`, p99 `{:.0f}s`.'.format(
+				waits[50], waits[90], waits[99])
+		await ctx.send(message)
+
+	@queue.command('join')
+	async def queue_join(self, ctx, name: str):
+		"""Queues the player (jstris name) to be matched with players of similar rating."""
+		data = {'channel_id': ctx.channel.id, 'user_id': ctx.author.id}
+		if self.model.join_queue(name, data):
+			await ctx.send('Queued `{}`, you will be mentioned when a lobby is ready'.format(name))
+		else:
+			await ctx.send('`{}` is already queued'.format(name))
+
+	@queue.command('leave')
+	async def queue_leave(self, ctx, name: str):
+		"""Removes the player (jstris name) from the matchmaking queue."""
+		if self.model.leave_queue(name):
+			await ctx.send('Removed `{}` from the queue'.format(name))
+		else:
+			await ctx.send('`{}` is not queued'.format(name))
+
+	@commands.command()
+	async def distribution(self, ctx, width: int = 100):
+		"""Displays how many players have each rating, in buckets <width> wide (at least 50)."""
+		histogram = self.model.get_rating_distribution()
+		buckets = histogram.get_buckets(max(width, 50))
+		if len(buckets) == 0:
+			await ctx.send('No players yet!')
+			return
+
+		most = max(count for (_, _, count) in buckets)
+		desc = '\n'.join('`{:>5} - {:<5}` {} {}'.format(low, high - 1, '█' * int(round(20 * count / most)),
+		                                                count)
+		                 for (low, high, count) in buckets)
+		embed = Embed(title='Rating Distribution', description=desc)
+		embed.set_footer(text='{} players'.format(histogram.total))
+		await ctx.send(embed=embed)
 
 	@commands.command()
 	async def simulate(self, ctx, player1: str, player2: str):
@@ -186,9 +390,9 @@ class JstrisCog(commands.Cog):
 
 		messages = []
 		if p1_player is None:
-			messages.append('Player `{}` not found!'.format(player1))
+			messages.append(self.player_not_found(player1))
 		if p2_player is None:
-			messages.append('Player `{}` not found!'.format(player2))
+			messages.append(self.player_not_found(player2))
 
 		if len(messages) == 0:
 			p1_winrate = self.model.simulate_1v1(p1_player, p2_player)
@@ -199,10 +403,97 @@ class JstrisCog(commands.Cog):
 
 		await ctx.send('\n'.join(messages))
 
+	@commands.command()
+	async def h2h(self, ctx, player1: str, player2: str):
+		"""Displays the head-to-head record between two players."""
+		record = self.model.get_head_to_head(player1, player2)
+		if record is None:
+			await ctx.send('`{}` and `{}` have not played each other yet'.format(player1, player2))
+			return
+
+		await ctx.send('`{0.player}` vs `{0.opponent}`: {0.wins} wins, {0.losses} losses, {0.draws} draws '
+		               '({1} games)'.format(record, record.get_games_played()))
+
+	@commands.command()
+	async def rivals(self, ctx, name: str):
+		"""Displays the player's records against the opponents they have played most."""
+		records = self.model.get_rivals(name, 5)
+		if len(records) == 0:
+			await ctx.send('`{}` has not played anyone yet'.format(name))
+			return
+
+		lines = ['{0.opponent:16.16} {0.wins:4d}W {0.losses:4d}L {0.draws:4d}D'.format(record)
+		         for record in records]
+		await ctx.send('Top rivals of `{}`:```\n{}```'.format(records[0].player, '\n'.join(lines)))
+
+	@commands.command()
+	async def search(self, ctx, fragment: str):
+		"""Searches for players whose names are similar to the given fragment."""
+		names = self.model.search_players(fragment, 10)
+		if len(names) == 0:
+			await ctx.send('No players found matching `{}`'.format(fragment))
+		else:
+			await ctx.send('Players matching `{}`:\n{}'.format(
+				fragment, '\n'.join('`{}`'.format(name) for name in names)))
+
+	@commands.command()
+	async def forecast(self, ctx, *names: str):
+		"""Displays the predicted results for the given players (or the players in the lobby)."""
+		if len(names) == 0:
+			names = await self.model.get_lobby_player_names()
+
+		(players, missing_names, forecast) = self.model.forecast(list(names))
+
+		messages = [self.player_not_found(name) for name in missing_names]
+		if forecast is None:
+			messages.append('Need at least two registered players to forecast a game')
+		else:
+			(win_matrix, expected_scores, place_deltas) = forecast
+			lines = []
+			for (i, player) in enumerate(players):
+				lines.append('{0.name:16} ({0.rating:7.2f}) expected to beat {1:5.2f} / {2:d}'.format(
+					player, expected_scores[i], len(players) - 1))
+				lines.append('    by place: ' + ' '.join('{:+.1f}'.format(d) for d in place_deltas[i]))
+			lines.append('')
+			lines.append('Win rates (row vs column):')
+			lines.append(' ' * 17 + ' '.join('{:>6.6}'.format(p.name) for p in players))
+			for (i, player) in enumerate(players):
+				lines.append('{:16.16} '.format(player.name) + ' '.join(
+					'  ----' if i == j else '{:6.1%}'.format(win_matrix[i][j]) for j in range(len(players))))
+			messages.append('According to the mathematical model:```\n{}```'.format('\n'.join(lines)))
+
+		await ctx.send('\n'.join(messages))
+
+	@commands.command()
+	async def odds(self, ctx, *names: str):
+		"""Displays each player's chance of finishing in each place (or for the players in the lobby)."""
+		if len(names) == 0:
+			names = await self.model.get_lobby_player_names()
+
+		(players, missing_names, simulation) = await self.model.simulate_placements(list(names))
+
+		messages = [self.player_not_found(name) for name in missing_names]
+		if simulation is None:
+			messages.append('Need at least two registered players to simulate a game')
+		else:
+			(place_probs, expected_deltas, samples_drawn) = simulation
+			lines = [' ' * 17 + ' '.join('{:>6}'.format('#' + str(p + 1)) for p in range(len(players)))
+			         + '  rating']
+			for (i, player) in enumerate(players):
+				lines.append('{:16.16} '.format(player.name)
+				             + ' '.join('{:6.1%}'.format(prob) for prob in place_probs[i])
+				             + '  {:+6.2f}'.format(expected_deltas[i]))
+			messages.append('Out of {:,} simulated games:```\n{}```'.format(samples_drawn, '\n'.join(lines)))
+
+		await ctx.send('\n'.join(messages))
+
 	@commands.command()
 	@commands.is_owner()
 	async def reset_player(self, ctx, player: str):
 		"""Resets the given player."""
+		if self.model.get_player(player) is None:
+			await ctx.send(self.player_not_found(player))
+			return
 		self.model.reset_player(player)
 		await ctx.send('Done')
 
@@ -213,7 +504,54 @@ class JstrisCog(commands.Cog):
 		if self.model.set_player_rating(player, rating):
 			await ctx.send('Done')
 		else:
-			await ctx.send('Player `{}` not found!'.format(player))
+			await ctx.send(self.player_not_found(player))
+
+	@commands.command()
+	@commands.is_owner()
+	async def rebuild_stats(self, ctx):
+		"""Recomputes every player's stats from the game history."""
+		self.model.rebuild_player_stats()
+		await ctx.send('Done')
+
+	@commands.command()
+	@commands.is_owner()
+	async def new_season(self, ctx, season: str):
+		"""Archives the standings as the given season, and soft-resets every rating."""
+		await ctx.send('Archiving season `{}` and resetting ratings...'.format(season))
+		try:
+			if not await self.model.roll_over_season(season):
+				await ctx.send('Season `{}` was already rolled over'.format(season))
+				return
+		except ValueError as exc:
+			await ctx.send(str(exc))
+			return
+		await ctx.send('Done')
+
+	@commands.command()
+	@commands.is_owner()
+	async def decay(self, ctx):
+		"""Applies inactivity decay now, rather than waiting for the daily run."""
+		if not await self.model.decay_inactive_ratings():
+			await ctx.send('Decay is already running')
+			return
+		await ctx.send('Done')
+
+	@commands.command()
+	@commands.is_owner()
+	async def db_profile(self, ctx):
+		"""Shows where the database has spent its time (if the bot was started with --profile-db)."""
+		report = self.model.get_db_profile()
+		if report is None:
+			await ctx.send('Database profiling is off')
+			return
+		# Keep each message under Discord's 2000 character limit
+		message = ''
+		for line in report.split('\n'):
+			if len(message) + len(line) > DISCORD_MESSAGE_LIMIT - 10:
+				await ctx.send('```\n{}```'.format(message))
+				message = ''
+			message += line[:DISCORD_MESSAGE_LIMIT - 10] + '\n'
+		await ctx.send('```\n{}```'.format(message))
 
 	@commands.command()
 	@commands.is_owner()
@@ -241,12 +579,20 @@ class JstrisCog(commands.Cog):
 		ret = await eval(expr, globals(), locals())
 		await ctx.send(str(ret))
 
-async def start_bot(model=None):
-	"""Starts up the DetsBot discord bot"""
+async def start_bot(model=None, checkpoint=None):
+	"""
+	Starts up the DetsBot discord bot
+
+	model -- the JstrisModel, or None to start connecting before it is ready, and give it to the
+		JstrisCog (bot.get_cog('JstrisCog').set_model) later
+	checkpoint -- a Checkpoint to save the channel watching a lobby in, to resume after a restart
+	"""
+	from credentials import discord_creds
+
 	cmd_prefix = 'd/'
 	detsbot = commands.Bot(command_prefix=[cmd_prefix], description='Detectives\' Jstris Bot')
 
-	detsbot.add_cog(JstrisCog(detsbot, model))
+	detsbot.add_cog(JstrisCog(detsbot, model, checkpoint))
 	#await detsbot.run(discord_creds['token'])
 	task = asyncio.create_task(detsbot.start(discord_creds['token']))
 	return (detsbot, task)